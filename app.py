@@ -1,15 +1,17 @@
 from flask import Flask, render_template, redirect, url_for
-from flask_login import LoginManager, current_user
+from flask_login import LoginManager, current_user, login_required
 from flask_socketio import SocketIO
 from flask_cors import CORS
 from models import db
-from models.user import User
 from sqlalchemy import text
+import importlib
+import json
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import sys
 import time
+from operator import attrgetter
 from werkzeug.serving import run_simple
 from secure_config import get_secret_key, create_env_example
 from datetime import timedelta
@@ -50,6 +52,12 @@ from routes.commuter import commuter_bp
 # Import event handlers
 import events_optimized
 
+# Route headways are fed by a flush listener on vehicle positions, registered on import
+import headways  # noqa: F401  imported only to register the listener
+
+# Cached principals are dropped by a flush listener on users, registered on import
+import user_cache
+
 # Create Flask app
 app = Flask(__name__)
 app.config.from_object('db_config')
@@ -128,7 +136,8 @@ login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from the principal cache; the User row is only loaded when needed
+    return user_cache.load_cached_user(user_id)
 
 # Disable automatic context processor to avoid database queries on public pages
 login_manager._context_processor = None
@@ -143,16 +152,20 @@ def inject_user():
         return {}  # Return empty context for public pages
     return dict(current_user=current_user)
 
-# Initialize Socket.IO with threading mode for Python 3.13 compatibility
-import os
-async_mode = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+# Initialize Socket.IO; SOCKETIO_ASYNC_MODE selects threading (default) or an
+# evented mode (gevent/eventlet), see async_server.py
+import async_server
+async_mode = async_server.ASYNC_MODE
+if async_server.is_evented(async_mode) and not async_server.is_patched(async_mode):
+    logger.warning(f"SOCKETIO_ASYNC_MODE={async_mode} but the standard library is not monkey-patched; "
+                   f"start through wsgi.py or gunicorn --config gunicorn_conf.py")
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
 
 # Register Socket.IO event handlers
 @socketio.on('connect')
 def handle_connect(auth=None):
-    # Accept auth parameter but don't use it
-    events_optimized.handle_connect()
+    # auth may ask for compact payloads: {'payload_mode': 'msgpack'}
+    events_optimized.handle_connect(auth)
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -162,9 +175,28 @@ def handle_disconnect():
 def handle_location_event(data):
     events_optimized.handle_location_update(data)
 
+@socketio.on('location_batch')
+def handle_location_batch(data):
+    # Returned dict is the client's acknowledgement
+    return events_optimized.handle_location_batch(data)
+
 @socketio.on('request_vehicle_positions')
-def handle_request_vehicle_positions():
-    events_optimized.handle_request_vehicle_positions()
+def handle_request_vehicle_positions(data=None):
+    events_optimized.handle_request_vehicle_positions(data)
+
+@socketio.on('subscribe_routes')
+def handle_subscribe_routes(data=None):
+    events_optimized.handle_subscribe_routes(data)
+
+@socketio.on('subscribe_stops')
+def handle_subscribe_stops(data=None):
+    events_optimized.handle_subscribe_stops(data)
+
+@socketio.on('commuter_location')
+def handle_commuter_location(data):
+    # Only queues the fix; storing it and proximity notifications run on the notification worker
+    import events
+    events.handle_commuter_location(data)
 
 @socketio.on('join_vehicle_room')
 def handle_join_vehicle_room(data):
@@ -213,6 +245,31 @@ def db_ping():
         # Return 200 with error info instead of 500 to avoid breaking the app
         return {'ok': False, 'error': str(e), 'took_ms': took_ms, 'status': 'database_unavailable'}, 200
 
+# Counters exposed by /stats: response key -> (module, dotted path of the stats callable).
+# Modules are imported on first request so the endpoint adds nothing to startup.
+STATS_SOURCES = {
+    'caches': ('caching', 'cache_stats'),
+    'liveness': ('liveness', 'tracker.stats'),
+    'location_dedup': ('location_dedup', 'fixes.stats'),
+    'rate_limits': ('rate_limit', 'stats'),
+    'stops': ('geofences', 'tracker.stats'),
+    'dashboard': ('dashboard_aggregates', 'aggregates.stats'),
+    'broadcasts': ('events_optimized', 'vehicle_broadcasts.stats'),
+    'notifications': ('notification_pipeline', 'pipeline.stats'),
+}
+
+@app.route('/stats')
+@login_required
+def stats_endpoint():
+    """Performance counters of every module in STATS_SOURCES, for operators and admins"""
+    if current_user.user_type not in ('admin', 'operator'):
+        return {'error': 'Access denied'}, 403
+    stats = {}
+    for key, (module_name, path) in STATS_SOURCES.items():
+        stats[key] = attrgetter(path)(importlib.import_module(module_name))()
+    stats['timestamp'] = time.time()
+    return stats, 200
+
 # Root route - PUBLIC PAGE (no authentication required)
 @app.route('/')
 def index():
@@ -291,7 +348,9 @@ with app.app_context():
                     logger.info("Database exists with data, skipping table creation to preserve data")
                     
                     # Verify all required tables exist
-                    required_tables = ['users', 'vehicles', 'location_logs', 'notifications', 'notification_settings']
+                    required_tables = ['users', 'vehicles', 'location_logs', 'notifications', 'notification_settings',
+                                       'stops', 'stop_visits', 'ridership_rollups', 'trip_passenger_totals',
+                                       'trip_metrics']
                     missing_tables = [table for table in required_tables if table not in existing_tables]
                     
                     if missing_tables:
@@ -307,6 +366,20 @@ with app.app_context():
                 table_names = inspector.get_table_names()
                 logger.info(f"Final tables: {table_names}")
                 
+                # Auto-migrate: ridership rollups are only maintained for new writes, load the history once
+                if 'ridership_rollups' in table_names and 'trips' in table_names:
+                    try:
+                        from models.ridership import RidershipRollup
+                        from models.user import Trip
+                        if RidershipRollup.query.first() is None and Trip.query.first() is not None:
+                            import ridership
+                            logger.info("Ridership rollups are empty, backfilling from trips...")
+                            rollups, trips = ridership.rebuild()
+                            logger.info(f"✓ Rebuilt {rollups} ridership rollup rows for {trips} trips")
+                    except Exception as migration_error:
+                        logger.warning(f"Could not backfill ridership rollups: {migration_error}")
+                        db.session.rollback()
+                
                 # Check if vehicles table exists
                 if 'vehicles' in table_names:
                     # Ensure required columns exist in vehicles table
@@ -323,7 +396,29 @@ with app.app_context():
                             logger.warning(f"Column {col} is missing!")
                     
                     logger.info("Column check completed")
-                    
+
+                    # Auto-migrate: seats moved from route_info JSON to the seat_mask column
+                    if 'seat_mask' not in vehicle_columns:
+                        logger.info("Adding seat_mask column to vehicles table...")
+                        try:
+                            from models.vehicle import seats_from_list
+                            db.session.execute(text("ALTER TABLE vehicles ADD COLUMN seat_mask SMALLINT NOT NULL DEFAULT 0"))
+                            rows = db.session.execute(text(
+                                "SELECT id, route_info FROM vehicles WHERE route_info LIKE '%seat_status%'")).fetchall()
+                            for vehicle_id, route_info in rows:
+                                try:
+                                    route_data = json.loads(route_info) if isinstance(route_info, str) else route_info
+                                    seats = route_data.pop('seat_status')
+                                except (ValueError, TypeError, AttributeError, KeyError):
+                                    continue
+                                db.session.execute(text("UPDATE vehicles SET seat_mask = :mask, route_info = :route_info WHERE id = :id"),
+                                                   {'mask': seats_from_list(seats), 'route_info': json.dumps(route_data), 'id': vehicle_id})
+                            db.session.commit()
+                            logger.info(f"✓ seat_mask column added, {len(rows)} seat maps migrated")
+                        except Exception as migration_error:
+                            logger.warning(f"Could not add seat_mask column (may already exist): {migration_error}")
+                            db.session.rollback()
+
                     # Verify all columns are present
                     vehicle_columns = [column['name'] for column in inspector.get_columns('vehicles')]
                     logger.info(f"VERIFICATION - Vehicle columns after setup: {vehicle_columns}")
@@ -0,0 +1,73 @@
+"""
+Server concurrency mode selection
+
+SOCKETIO_ASYNC_MODE picks how the server handles connections:
+
+- threading (default): gunicorn gthread worker. Each HTTP request, SSE
+  stream or long-polling Socket.IO client holds an OS thread, so
+  concurrency is capped by --threads.
+- gevent / eventlet: evented worker. Connections are greenlets, so one
+  worker can hold thousands of idle sockets and streams.
+
+Evented modes need the standard library monkey-patched before anything
+else imports socket, ssl or threading. The gunicorn gevent/eventlet
+workers patch on startup; wsgi.py calls monkey_patch() first thing for
+direct runs. Database access stays cooperative after patching: pg8000 is
+pure Python, so its socket I/O yields to other greenlets, and SQLAlchemy's
+pool waits on patched locks. SQLite calls are C and block the loop, so use
+evented mode with PostgreSQL.
+"""
+import os
+
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading').strip().lower()
+EVENTED_MODES = ('gevent', 'eventlet')
+
+# Gunicorn worker class for each mode
+WORKER_CLASSES = {
+    'threading': 'gthread',
+    'gevent': 'gevent',
+    'eventlet': 'eventlet',
+}
+
+
+def is_evented(mode=None):
+    return (mode or ASYNC_MODE) in EVENTED_MODES
+
+
+def monkey_patch(mode=None):
+    """Patch the standard library for an evented mode. Must run before other imports.
+
+    Returns True if the process is (now) patched, False in threading mode.
+    """
+    mode = mode or ASYNC_MODE
+    if mode == 'gevent':
+        from gevent import monkey
+        if not monkey.is_module_patched('socket'):
+            monkey.patch_all()
+        return True
+    if mode == 'eventlet':
+        import eventlet
+        import eventlet.patcher
+        if not eventlet.patcher.is_monkey_patched('socket'):
+            eventlet.monkey_patch()
+        return True
+    return False
+
+
+def is_patched(mode=None):
+    """Whether sockets are cooperative for the given evented mode."""
+    mode = mode or ASYNC_MODE
+    try:
+        if mode == 'gevent':
+            from gevent import monkey
+            return monkey.is_module_patched('socket')
+        if mode == 'eventlet':
+            import eventlet.patcher
+            return eventlet.patcher.is_monkey_patched('socket')
+    except ImportError:
+        return False
+    return False
+
+
+def worker_class(mode=None):
+    return WORKER_CLASSES.get(mode or ASYNC_MODE, 'gthread')
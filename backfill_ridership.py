@@ -0,0 +1,18 @@
+"""
+Ridership Rollup Backfill Script
+Rebuilds the hourly/daily ridership rollups and per-trip passenger totals
+from the raw trips and passenger events. App startup does this
+automatically while the rollups are empty; run it after editing
+trips/passenger events by hand.
+"""
+from app import app, db
+import ridership
+
+def backfill_ridership():
+    with app.app_context():
+        db.create_all()  # Creates the rollup tables if they don't exist yet
+        rollups, trips = ridership.rebuild()
+        print(f"✅ Rebuilt {rollups} ridership rollup rows and passenger totals for {trips} trips.")
+
+if __name__ == "__main__":
+    backfill_ridership()
@@ -0,0 +1,101 @@
+"""
+Request-scoped batched loading (DataLoader style)
+
+Routes that render a list and look something up for every row used to run
+one query per row. A BatchLoader turns those lookups into one IN query:
+keys are collected with want(), the first load() resolves every pending
+key (plus its own) in a single fetch, and results are memoized on flask.g
+for the rest of the request, so asking again costs nothing.
+
+fetch(keys) returns {key: value}; missing keys get the loader's default.
+Loaders with many=True group the fetched rows into lists per key.
+"""
+from flask import g, has_app_context
+
+from models import db
+from models.ridership import TripPassengerTotal
+from models.user import DriverActionLog, User
+from models.vehicle import Vehicle
+
+MAX_IN = 500  # Keys per IN query
+
+
+class BatchLoader:
+    def __init__(self, name, fetch, many=False):
+        self.name = name
+        self.fetch = fetch
+        self.many = many
+
+    def _state(self):
+        # (memo, pending keys) for this request; a fresh one outside requests
+        if not has_app_context():
+            return {}, set()
+        loaders = g.setdefault('_batch_loaders', {})
+        if self.name not in loaders:
+            loaders[self.name] = ({}, set())
+        return loaders[self.name]
+
+    def want(self, *keys):
+        """Queue keys for the next load without fetching yet."""
+        memo, pending = self._state()
+        pending.update(key for key in keys if key is not None and key not in memo)
+
+    def load_many(self, keys):
+        """{key: value} for keys, fetching everything pending in as few queries as possible."""
+        keys = [key for key in keys if key is not None]
+        memo, pending = self._state()
+        pending.update(key for key in keys if key not in memo)
+        if pending:
+            missing = list(pending)
+            pending.clear()
+            for start in range(0, len(missing), MAX_IN):
+                chunk = missing[start:start + MAX_IN]
+                found = self.fetch(chunk)
+                for key in chunk:
+                    memo[key] = found.get(key, [] if self.many else None)
+        return {key: memo[key] for key in keys}
+
+    def load(self, key):
+        if key is None:
+            return [] if self.many else None
+        return self.load_many([key])[key]
+
+
+def _group(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(key(row), []).append(row)
+    return grouped
+
+
+users = BatchLoader('users', lambda ids: {
+    user.id: user for user in User.query.filter(User.id.in_(ids)).all()
+})
+
+vehicles_by_driver = BatchLoader('vehicles_by_driver', lambda ids: _group(
+    Vehicle.query.filter(Vehicle.assigned_driver_id.in_(ids)).order_by(Vehicle.id).all(),
+    lambda vehicle: vehicle.assigned_driver_id
+), many=True)
+
+trip_passengers = BatchLoader('trip_passengers', lambda ids: {
+    total.trip_id: (total.boards, total.alights)
+    for total in TripPassengerTotal.query.filter(TripPassengerTotal.trip_id.in_(ids)).all()
+})
+
+
+RECENT_LOGS = 5
+
+
+def _recent_logs(driver_ids):
+    # Each driver's latest RECENT_LOGS action logs in one windowed query
+    ranked = db.session.query(
+        DriverActionLog.id,
+        db.func.row_number().over(partition_by=DriverActionLog.driver_id,
+                                  order_by=DriverActionLog.created_at.desc()).label('rank')
+    ).filter(DriverActionLog.driver_id.in_(driver_ids)).subquery()
+    logs = DriverActionLog.query.join(ranked, ranked.c.id == DriverActionLog.id) \
+        .filter(ranked.c.rank <= RECENT_LOGS).order_by(DriverActionLog.created_at.desc()).all()
+    return _group(logs, lambda log: log.driver_id)
+
+
+recent_logs = BatchLoader('recent_logs', _recent_logs, many=True)
@@ -0,0 +1,179 @@
+"""
+In-process broadcast hub for Server-Sent Events
+
+Each published event is encoded once into an SSE frame and the same bytes
+are handed to every subscriber. Subscribers have small bounded buffers; a
+client that falls too far behind is dropped rather than buffered without
+limit, and its EventSource reconnects with Last-Event-ID to resume from the
+hub's short history (or from a fresh snapshot if it is too far behind).
+
+Under gthread every open stream holds one worker thread, so streams are
+capped per process and closed after a fixed lifetime; EventSource
+reconnects transparently and resumes where it left off.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+
+def encode_event(event, data=None, body=None, event_id=None):
+    """Encode one SSE frame. Pass pre-encoded JSON bytes as body to skip re-encoding."""
+    if body is None:
+        body = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+    frame = b''
+    if event_id is not None:
+        frame += f"id: {event_id}\n".encode('utf-8')
+    # JSON bodies are single-line, so one data: field is enough
+    return frame + f"event: {event}\n".encode('utf-8') + b'data: ' + body + b'\n\n'
+
+
+HEARTBEAT_FRAME = b': heartbeat\n\n'
+
+
+class Subscription:
+    """One connected client: a bounded frame buffer plus a wake-up event."""
+
+    def __init__(self, hub, buffer_size):
+        self.hub = hub
+        self.buffer_size = buffer_size
+        self.frames = deque()
+        self.wake = threading.Event()
+        self.dropped = False
+        self.resumed = False
+        self.start_id = None
+
+    def push(self, frame):
+        # Caller holds the hub lock
+        if len(self.frames) >= self.buffer_size:
+            self.dropped = True
+        else:
+            self.frames.append(frame)
+        self.wake.set()
+
+    def stream(self, initial=(), heartbeat=15.0, max_duration=60.0, retry_ms=2000):
+        """Yield SSE bytes until the lifetime ends, the client is dropped or disconnects."""
+        deadline = time.time() + max_duration
+        try:
+            yield f"retry: {retry_ms}\n\n".encode('utf-8')
+            for frame in initial:
+                yield frame
+
+            while not self.dropped:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                if not self.wake.wait(min(heartbeat, remaining)):
+                    if heartbeat < remaining:
+                        yield HEARTBEAT_FRAME
+                    continue
+
+                with self.hub._lock:
+                    self.wake.clear()
+                    pending = list(self.frames)
+                    self.frames.clear()
+                for frame in pending:
+                    yield frame
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class BroadcastHub:
+    """Fan out pre-encoded events to many SSE subscribers."""
+
+    def __init__(self, name='broadcast-hub', buffer_size=32, history_size=256, max_subscribers=100,
+                 slots=None):
+        self.name = name
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        # Optional semaphore shared by several hubs to cap their streams together
+        self.slots = slots
+        # Event ids carry a per-process token so a Last-Event-ID from another
+        # worker or an earlier process is never mistaken for one of ours
+        self._token = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def last_event_id(self):
+        return f"{self._token}:{self._seq}"
+
+    def publish(self, event, data=None, body=None):
+        """Encode an event once and queue it for every subscriber."""
+        with self._lock:
+            self._seq += 1
+            frame = encode_event(event, data=data, body=body, event_id=f"{self._token}:{self._seq}")
+            self._history.append((self._seq, frame))
+            for subscription in self._subscribers:
+                was_dropped = subscription.dropped
+                subscription.push(frame)
+                if subscription.dropped and not was_dropped:
+                    self.dropped += 1
+            self.published += 1
+            return self._seq
+
+    def subscribe(self, last_event_id=None):
+        """Register a subscriber, or return None when the hub is full.
+
+        If last_event_id can be resumed from history the missed frames are
+        queued and subscription.resumed is True; otherwise the caller should
+        send a full snapshot first.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers or \
+                    (self.slots is not None and not self.slots.acquire(blocking=False)):
+                self.rejected += 1
+                return None
+
+            subscription = Subscription(self, self.buffer_size)
+            # Anything published after this id will reach the new subscriber
+            subscription.start_id = self.last_event_id()
+            missed = self._missed_since(last_event_id)
+            if missed is not None and len(missed) <= self.buffer_size:
+                subscription.frames.extend(missed)
+                subscription.resumed = True
+                if missed:
+                    subscription.wake.set()
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+                if self.slots is not None:
+                    self.slots.release()
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def _missed_since(self, last_event_id):
+        # Caller holds the lock. Returns None when the id can't be resumed.
+        if not last_event_id:
+            return None
+        token, _, seq = last_event_id.partition(':')
+        if token != self._token or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq > self._seq:
+            return None
+        if seq == self._seq:
+            return []
+        if not self._history or self._history[0][0] > seq + 1:
+            return None  # Part of the gap has already left the history
+        return [frame for event_seq, frame in self._history if event_seq > seq]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'last_event_id': self.last_event_id()
+            }
@@ -0,0 +1,179 @@
+"""
+Coalescing broadcast scheduler for Socket.IO rooms
+
+Vehicle updates used to be emitted one message per fix. The scheduler
+instead collects updates per (room, event) and sends them once per tick:
+updates to the same vehicle inside a tick are merged (later fields win), so
+a room receives at most one batch per tick however many fixes arrived.
+
+A room that has been quiet for longer than its tick is flushed on the next
+pass, so isolated updates still go out almost immediately; only bursts are
+throttled.
+
+Tick lengths are configured per room type, where the type is the room name
+up to the first underscore (tile_12_..., route_..., vehicle_...). They can
+be overridden with BROADCAST_TICKS, e.g. "all=1,tile=0.5,route=0.5".
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICKS = {
+    'all': 1.0,      # Global room: the most clients, so the most to gain
+    'tile': 0.5,
+    'route': 0.5,
+    'vehicle': 0.5,  # Single-vehicle rooms (operator/driver controls)
+}
+DEFAULT_TICK = 1.0
+
+
+def parse_ticks(value):
+    """Parse "type=seconds,..." into a dict, ignoring malformed entries."""
+    ticks = {}
+    for part in (value or '').split(','):
+        name, _, seconds = part.partition('=')
+        try:
+            if name.strip() and float(seconds) > 0:
+                ticks[name.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid broadcast tick: {part!r}")
+    return ticks
+
+
+class _Batch:
+    __slots__ = ('room', 'event', 'batch_event', 'updates', 'count')
+
+    def __init__(self, room, event, batch_event):
+        self.room = room
+        self.event = event
+        self.batch_event = batch_event
+        self.updates = {}  # key -> merged payload, in first-seen order
+        self.count = 0     # Updates queued, before coalescing
+
+
+class BroadcastScheduler:
+    """Coalesce per-room updates into one message per room per tick."""
+
+    def __init__(self, emit, ticks=None, default_tick=DEFAULT_TICK, room_type=None, name='broadcasts'):
+        # emit(event, payload, room) performs the actual send
+        self._emit = emit
+        self.ticks = dict(DEFAULT_TICKS if ticks is None else ticks)
+        self.default_tick = default_tick
+        self._room_type = room_type or (lambda room: room.split('_', 1)[0])
+        self.name = name
+        self._pending = {}    # (room, event) -> _Batch
+        self._last_flush = {}  # (room, event) -> time of last send
+        self._lock = threading.Lock()
+        self._started = False
+        self._metrics = {}
+
+    def tick_for(self, room):
+        return self.ticks.get(self._room_type(room), self.default_tick)
+
+    def enqueue(self, event, rooms, key, data, batch_event=None):
+        """Queue an update for key in each room.
+
+        With batch_event the room gets one batch_event message carrying a
+        list of updates; without it, one event message per key.
+        """
+        with self._lock:
+            for room in dict.fromkeys(rooms):
+                batch = self._pending.get((room, event))
+                if batch is None:
+                    batch = self._pending[(room, event)] = _Batch(room, event, batch_event)
+                metrics = self._metrics_for(room)
+                metrics['updates'] += 1
+                batch.count += 1
+                existing = batch.updates.get(key)
+                if existing is None:
+                    batch.updates[key] = dict(data)
+                else:
+                    existing.update(data)
+                    metrics['coalesced'] += 1
+
+    def flush(self, now=None, force=False):
+        """Send every batch whose room tick has elapsed (or all, with force)."""
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            for slot, batch in list(self._pending.items()):
+                if force or now - self._last_flush.get(slot, 0) >= self.tick_for(batch.room):
+                    due.append(batch)
+                    del self._pending[slot]
+                    self._last_flush[slot] = now
+            if len(self._last_flush) > 4 * (len(self._pending) + 256):
+                # Forget rooms that have gone quiet so the table doesn't grow without bound
+                horizon = now - 10 * max(list(self.ticks.values()) + [self.default_tick])
+                self._last_flush = {slot: t for slot, t in self._last_flush.items() if t >= horizon}
+
+        for batch in due:
+            updates = list(batch.updates.values())
+            try:
+                if batch.batch_event:
+                    self._emit(batch.batch_event, {'updates': updates, 'timestamp': now}, batch.room)
+                    sent = 1
+                else:
+                    for update in updates:
+                        self._emit(batch.event, update, batch.room)
+                    sent = len(updates)
+            except Exception as e:
+                logger.error(f"{self.name}: failed to send {batch.event} to {batch.room}: {e}")
+                continue
+            with self._lock:
+                metrics = self._metrics_for(batch.room)
+                metrics['delivered'] += batch.count
+                metrics['messages'] += sent
+        return len(due)
+
+    def start(self, start_background_task, sleep):
+        """Start the flush loop once, using the server's task and sleep primitives."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        resolution = min(list(self.ticks.values()) + [self.default_tick]) / 5
+
+        def run():
+            while True:
+                sleep(resolution)
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"{self.name}: flush failed: {e}")
+
+        start_background_task(run)
+
+    def _metrics_for(self, room):
+        # Caller holds the lock
+        room_type = self._room_type(room)
+        metrics = self._metrics.get(room_type)
+        if metrics is None:
+            metrics = self._metrics[room_type] = {'updates': 0, 'coalesced': 0, 'delivered': 0, 'messages': 0}
+        return metrics
+
+    def stats(self):
+        with self._lock:
+            # Saved = updates already sent as part of a batch, minus the messages that carried them
+            rooms = {}
+            for room_type, metrics in self._metrics.items():
+                rooms[room_type] = dict(metrics, tick=self.ticks.get(room_type, self.default_tick),
+                                        messages_saved=metrics['delivered'] - metrics['messages'])
+            delivered = sum(m['delivered'] for m in self._metrics.values())
+            messages = sum(m['messages'] for m in self._metrics.values())
+            return {
+                'name': self.name,
+                'pending_batches': len(self._pending),
+                'updates': sum(m['updates'] for m in self._metrics.values()),
+                'messages': messages,
+                'messages_saved': delivered - messages,
+                'rooms': rooms
+            }
+
+
+def configured_ticks():
+    ticks = dict(DEFAULT_TICKS)
+    ticks.update(parse_ticks(os.environ.get('BROADCAST_TICKS')))
+    return ticks
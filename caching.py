@@ -1,59 +1,467 @@
 """
 Caching utilities for performance optimization
+
+Caches are bounded LRU maps with per-entry TTLs and tag-based invalidation.
+Each cache counts hits, misses and evictions, and loads missing keys
+single-flight so concurrent callers share one computation. A load that is
+overtaken by an invalidation returns its value but doesn't store it.
+
+Two storage backends are available:
+  - memory: in-process OrderedDict (default)
+  - sqlite: a local SQLite file shared by all workers on the same host
+
+Set CACHE_BACKEND=sqlite (and optionally CACHE_SQLITE_PATH) to share entries
+between gunicorn workers.
 """
+import os
+import pickle
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
 
-# Simple in-memory cache
-_cache = {}
-_cache_times = {}
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class MemoryBackend:
+    """In-process LRU store. Entries are (value, expires_at, tags)."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value, expired)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None, False
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return False, None, True
+            self._entries.move_to_end(key)
+            return True, value, False
+
+    def set(self, key, value, expires_at, tags=()):
+        """Store a value and return how many entries were evicted to make room."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                evicted += 1
+            return evicted
 
-def timed_cache(seconds=300):
+    def delete(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def delete_tag(self, tag):
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+            return len(keys)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at, _) in self._entries.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteBackend:
+    """Host-local store shared by every worker process through one SQLite file.
+
+    Values must be picklable. Each cache uses its own namespace inside the file.
+    """
+
+    def __init__(self, namespace, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.namespace = namespace
+        self.path = path or os.environ.get('CACHE_SQLITE_PATH', os.path.join('instance', 'cache.db'))
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB, '
+                'expires_at REAL, accessed_at REAL NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_tags ('
+                'namespace TEXT NOT NULL, tag TEXT NOT NULL, key TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, tag, key))'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed '
+                'ON cache_entries (namespace, accessed_at)'
+            )
+
+    def _conn(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?',
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return False, None, False
+        value, expires_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            self.delete(key)
+            return False, None, True
+        conn.execute(
+            'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+            (now, self.namespace, key)
+        )
+        return True, pickle.loads(value), False
+
+    def set(self, key, value, expires_at, tags=()):
+        conn = self._conn()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_tags WHERE namespace = ? AND key = ?', (self.namespace, key))
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self.namespace, key, blob, expires_at, time.time())
+            )
+            conn.executemany(
+                'INSERT OR IGNORE INTO cache_tags (namespace, tag, key) VALUES (?, ?, ?)',
+                [(self.namespace, tag, key) for tag in tags]
+            )
+
+            count = conn.execute(
+                'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+            ).fetchone()[0]
+            evicted = max(0, count - self.max_entries)
+            if evicted:
+                victims = conn.execute(
+                    'SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?',
+                    (self.namespace, evicted)
+                ).fetchall()
+                self._delete_keys(conn, [victim[0] for victim in victims])
+        return evicted
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            return self._delete_keys(conn, [key]) > 0
+
+    def delete_tag(self, tag):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            keys = [row[0] for row in conn.execute(
+                'SELECT key FROM cache_tags WHERE namespace = ? AND tag = ?', (self.namespace, tag)
+            ).fetchall()]
+            self._delete_keys(conn, keys)
+        return len(keys)
+
+    def purge_expired(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            keys = [row[0] for row in conn.execute(
+                'SELECT key FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?',
+                (self.namespace, time.time())
+            ).fetchall()]
+            self._delete_keys(conn, keys)
+        return len(keys)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entries WHERE namespace = ?', (self.namespace,))
+            conn.execute('DELETE FROM cache_tags WHERE namespace = ?', (self.namespace,))
+
+    def __len__(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+    def _delete_keys(self, conn, keys):
+        deleted = 0
+        for key in keys:
+            deleted += conn.execute(
+                'DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key)
+            ).rowcount
+            conn.execute('DELETE FROM cache_tags WHERE namespace = ? AND key = ?', (self.namespace, key))
+        return deleted
+
+
+class _Flight:
+    """A load in progress that other callers for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL, tags, counters and single-flight loading."""
+
+    def __init__(self, name, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.backend = backend if backend is not None else _default_backend(name, max_entries)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        # Bumped by every invalidation; loads started under an older generation aren't stored
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                       'loads': 0, 'load_errors': 0, 'stale_loads': 0, 'invalidations': 0}
+
+    def _count(self, counter, amount=1):
+        if amount:
+            with self._stats_lock:
+                self._stats[counter] += amount
+
+    def get(self, key, default=None):
+        found, value, expired = self.backend.get(self._key(key))
+        if expired:
+            self._count('expirations')
+        if found:
+            self._count('hits')
+            return value
+        self._count('misses')
+        return default
+
+    def set(self, key, value, ttl=None, tags=()):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._count('evictions', self.backend.set(self._key(key), value, expires_at, tags))
+
+    def get_or_load(self, key, loader, ttl=None, tags=()):
+        """Return the cached value, calling loader() at most once across concurrent misses."""
+        found, value, expired = self.backend.get(self._key(key))
+        if expired:
+            self._count('expirations')
+        if found:
+            self._count('hits')
+            return value
+        self._count('misses')
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        generation = self._generation
+        try:
+            flight.value = loader()
+            self._count('loads')
+            # Compared and stored under the lock, so an invalidation either
+            # prevents the store or runs after it and removes the entry
+            with self._generation_lock:
+                stale = self._generation != generation
+                if not stale:
+                    self.set(key, flight.value, ttl=ttl, tags=tags)
+            if stale:
+                # The data changed while loading; the value may predate the change
+                self._count('stale_loads')
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            self._count('load_errors')
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key):
+        self._bump_generation()
+        if self.backend.delete(self._key(key)):
+            self._count('invalidations')
+            return True
+        return False
+
+    def invalidate_tag(self, tag):
+        self._bump_generation()
+        removed = self.backend.delete_tag(tag)
+        self._count('invalidations', removed)
+        return removed
+
+    def purge_expired(self):
+        removed = self.backend.purge_expired()
+        self._count('expirations', removed)
+        return removed
+
+    def clear(self):
+        self._bump_generation()
+        self.backend.clear()
+
+    def _bump_generation(self):
+        with self._generation_lock:
+            self._generation += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['size'] = len(self.backend)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
+
+    def _key(self, key):
+        # The SQLite backend needs text keys; the memory backend takes anything hashable
+        if isinstance(self.backend, SQLiteBackend):
+            return key if isinstance(key, str) else repr(key)
+        return key
+
+
+def _default_backend(name, max_entries):
+    if os.environ.get('CACHE_BACKEND', 'memory').lower() == 'sqlite':
+        return SQLiteBackend(name, max_entries=max_entries)
+    return MemoryBackend(max_entries=max_entries)
+
+
+# Registry of named caches so stats and invalidation can reach all of them
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, backend=None):
+    """Return the named cache, creating it on first use."""
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = TTLCache(name, ttl=ttl, max_entries=max_entries, backend=backend)
+        return cache
+
+
+def invalidate_tag(tag):
+    """Invalidate a tag (e.g. 'vehicle:42') in every registered cache."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return sum(cache.invalidate_tag(tag) for cache in caches)
+
+
+def cache_stats():
+    """Return hit/miss/eviction counters for every registered cache."""
+    with _caches_lock:
+        caches = list(_caches.items())
+    return {name: cache.stats() for name, cache in caches}
+
+
+def make_key(func, args, kwargs):
+    """Build a stable cache key from a function and its call arguments."""
+    key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        # Unhashable arguments (lists, dicts) fall back to their repr
+        return repr(key)
+
+
+def timed_cache(seconds=300, max_entries=DEFAULT_MAX_ENTRIES, tags=None):
     """
     Function decorator that caches the result for a specified time period.
-    
+
     Args:
         seconds: Number of seconds to cache the result
+        max_entries: Maximum number of results kept for this function
+        tags: Optional callable (args, kwargs) -> iterable of tags for the entry
     """
     def decorator(func):
+        cache = get_cache(f"{func.__module__}.{func.__qualname__}", ttl=seconds, max_entries=max_entries)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Create a cache key from function name and arguments
-            key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
-            
-            # Check if result is in cache and not expired
-            current_time = time.time()
-            if key in _cache and current_time - _cache_times.get(key, 0) < seconds:
-                return _cache[key]
-            
-            # Call the function and cache the result
-            result = func(*args, **kwargs)
-            _cache[key] = result
-            _cache_times[key] = current_time
-            
-            return result
+            entry_tags = tuple(tags(args, kwargs)) if tags else ()
+            return cache.get_or_load(
+                make_key(func, args, kwargs),
+                lambda: func(*args, **kwargs),
+                tags=entry_tags
+            )
+
+        def invalidate(*args, **kwargs):
+            return cache.invalidate(make_key(func, args, kwargs))
+
+        wrapper.cache = cache
+        wrapper.invalidate = invalidate
         return wrapper
     return decorator
 
 # Cache cleanup function to prevent memory leaks
-def cleanup_cache(max_age=3600):
+def cleanup_cache(max_age=None):
     """
-    Remove expired cache entries to prevent memory leaks
-    
+    Remove expired entries from every registered cache.
+
+    Caches are bounded, so this only reclaims memory early; it is no longer
+    required to prevent leaks.
+
     Args:
-        max_age: Maximum age in seconds before entry is removed
+        max_age: Ignored; kept for backwards compatibility. Entries expire by their own TTL.
     """
-    current_time = time.time()
-    keys_to_delete = []
-    
-    for key, timestamp in _cache_times.items():
-        if current_time - timestamp > max_age:
-            keys_to_delete.append(key)
-    
-    for key in keys_to_delete:
-        if key in _cache:
-            del _cache[key]
-        if key in _cache_times:
-            del _cache_times[key]
-    
-    return len(keys_to_delete)
+    with _caches_lock:
+        caches = list(_caches.values())
+    return sum(cache.purge_expired() for cache in caches)
@@ -0,0 +1,143 @@
+"""
+Server-side marker clustering for the public vehicle feed
+
+Vehicles are grouped into grid cells per zoom level. Each cell is a Web
+Mercator tile CELL_ZOOM_OFFSET levels below the map zoom (a 64px square at
+256px tiles). Each cell keeps running sums, so moving, adding or removing a
+vehicle only touches its old and new cell. Grids are created lazily the
+first time a zoom level is requested and then kept up to date incrementally.
+"""
+import threading
+
+from spatial_index import tile_xy, in_bbox
+
+CELL_ZOOM_OFFSET = 2
+MAX_CLUSTER_ZOOM = 16  # Above this, clients should request individual vehicles
+
+
+class _Cell:
+    __slots__ = ('count', 'sum_lat', 'sum_lon', 'occupancy', 'vehicle_ids')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lon = 0.0
+        self.occupancy = {}
+        self.vehicle_ids = set()
+
+    def add(self, vehicle_id, lat, lon, occupancy):
+        self.count += 1
+        self.sum_lat += lat
+        self.sum_lon += lon
+        self.occupancy[occupancy] = self.occupancy.get(occupancy, 0) + 1
+        self.vehicle_ids.add(vehicle_id)
+
+    def remove(self, vehicle_id, lat, lon, occupancy):
+        self.count -= 1
+        self.sum_lat -= lat
+        self.sum_lon -= lon
+        remaining = self.occupancy.get(occupancy, 0) - 1
+        if remaining > 0:
+            self.occupancy[occupancy] = remaining
+        else:
+            self.occupancy.pop(occupancy, None)
+        self.vehicle_ids.discard(vehicle_id)
+
+    def to_dict(self):
+        cluster = {
+            'latitude': round(self.sum_lat / self.count, 6),
+            'longitude': round(self.sum_lon / self.count, 6),
+            'count': self.count,
+            'occupancy': dict(self.occupancy)
+        }
+        if self.count == 1:
+            cluster['vehicle_id'] = next(iter(self.vehicle_ids))
+        return cluster
+
+
+class ClusterGrid:
+    """Running per-cell aggregates for one zoom level."""
+
+    def __init__(self, zoom):
+        self.zoom = zoom
+        self.cell_zoom = zoom + CELL_ZOOM_OFFSET
+        self._cells = {}
+        self._members = {}  # vehicle_id -> (cell, lat, lon, occupancy)
+        self.version = 0
+
+    def upsert(self, vehicle_id, lat, lon, occupancy):
+        self.remove(vehicle_id)
+        cell_key = tile_xy(lat, lon, self.cell_zoom)
+        cell = self._cells.get(cell_key)
+        if cell is None:
+            cell = self._cells[cell_key] = _Cell()
+        cell.add(vehicle_id, lat, lon, occupancy)
+        self._members[vehicle_id] = (cell_key, lat, lon, occupancy)
+        self.version += 1
+
+    def remove(self, vehicle_id):
+        member = self._members.pop(vehicle_id, None)
+        if member is None:
+            return
+        cell_key, lat, lon, occupancy = member
+        cell = self._cells[cell_key]
+        cell.remove(vehicle_id, lat, lon, occupancy)
+        if cell.count == 0:
+            del self._cells[cell_key]
+        self.version += 1
+
+    def clusters(self, bbox=None):
+        clusters = [cell.to_dict() for cell in self._cells.values()]
+        if bbox is not None:
+            clusters = [c for c in clusters if in_bbox(c['latitude'], c['longitude'], bbox)]
+        return clusters
+
+
+class ClusterIndex:
+    """Cluster grids for every zoom level that has been requested."""
+
+    def __init__(self, load_vehicles):
+        # load_vehicles() returns the current vehicle dicts, used to seed a new grid
+        self._load_vehicles = load_vehicles
+        self._grids = {}
+        self._lock = threading.Lock()
+        # Bumped on reset so versions from discarded grids are never reused
+        self._generation = 0
+
+    def version(self, zoom):
+        """Current version of a zoom's grid, or None if it hasn't been built yet."""
+        with self._lock:
+            grid = self._grids.get(zoom)
+            return (self._generation, grid.version) if grid is not None else None
+
+    def clusters(self, zoom, bbox=None):
+        """Return (clusters, version) for a zoom, seeding its grid on first use."""
+        with self._lock:
+            grid = self._grids.get(zoom)
+            if grid is None:
+                grid = self._grids[zoom] = ClusterGrid(zoom)
+                for vehicle in self._load_vehicles():
+                    self._upsert(grid, vehicle)
+            return grid.clusters(bbox), (self._generation, grid.version)
+
+    def apply(self, changed=(), removed=()):
+        """Apply changed vehicle dicts and removed vehicle ids to every grid."""
+        with self._lock:
+            for grid in self._grids.values():
+                for vehicle in changed:
+                    self._upsert(grid, vehicle)
+                for vehicle_id in removed:
+                    grid.remove(vehicle_id)
+
+    def reset(self):
+        with self._lock:
+            self._grids.clear()
+            self._generation += 1
+
+    @staticmethod
+    def _upsert(grid, vehicle):
+        if vehicle.get('latitude') is None or vehicle.get('longitude') is None:
+            grid.remove(vehicle['id'])
+        else:
+            grid.upsert(vehicle['id'], vehicle['latitude'], vehicle['longitude'],
+                        vehicle.get('occupancy_status') or 'unknown')
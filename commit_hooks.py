@@ -0,0 +1,37 @@
+"""
+Transaction-aware callbacks
+
+Caches and in-memory indexes that mirror database rows should only change
+once a write is durable. after_commit() queues a callback on a session; it
+runs after that session's next successful commit and is discarded if the
+transaction rolls back.
+"""
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_CALLBACKS_KEY = 'after_commit_callbacks'
+
+
+def after_commit(session, callback, *args):
+    """Run callback(*args) after the session's current transaction commits."""
+    session.info.setdefault(_CALLBACKS_KEY, []).append((callback, args))
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    callbacks = session.info.pop(_CALLBACKS_KEY, None)
+    for callback, args in callbacks or ():
+        try:
+            callback(*args)
+        except Exception as e:
+            # A failing cache update must never turn a committed write into an error
+            logger.error(f"after_commit callback {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit(session):
+    session.info.pop(_CALLBACKS_KEY, None)
@@ -0,0 +1,303 @@
+"""
+In-memory dashboard counters
+
+The admin and operator dashboards used to COUNT vehicles, drivers and
+operators and look up every vehicle's active trip on each page load. These
+figures now live in memory:
+
+- vehicles per status, users per (type, active)
+- the active trip of every vehicle
+- the latest driver action logs, and driver logs / trips started per hour
+  for the last 24 hours
+
+Mapper write hooks (after_insert/after_update/after_delete) turn each
+flushed row change into a delta that is applied once the transaction
+commits (rolled-back writes never count). Writes that bypass the ORM
+(bulk Query.update/delete, other processes, manual SQL) are caught by a
+reconciliation that recounts everything from the database every
+RECONCILE_INTERVAL seconds in a background thread; how far the counters
+had drifted is reported in stats().
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect, select
+
+from commit_hooks import after_commit
+from models import db
+from models.user import DriverActionLog, Trip, User
+from models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = float(os.environ.get('DASHBOARD_RECONCILE_SECONDS', 300))
+RECENT_LOGS = 5
+WINDOW_HOURS = 24
+
+
+def _hour(when):
+    return (when or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+def _previous(obj, attr):
+    """Value of attr before the flush that is running now."""
+    history = inspect(obj).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(obj, attr)
+
+
+class DashboardAggregates:
+    """Dashboard counters kept current by write hooks, recounted periodically."""
+
+    def __init__(self, interval=RECONCILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._vehicles = Counter()      # status -> vehicles
+        self._users = Counter()         # (user_type, is_active) -> users
+        self._active_trips = {}         # vehicle_id -> active trip id
+        self._log_hours = Counter()     # hour -> driver action logs
+        self._trip_hours = Counter()    # hour -> trips started
+        self._recent_logs = deque(maxlen=RECENT_LOGS)
+        self.loaded = False
+        self.reconciliations = 0
+        self.drift = 0                  # Corrections made by the last reconciliation
+        self.reconciled_at = None
+
+    # Deltas from write hooks (applied after commit)
+
+    def vehicle_changed(self, old_status, new_status):
+        with self._lock:
+            if old_status is not None:
+                self._vehicles[old_status] -= 1
+            if new_status is not None:
+                self._vehicles[new_status] += 1
+
+    def user_changed(self, old_key, new_key):
+        with self._lock:
+            if old_key is not None:
+                self._users[old_key] -= 1
+            if new_key is not None:
+                self._users[new_key] += 1
+
+    def trip_started(self, vehicle_id, trip_id, start_time):
+        with self._lock:
+            self._active_trips[vehicle_id] = trip_id
+            self._trip_hours[_hour(start_time)] += 1
+            self._prune()
+
+    def trip_ended(self, vehicle_id, trip_id):
+        with self._lock:
+            if self._active_trips.get(vehicle_id) == trip_id:
+                del self._active_trips[vehicle_id]
+
+    def log_added(self, log):
+        with self._lock:
+            self._recent_logs.appendleft(log)
+            self._log_hours[_hour(log.get('created_at_dt'))] += 1
+            self._prune()
+
+    def _prune(self):
+        # Caller holds the lock
+        oldest = _hour(datetime.utcnow()) - timedelta(hours=WINDOW_HOURS - 1)
+        for hours in (self._log_hours, self._trip_hours):
+            for hour in [hour for hour in hours if hour < oldest]:
+                del hours[hour]
+
+    # Reads
+
+    def vehicle_counts(self):
+        with self._lock:
+            counts = {status: count for status, count in self._vehicles.items() if count}
+        return {
+            'total': sum(counts.values()),
+            'active': counts.get('active', 0),
+            'delayed': counts.get('delayed', 0),
+            'inactive': counts.get('inactive', 0)
+        }
+
+    def user_counts(self, user_type):
+        with self._lock:
+            active = self._users[(user_type, True)]
+            inactive = self._users[(user_type, False)]
+        return {'total': active + inactive, 'active': active, 'inactive': inactive}
+
+    def active_trip(self, vehicle_id):
+        return self._active_trips.get(vehicle_id)
+
+    def active_trip_count(self):
+        return len(self._active_trips)
+
+    def last_24h(self):
+        with self._lock:
+            self._prune()
+            return {'driver_logs': sum(self._log_hours.values()), 'trips_started': sum(self._trip_hours.values())}
+
+    def recent_logs(self):
+        with self._lock:
+            return [{k: v for k, v in log.items() if k != 'created_at_dt'} for log in self._recent_logs]
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'reconciliations': self.reconciliations,
+            'last_drift': self.drift,
+            'reconciled_at': self.reconciled_at,
+            'active_trips': len(self._active_trips)
+        }
+
+    # Reconciliation
+
+    def reconcile(self):
+        """Recount everything through a separate connection. Needs an app context."""
+        since = _hour(datetime.utcnow()) - timedelta(hours=WINDOW_HOURS - 1)
+        vehicles, users, trips, logs = Vehicle.__table__, User.__table__, Trip.__table__, DriverActionLog.__table__
+        with db.engine.connect() as connection:
+            vehicle_counts = Counter(dict(connection.execute(
+                select(vehicles.c.status, func.count()).group_by(vehicles.c.status)).fetchall()))
+            user_counts = Counter({(user_type, bool(active)): count for user_type, active, count in connection.execute(
+                select(users.c.user_type, users.c.is_active, func.count())
+                .group_by(users.c.user_type, users.c.is_active)).fetchall()})
+            active_trips = {vehicle_id: trip_id for trip_id, vehicle_id in connection.execute(
+                select(trips.c.id, trips.c.vehicle_id).where(trips.c.status == 'active')
+                .order_by(trips.c.start_time)).fetchall()}
+            trip_hours = Counter(_hour(start) for (start,) in connection.execute(
+                select(trips.c.start_time).where(trips.c.start_time >= since)).fetchall())
+            log_hours = Counter(_hour(created) for (created,) in connection.execute(
+                select(logs.c.created_at).where(logs.c.created_at >= since)).fetchall())
+            recent = [_log_dict(row) for row in connection.execute(
+                select(logs).order_by(logs.c.created_at.desc()).limit(RECENT_LOGS)).fetchall()]
+
+        with self._lock:
+            drift = sum((vehicle_counts - self._vehicles).values()) + sum((self._vehicles - vehicle_counts).values()) \
+                + sum((user_counts - self._users).values()) + sum((self._users - user_counts).values()) \
+                + len(set(active_trips.items()) ^ set(self._active_trips.items()))
+            self._vehicles = vehicle_counts
+            self._users = user_counts
+            self._active_trips = active_trips
+            self._trip_hours = trip_hours
+            self._log_hours = log_hours
+            self._recent_logs = deque(recent, maxlen=RECENT_LOGS)
+            self.drift = drift if self.loaded else 0
+            self.loaded = True
+            self.reconciliations += 1
+            self.reconciled_at = time.time()
+        if drift and self.reconciliations > 1:
+            logger.info(f"Dashboard aggregates reconciled, corrected {drift} counts")
+
+    def start(self, app):
+        """Load the counters (once) and start the reconciliation thread."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            if not self.loaded:
+                self.reconcile()
+            self._thread = threading.Thread(target=self._run, name='dashboard-reconcile', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._app.app_context():
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"Dashboard reconciliation failed: {e}")
+
+
+def _log_dict(log):
+    created_at = log.created_at
+    return {
+        'id': log.id,
+        'driver_id': log.driver_id,
+        'vehicle_id': log.vehicle_id,
+        'action': log.action,
+        'meta_data': log.meta_data,
+        'created_at': created_at.isoformat() if created_at else None,
+        'created_at_dt': created_at
+    }
+
+
+aggregates = DashboardAggregates()
+
+
+def ensure_started():
+    """Start the aggregates for the current app (first call loads them). Needs an app context."""
+    from flask import current_app
+    aggregates.start(current_app._get_current_object())
+    return aggregates
+
+
+def _queue(target, callback, *args):
+    session = inspect(target).session
+    if session is not None:
+        after_commit(session, callback, *args)
+
+
+@event.listens_for(Vehicle, 'after_insert')
+def _vehicle_inserted(mapper, connection, target):
+    _queue(target, aggregates.vehicle_changed, None, target.status)
+
+
+@event.listens_for(Vehicle, 'after_update')
+def _vehicle_updated(mapper, connection, target):
+    if inspect(target).attrs.status.history.has_changes():
+        _queue(target, aggregates.vehicle_changed, _previous(target, 'status'), target.status)
+
+
+@event.listens_for(Vehicle, 'after_delete')
+def _vehicle_deleted(mapper, connection, target):
+    _queue(target, aggregates.vehicle_changed, _previous(target, 'status'), None)
+
+
+def _user_key(user, previous=False):
+    if previous:
+        return _previous(user, 'user_type'), bool(_previous(user, 'is_active'))
+    return user.user_type, bool(user.is_active)
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    _queue(target, aggregates.user_changed, None, _user_key(target))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.user_type.history.has_changes() or attrs.is_active.history.has_changes():
+        _queue(target, aggregates.user_changed, _user_key(target, previous=True), _user_key(target))
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _queue(target, aggregates.user_changed, _user_key(target, previous=True), None)
+
+
+@event.listens_for(Trip, 'after_insert')
+def _trip_inserted(mapper, connection, target):
+    if target.status == 'active':
+        _queue(target, aggregates.trip_started, target.vehicle_id, target.id, target.start_time)
+
+
+@event.listens_for(Trip, 'after_update')
+def _trip_updated(mapper, connection, target):
+    if inspect(target).attrs.status.history.has_changes() and target.status != 'active':
+        _queue(target, aggregates.trip_ended, target.vehicle_id, target.id)
+
+
+@event.listens_for(Trip, 'after_delete')
+def _trip_deleted(mapper, connection, target):
+    _queue(target, aggregates.trip_ended, target.vehicle_id, target.id)
+
+
+@event.listens_for(DriverActionLog, 'after_insert')
+def _log_inserted(mapper, connection, target):
+    _queue(target, aggregates.log_added, _log_dict(target))
@@ -8,4 +8,5 @@ python init_db.py
 
 # Start the application
 echo "Starting Gunicorn server..."
-exec gunicorn -k gthread --threads 4 -w 2 --timeout 30 --keep-alive 2 --max-requests 1000 --max-requests-jitter 100 wsgi:app
+# Worker class follows SOCKETIO_ASYNC_MODE (threading -> gthread, gevent -> gevent)
+exec gunicorn --config gunicorn_conf.py wsgi:app
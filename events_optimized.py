@@ -9,15 +9,96 @@ from models import db
 import json
 import math
 from sqlalchemy import desc
+from vehicle_access import get_vehicle_access
+from spatial_index import SpatialIndex, parse_bbox, viewport_rooms, point_rooms
+from route_rooms import route_room, parse_routes
+from broadcast_scheduler import BroadcastScheduler, configured_ticks
+import payload_codec
+import liveness
+import location_batch
+import location_dedup
+import rate_limit
 
 # Cache for vehicle positions to reduce database queries
 vehicle_positions_cache = {}
+vehicle_positions_index = SpatialIndex()  # Same vehicles, bucketed for bbox queries
 last_cache_update = 0
 CACHE_EXPIRY = 5  # seconds
 
-def handle_connect():
+# Clients that haven't sent a viewport (or whose viewport is too large for
+# tile rooms) receive every vehicle_update through this room
+ALL_VEHICLE_UPDATES_ROOM = 'vehicle_updates_all'
+
+# Tile rooms each connected client has joined for its current viewport
+_viewport_rooms = {}
+
+# Clients that negotiated compact MessagePack payloads, by sid. They join a
+# ":mp" twin of each vehicle-update room so each room's binary form is
+# encoded once and only sent to them.
+_payload_modes = {}
+BINARY_ROOM_SUFFIX = ':mp'
+
+# Events that opted-in clients receive in the compact binary form
+PACKED_EVENTS = {'vehicle_positions', 'vehicle_update_batch', 'vehicle_updated'}
+
+def _wire_room(room, sid=None):
+    """Name of the room the client actually joins for a vehicle-update room."""
+    sid = sid or request.sid
+    return room + BINARY_ROOM_SUFFIX if sid in _payload_modes else room
+
+def wire_rooms(rooms):
+    """All rooms (JSON and binary twins) to emit a JSON-only event to."""
+    rooms = [rooms] if isinstance(rooms, str) else list(rooms)
+    if not _payload_modes:
+        return rooms
+    return rooms + [room + BINARY_ROOM_SUFFIX for room in rooms]
+
+def _negotiate_payload_mode(auth):
+    """Honour {'payload_mode': 'msgpack'} in the connect auth when msgpack is installed."""
+    wants_msgpack = isinstance(auth, dict) and auth.get('payload_mode') == payload_codec.PAYLOAD_MODE_MSGPACK
+    if wants_msgpack and payload_codec.msgpack_available():
+        _payload_modes[request.sid] = payload_codec.PAYLOAD_MODE_MSGPACK
+        emit('payload_mode', payload_codec.describe())
+    elif wants_msgpack:
+        # Old server build or msgpack missing: tell the client to stay on JSON
+        emit('payload_mode', {'mode': payload_codec.PAYLOAD_MODE_JSON})
+
+def _broadcast_room_type(room):
+    return 'all' if room == ALL_VEHICLE_UPDATES_ROOM else room.split('_', 1)[0]
+
+def _send_broadcast(event, payload, room):
+    from app import socketio
+    socketio.emit(event, payload, room=room)
+    if _payload_modes and event in PACKED_EVENTS:
+        socketio.emit(event, payload_codec.pack(payload), room=room + BINARY_ROOM_SUFFIX)
+
+# vehicle_update and vehicle_updated are coalesced per room and sent once per
+# tick; everything else is still emitted immediately
+vehicle_broadcasts = BroadcastScheduler(_send_broadcast, ticks=configured_ticks(),
+                                        room_type=_broadcast_room_type, name='vehicle-broadcasts')
+
+# Events sent through the scheduler by emit_vehicle_update
+COALESCED_VEHICLE_EVENTS = {'vehicle_updated'}
+
+def queue_vehicle_update(vehicle_id, data, rooms):
+    """Queue a vehicle_update for rooms; clients receive vehicle_update_batch messages."""
+    from app import socketio
+    vehicle_broadcasts.start(socketio.start_background_task, socketio.sleep)
+    vehicle_broadcasts.enqueue('vehicle_update', rooms, vehicle_id, {'id': vehicle_id, **data},
+                               batch_event='vehicle_update_batch')
+
+# Route rooms of clients that follow specific routes. While a client follows
+# routes it receives vehicle_update only through them, not its viewport.
+_route_rooms = {}
+
+# Stop rooms each client follows for arrived_at_stop/departed_stop
+_stop_rooms = {}
+MAX_STOP_SUBSCRIPTIONS = 50
+
+def handle_connect(auth=None):
     """Handle client connection."""
     current_app.logger.debug(f"Client connected: {request.sid}")
+    _negotiate_payload_mode(auth)
     
     # Add user to their own room if authenticated
     if current_user.is_authenticated:
@@ -26,6 +107,7 @@ def handle_connect():
     
     # Add all clients to a global room
     join_room('all_clients')
+    join_room(_wire_room(ALL_VEHICLE_UPDATES_ROOM))
     
     # Emit connection acknowledgement
     emit('connect_ack', {'status': 'connected', 'timestamp': time.time()})
@@ -40,6 +122,10 @@ def handle_disconnect():
     
     # Remove from global room
     leave_room('all_clients')
+    _viewport_rooms.pop(request.sid, None)
+    _route_rooms.pop(request.sid, None)
+    _stop_rooms.pop(request.sid, None)
+    _payload_modes.pop(request.sid, None)
 
 def handle_location_update(data):
     """Handle location update from vehicles."""
@@ -62,8 +148,9 @@ def handle_location_update(data):
             current_app.logger.warning(f"Invalid location data: {data}")
             return
         
-        # Convert to float
+        # Convert to numbers; an int vehicle_id shares dedup and cache keys with the HTTP path
         try:
+            vehicle_id = int(vehicle_id)
             latitude = float(latitude)
             longitude = float(longitude)
             accuracy = float(accuracy) if accuracy else None
@@ -71,22 +158,28 @@ def handle_location_update(data):
             current_app.logger.warning(f"Invalid location format: {data}")
             return
         
-        # Get the vehicle
-        vehicle = Vehicle.query.get(vehicle_id)
+        if not _may_report_location(vehicle_id):
+            return
         
+        if not rate_limit.allow('location_update', f"vehicle:{vehicle_id}"):
+            current_app.logger.warning(f"Rate limited location updates for vehicle {vehicle_id}")
+            return
+        
+        # Drop retried and out-of-order fixes before any database work
+        device_ts = _device_timestamp(data.get('timestamp'))
+        seq = location_dedup.parse_sequence(data.get('seq'))
+        result = location_dedup.fixes.check(vehicle_id, latitude, longitude, device_ts, seq)
+        if result != location_dedup.ACCEPTED:
+            current_app.logger.debug(f"Dropped {result} fix for vehicle {vehicle_id}")
+            return
+        
+        vehicle = Vehicle.query.get(vehicle_id)
         if not vehicle:
             current_app.logger.warning(f"Vehicle not found: {vehicle_id}")
             return
         
-        # Check permissions: operators can update owned vehicles, drivers can update assigned vehicles
-        if current_user.user_type in ['operator', 'admin']:
-            if vehicle.owner_id != current_user.id:
-                current_app.logger.warning(f"Vehicle not owned by operator: {vehicle_id}")
-                return
-        elif current_user.user_type == 'driver':
-            if vehicle.assigned_driver_id != current_user.id:
-                current_app.logger.warning(f"Vehicle not assigned to driver: {vehicle_id}")
-                return
+        # Remember where the vehicle was so viewers of its old position see it leave
+        previous_position = (vehicle.current_latitude, vehicle.current_longitude)
         
         # Calculate speed if we have previous location
         speed_kmh = None
@@ -125,56 +218,289 @@ def handle_location_update(data):
             accuracy=accuracy
         )
         
-        # Save to database
+        # Save to database; the fix only counts as seen once it is stored
         db.session.add(location_log)
+        location_dedup.remember_after_commit(db.session, vehicle_id, latitude, longitude, device_ts, seq)
         db.session.commit()
         
-        # Update cache
-        update_vehicle_cache(vehicle)
-        
-        # Only broadcast to all clients if vehicle has an active trip
-        from models.user import Trip
-        active_trip = Trip.query.filter_by(
-            vehicle_id=vehicle.id,
-            status='active'
-        ).first()
-        
-        if active_trip:
-            emit('vehicle_update', {
-                'id': vehicle.id,
-                'latitude': latitude,
-                'longitude': longitude,
-                'status': vehicle.status,
-                'occupancy_status': vehicle.occupancy_status,
-                'type': vehicle.vehicle_type,
-                'route': vehicle.route,
-                'last_updated': vehicle.last_updated.isoformat(),
-                'speed_kmh': speed_kmh
-            }, room='all_clients')
+        _broadcast_location(vehicle, previous_position, speed_kmh)
         
         current_app.logger.debug(f"Location updated for vehicle {vehicle_id}: {latitude}, {longitude}")
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error handling location update: {str(e)}")
 
-def handle_request_vehicle_positions():
-    """Handle request for all active vehicle positions."""
+def handle_location_batch(data):
+    """Handle a batch of buffered fixes: {'vehicle_id', 'fixes': [...], 'occupancy_status'?}.
+    
+    See location_batch for the fix format. Acknowledges with the number of
+    fixes accepted and rejected.
+    """
+    if not current_user.is_authenticated or current_user.user_type not in ['operator', 'admin', 'driver']:
+        current_app.logger.warning(f"Unauthorized location batch attempt: {request.sid}")
+        return {'success': False, 'error': 'unauthorized'}
+    
     try:
+        vehicle_id = data.get('vehicle_id') if isinstance(data, dict) else None
+        try:
+            vehicle_id = int(vehicle_id) if vehicle_id else None
+        except (TypeError, ValueError):
+            vehicle_id = None
+        try:
+            fixes, rejected = location_batch.parse_batch(data.get('fixes') if vehicle_id else None)
+        except location_batch.BatchError as e:
+            current_app.logger.warning(f"Invalid location batch from {request.sid}: {e}")
+            return {'success': False, 'error': str(e)}
+        if not fixes:
+            return {'success': False, 'error': 'no valid fixes', 'rejected': rejected}
+        
+        if not _may_report_location(vehicle_id):
+            return {'success': False, 'error': 'vehicle not available'}
+        
+        if not rate_limit.allow('location_batch', f"vehicle:{vehicle_id}"):
+            return {'success': False, 'error': 'rate_limited'}
+        
+        # A retried batch is acknowledged without touching the database
+        fixes, duplicates = location_dedup.filter_new(vehicle_id, fixes)
+        if not fixes:
+            return {'success': True, 'accepted': 0, 'duplicates': duplicates, 'rejected': rejected}
+        
+        vehicle = Vehicle.query.get(vehicle_id)
+        if not vehicle:
+            current_app.logger.warning(f"Vehicle not found: {vehicle_id}")
+            return {'success': False, 'error': 'vehicle not available'}
+        
+        previous_position = (vehicle.current_latitude, vehicle.current_longitude)
+        location_dedup.remember_batch_after_commit(db.session, vehicle_id, fixes)
+        newest, speed_kmh = location_batch.store_batch(vehicle, fixes, data.get('occupancy_status'))
+        if newest is not None:
+            _broadcast_location(vehicle, previous_position, speed_kmh)
+        
+        current_app.logger.debug(f"Location batch for vehicle {vehicle_id}: {len(fixes)} fixes, {rejected} rejected")
+        return {'success': True, 'accepted': len(fixes), 'duplicates': duplicates, 'rejected': rejected}
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error handling location batch: {str(e)}")
+        return {'success': False, 'error': 'server error'}
+
+def _may_report_location(vehicle_id):
+    """Whether the current user may report the vehicle's location."""
+    # Check permissions from the access map before touching the database:
+    # operators can update owned vehicles, drivers can update assigned vehicles
+    access = get_vehicle_access(vehicle_id)
+    
+    if not access:
+        current_app.logger.warning(f"Vehicle not found: {vehicle_id}")
+        return False
+    
+    if current_user.user_type in ['operator', 'admin']:
+        if access.owner_id != current_user.id:
+            current_app.logger.warning(f"Vehicle not owned by operator: {vehicle_id}")
+            return False
+    elif current_user.user_type == 'driver':
+        if access.driver_id != current_user.id:
+            current_app.logger.warning(f"Vehicle not assigned to driver: {vehicle_id}")
+            return False
+    return True
+
+def _device_timestamp(value):
+    """Epoch seconds from a client's optional device timestamp, or None."""
+    if value is None:
+        return None
+    try:
+        return location_batch.parse_timestamp(value)
+    except (TypeError, ValueError):
+        return None
+
+def _broadcast_location(vehicle, previous_position, speed_kmh):
+    """Refresh the cache and queue a vehicle_update for a vehicle's new position."""
+    update_vehicle_cache(vehicle)
+    
+    # Only broadcast to all clients if vehicle has an active trip
+    from models.user import Trip
+    active_trip = Trip.query.filter_by(
+        vehicle_id=vehicle.id,
+        status='active'
+    ).first()
+    
+    if active_trip:
+        latitude, longitude = vehicle.current_latitude, vehicle.current_longitude
+        queue_vehicle_update(vehicle.id, {
+            'latitude': latitude,
+            'longitude': longitude,
+            'status': vehicle.status,
+            'occupancy_status': vehicle.occupancy_status,
+            'type': vehicle.vehicle_type,
+            'route': vehicle.route,
+            'last_updated': vehicle.last_updated.isoformat(),
+            'speed_kmh': speed_kmh
+        }, vehicle_update_rooms(latitude, longitude, *previous_position, route=vehicle.route))
+
+def handle_request_vehicle_positions(data=None):
+    """Handle request for active vehicle positions.
+    
+    Clients may send {'bbox': 'west,south,east,north'} (or a 4-item list) to
+    receive only vehicles in their viewport; this also moves them into the
+    tile rooms for that viewport so later vehicle_update events are scoped.
+    """
+    if not rate_limit.allow('vehicle_positions', f"sid:{request.sid}"):
+        current_app.logger.debug(f"Rate limited vehicle_positions request from {request.sid}")
+        return
+    
+    try:
+        bbox = None
+        if isinstance(data, dict) and data.get('bbox') is not None:
+            try:
+                bbox = parse_bbox(data.get('bbox'))
+            except ValueError:
+                current_app.logger.warning(f"Invalid bbox from {request.sid}: {data.get('bbox')}")
+        
         # Get cached positions or update cache
-        positions = get_cached_positions()
+        positions = get_cached_positions(bbox)
+        
+        if bbox is not None:
+            subscribe_viewport(bbox)
         
         # Emit to the requesting client only
-        emit('vehicle_positions', {
+        payload = {
             'vehicles': positions,
             'count': len(positions),
+            'bbox': list(bbox) if bbox else None,
             'timestamp': time.time()
-        })
+        }
+        if request.sid in _payload_modes:
+            payload = payload_codec.pack(payload)
+        emit('vehicle_positions', payload)
         
         current_app.logger.debug(f"Sent vehicle positions to client: {request.sid}")
         
     except Exception as e:
         current_app.logger.error(f"Error handling vehicle positions request: {str(e)}")
 
+def handle_subscribe_routes(data=None):
+    """Follow specific routes: {'routes': ['Carmen to Lapasan', ...]}.
+    
+    Commuters who send no routes follow the routes saved in their
+    notification settings. An empty list stops following routes and
+    returns the client to its viewport (or every vehicle).
+    """
+    try:
+        routes = data.get('routes') if isinstance(data, dict) else None
+        if routes is None and current_user.is_authenticated and current_user.user_type == 'commuter':
+            from models.notification import NotificationSetting
+            settings = NotificationSetting.query.filter_by(user_id=current_user.id).first()
+            routes = settings.routes if settings and settings.routes else []
+        
+        try:
+            keys = parse_routes(routes)
+        except ValueError as e:
+            emit('routes_subscribed', {'success': False, 'error': str(e)})
+            return
+        
+        subscribe_routes(keys)
+        
+        # Send the current positions on those routes so the client can draw them now
+        rooms = _route_rooms.get(request.sid, set())
+        vehicles = [v for v in get_cached_positions() if route_room(v.get('route')) in rooms]
+        emit('routes_subscribed', {
+            'success': True,
+            'routes': keys,
+            'vehicles': vehicles,
+            'count': len(vehicles),
+            'timestamp': time.time()
+        })
+        
+        current_app.logger.debug(f"Client {request.sid} following routes: {keys}")
+        
+    except Exception as e:
+        current_app.logger.error(f"Error handling route subscription: {str(e)}")
+
+def handle_subscribe_stops(data=None):
+    """Follow arrivals/departures at specific stops: {'stop_ids': [1, 2, ...]}.
+    
+    Route followers already get the events for their routes; this is for
+    clients waiting at a stop. An empty list stops following stops.
+    """
+    try:
+        stop_ids = data.get('stop_ids') if isinstance(data, dict) else None
+        if not isinstance(stop_ids, list) or len(stop_ids) > MAX_STOP_SUBSCRIPTIONS:
+            emit('stops_subscribed', {'success': False,
+                                      'error': f'stop_ids must be a list of at most {MAX_STOP_SUBSCRIPTIONS} ids'})
+            return
+        try:
+            rooms = {f"stop_{int(stop_id)}" for stop_id in stop_ids}
+        except (TypeError, ValueError):
+            emit('stops_subscribed', {'success': False, 'error': 'stop_ids must be integers'})
+            return
+        
+        previous = _stop_rooms.get(request.sid, set())
+        for room in previous - rooms:
+            leave_room(room)
+        for room in rooms - previous:
+            join_room(room)
+        if rooms:
+            _stop_rooms[request.sid] = rooms
+        else:
+            _stop_rooms.pop(request.sid, None)
+        
+        emit('stops_subscribed', {'success': True, 'stop_ids': sorted(int(r.split('_', 1)[1]) for r in rooms)})
+        
+    except Exception as e:
+        current_app.logger.error(f"Error handling stop subscription: {str(e)}")
+
+def _update_rooms(sid):
+    """Rooms the client currently receives vehicle_update through."""
+    if sid in _route_rooms:
+        return _route_rooms[sid]
+    return _viewport_rooms.get(sid, {ALL_VEHICLE_UPDATES_ROOM})
+
+def _switch_rooms(previous, rooms):
+    for room in previous - rooms:
+        leave_room(_wire_room(room))
+    for room in rooms - previous:
+        join_room(_wire_room(room))
+
+def subscribe_viewport(bbox):
+    """Move the current client into the tile rooms covering bbox."""
+    sid = request.sid
+    rooms = viewport_rooms(bbox)
+    
+    if rooms is None:
+        # Viewport too large for tile rooms; receive everything
+        rooms = {ALL_VEHICLE_UPDATES_ROOM}
+    
+    # Route subscriptions take precedence; the viewport applies once they're dropped
+    if sid not in _route_rooms:
+        _switch_rooms(_update_rooms(sid), rooms)
+    _viewport_rooms[sid] = rooms
+
+def subscribe_routes(keys):
+    """Move the current client into the rooms for the given route keys."""
+    sid = request.sid
+    previous = _update_rooms(sid)
+    
+    if keys:
+        rooms = {route_room(key) for key in keys}
+        _route_rooms[sid] = rooms
+    else:
+        _route_rooms.pop(sid, None)
+        rooms = _update_rooms(sid)
+    
+    _switch_rooms(previous, rooms)
+
+def vehicle_update_rooms(latitude, longitude, previous_latitude=None, previous_longitude=None, route=None):
+    """Rooms that should receive a vehicle_update for a vehicle at this position and route."""
+    rooms = [ALL_VEHICLE_UPDATES_ROOM]
+    if latitude is not None and longitude is not None:
+        rooms.extend(point_rooms(latitude, longitude))
+    if previous_latitude is not None and previous_longitude is not None:
+        rooms.extend(point_rooms(previous_latitude, previous_longitude))
+    if route_room(route):
+        rooms.append(route_room(route))
+    return rooms
+
 def update_vehicle_cache(vehicle):
     """Update the cache for a specific vehicle."""
     global vehicle_positions_cache
@@ -190,10 +516,13 @@ def update_vehicle_cache(vehicle):
         'last_updated': vehicle.last_updated.isoformat() if vehicle.last_updated else None,
         'speed_kmh': vehicle.last_speed_kmh
     }
+    if vehicle.current_latitude is not None and vehicle.current_longitude is not None:
+        vehicle_positions_index.upsert(vehicle.id, vehicle.current_latitude, vehicle.current_longitude,
+                                       vehicle_positions_cache[vehicle.id])
 
 def cache_vehicle_positions():
     """Cache all active vehicle positions."""
-    global vehicle_positions_cache, last_cache_update
+    global vehicle_positions_cache, vehicle_positions_index, last_cache_update
     
     # Skip if cache is still fresh
     current_time = time.time()
@@ -210,16 +539,19 @@ def cache_vehicle_positions():
         Trip.status == 'active'
     ).all()
     
-    # Update cache
+    # Update cache, leaving out vehicles that have gone offline
+    liveness.start(current_app._get_current_object())
     vehicle_positions_cache = {}
+    vehicle_positions_index = SpatialIndex()
     for vehicle in active_vehicles:
-        update_vehicle_cache(vehicle)
+        if not liveness.tracker.is_offline(vehicle.id):
+            update_vehicle_cache(vehicle)
     
     last_cache_update = current_time
     current_app.logger.debug(f"Vehicle positions cache updated with {len(vehicle_positions_cache)} vehicles")
 
-def get_cached_positions():
-    """Get cached vehicle positions or update cache if expired."""
+def get_cached_positions(bbox=None):
+    """Get cached vehicle positions (optionally only inside bbox) or update cache if expired."""
     global last_cache_update
     
     # Update cache if expired
@@ -227,6 +559,9 @@ def get_cached_positions():
     if current_time - last_cache_update > CACHE_EXPIRY or not vehicle_positions_cache:
         cache_vehicle_positions()
     
+    if bbox is not None:
+        return vehicle_positions_index.within(bbox)
+    
     # Return cached positions as a list
     return list(vehicle_positions_cache.values())
 
@@ -261,7 +596,7 @@ def handle_join_vehicle_room(data):
             return
         
         # Join the vehicle-specific room
-        join_room(f"vehicle_{vehicle_id}")
+        join_room(_wire_room(f"vehicle_{vehicle_id}"))
         current_app.logger.debug(f"Client {request.sid} joined vehicle room: vehicle_{vehicle_id}")
         
         # Send confirmation
@@ -281,13 +616,21 @@ def emit_vehicle_update(vehicle_id, update_type, data):
         # Import inside function to avoid circular import issues
         from app import socketio
         
-        if socketio:
+        if socketio and update_type in COALESCED_VEHICLE_EVENTS:
+            # Frequent updates (e.g. HTTP location fixes) go out at most once per tick
+            vehicle_broadcasts.start(socketio.start_background_task, socketio.sleep)
+            vehicle_broadcasts.enqueue(update_type, [f"vehicle_{vehicle_id}"], vehicle_id, {
+                'vehicle_id': vehicle_id,
+                'timestamp': time.time(),
+                **data
+            })
+        elif socketio:
             # Use socketio.emit() instead of emit() when called from HTTP routes
             socketio.emit(update_type, {
                 'vehicle_id': vehicle_id,
                 'timestamp': time.time(),
                 **data
-            }, room=f"vehicle_{vehicle_id}")
+            }, room=wire_rooms(f"vehicle_{vehicle_id}"))
             
             current_app.logger.debug(f"Emitted {update_type} for vehicle {vehicle_id}")
         else:
@@ -298,6 +641,94 @@ def emit_vehicle_update(vehicle_id, update_type, data):
     except Exception as e:
         current_app.logger.error(f"Error emitting vehicle update: {str(e)}")
 
+def emit_vehicle_route_change(vehicle, old_route):
+    """Tell old-route subscribers a vehicle left and new-route subscribers it arrived."""
+    try:
+        from app import socketio
+        
+        # Keep the positions cache in step so route filters see the new route
+        cached = vehicle_positions_cache.get(vehicle.id)
+        if cached is not None:
+            cached['route'] = vehicle.route
+        
+        rooms = vehicle_update_rooms(vehicle.current_latitude, vehicle.current_longitude, route=vehicle.route)
+        if route_room(old_route):
+            rooms.append(route_room(old_route))
+        
+        socketio.emit('vehicle_route_changed', {
+            'id': vehicle.id,
+            'old_route': old_route,
+            'route': vehicle.route,
+            'latitude': vehicle.current_latitude,
+            'longitude': vehicle.current_longitude,
+            'status': vehicle.status,
+            'occupancy_status': vehicle.occupancy_status,
+            'type': vehicle.vehicle_type,
+            'last_updated': vehicle.last_updated.isoformat() if vehicle.last_updated else None,
+            'timestamp': time.time()
+        }, room=wire_rooms(rooms))
+        
+        current_app.logger.debug(f"Vehicle {vehicle.id} moved from route {old_route!r} to {vehicle.route!r}")
+        
+    except ImportError:
+        current_app.logger.warning(f"SocketIO not available, skipping route change for vehicle {vehicle.id}")
+    except Exception as e:
+        current_app.logger.error(f"Error emitting route change: {str(e)}")
+
+def emit_vehicle_liveness(vehicle_id, previous, state, info=None):
+    """Announce a live/stale/offline transition to every client that can see the vehicle."""
+    try:
+        from app import socketio
+        
+        info = info or {}
+        if state == liveness.OFFLINE:
+            # Offline vehicles leave the positions cache like any other inactive vehicle
+            vehicle_positions_cache.pop(vehicle_id, None)
+            vehicle_positions_index.remove(vehicle_id)
+        
+        rooms = vehicle_update_rooms(info.get('latitude'), info.get('longitude'), route=info.get('route'))
+        rooms.append(f"vehicle_{vehicle_id}")
+        socketio.emit('vehicle_liveness', {
+            'id': vehicle_id,
+            'state': state,
+            'previous': previous,
+            'timestamp': time.time()
+        }, room=wire_rooms(rooms))
+        
+        current_app.logger.debug(f"Vehicle {vehicle_id} liveness {previous} -> {state}")
+        
+    except ImportError:
+        current_app.logger.warning(f"SocketIO not available, skipping liveness change for vehicle {vehicle_id}")
+    except Exception as e:
+        current_app.logger.error(f"Error emitting liveness change: {str(e)}")
+
+def emit_stop_event(event, payload):
+    """Send arrived_at_stop/departed_stop to the stop's, route's and vehicle's followers."""
+    try:
+        from app import socketio
+        
+        rooms = [f"vehicle_{payload['vehicle_id']}"]
+        if payload.get('route'):
+            rooms.append(route_room(payload['route']))
+        socketio.emit(event, payload, room=wire_rooms(rooms) + [f"stop_{payload['stop_id']}"])
+        
+        current_app.logger.debug(f"Vehicle {payload['vehicle_id']} {event} {payload['stop_id']}")
+        
+    except ImportError:
+        current_app.logger.warning(f"SocketIO not available, skipping {event}")
+    except Exception as e:
+        current_app.logger.error(f"Error emitting {event}: {str(e)}")
+
+def emit_route_headways(route, summary):
+    """Queue a route_headways event for the route's followers (coalesced per tick)."""
+    try:
+        from app import socketio
+        vehicle_broadcasts.start(socketio.start_background_task, socketio.sleep)
+        vehicle_broadcasts.enqueue('route_headways', wire_rooms([route_room(route)]), route,
+                                   {**summary, 'timestamp': time.time()})
+    except Exception as e:
+        current_app.logger.error(f"Error emitting route headways: {str(e)}")
+
 def emit_trip_update(vehicle_id, update_type, data):
     """Emit trip update to all clients in the vehicle's room."""
     try:
@@ -311,7 +742,7 @@ def emit_trip_update(vehicle_id, update_type, data):
                 'update_type': update_type,
                 'timestamp': time.time(),
                 **data
-            }, room=f"vehicle_{vehicle_id}")
+            }, room=wire_rooms(f"vehicle_{vehicle_id}"))
             
             current_app.logger.debug(f"Emitted trip update {update_type} for vehicle {vehicle_id}")
         else:
@@ -335,7 +766,7 @@ def emit_passenger_event(vehicle_id, event_type, data):
                 'event_type': event_type,
                 'timestamp': time.time(),
                 **data
-            }, room=f"vehicle_{vehicle_id}")
+            }, room=wire_rooms(f"vehicle_{vehicle_id}"))
             
             current_app.logger.debug(f"Emitted passenger event {event_type} for vehicle {vehicle_id}")
         else:
@@ -361,9 +792,9 @@ def handle_driver_vehicle_update(data):
             current_app.logger.warning(f"Invalid driver vehicle update data: {data}")
             return
         
-        # Get the vehicle and check assignment
-        vehicle = Vehicle.query.get(vehicle_id)
-        if not vehicle or vehicle.assigned_driver_id != current_user.id:
+        # Check assignment
+        access = get_vehicle_access(vehicle_id)
+        if not access or access.driver_id != current_user.id:
             current_app.logger.warning(f"Driver not assigned to vehicle: {vehicle_id}")
             return
         
@@ -371,16 +802,17 @@ def handle_driver_vehicle_update(data):
         if update_type == 'occupancy_change':
             new_status = update_data.get('occupancy_status')
             if new_status in ['vacant', 'full']:
+                vehicle = Vehicle.query.get(vehicle_id)
                 vehicle.occupancy_status = new_status
                 vehicle.last_updated = datetime.utcnow()
                 db.session.commit()
                 
-                # Emit update to all clients
-                emit('vehicle_update', {
-                    'id': vehicle.id,
+                # Queue the update for every client that can see the vehicle
+                queue_vehicle_update(vehicle.id, {
                     'occupancy_status': new_status,
                     'last_updated': vehicle.last_updated.isoformat()
-                }, room='all_clients')
+                }, vehicle_update_rooms(vehicle.current_latitude, vehicle.current_longitude,
+                                        route=vehicle.route))
                 
                 current_app.logger.debug(f"Driver updated vehicle {vehicle_id} occupancy to {new_status}")
         
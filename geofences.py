@@ -0,0 +1,364 @@
+"""
+Stop geofences and arrival/departure detection
+
+Stops (models.stop.Stop) are circles or polygons. The registry buckets
+each geofence into every grid cell its bounding box touches, so checking a
+fix only tests the handful of geofences in the fix's cell instead of every
+stop.
+
+Every committed vehicle position change is run through StopTracker (a
+flush listener, like liveness, so all ingestion paths are covered; batch
+uploads also feed their intermediate fixes). A vehicle that enters a stop
+emits arrived_at_stop; leaving it again emits departed_stop with the dwell
+time, and the completed visit is queued for a background writer that
+bulk-inserts StopVisit rows. Leaving a circle needs EXIT_MARGIN_M of extra
+distance, so GPS jitter at the edge doesn't flap.
+
+Open visits live in memory; a visit in progress during a restart is not
+recorded.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from commit_hooks import after_commit
+from models import db
+from models.stop import Stop, StopVisit
+from models.vehicle import Vehicle
+from route_rooms import route_key
+
+logger = logging.getLogger(__name__)
+
+CELL_DEG = 0.01  # ~1.1 km grid cells
+EXIT_MARGIN_M = 15.0
+EARTH_RADIUS_M = 6371000.0
+
+VISIT_FLUSH_INTERVAL = 5.0  # seconds between StopVisit bulk inserts
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance; accurate to well under a metre at stop scale."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def _in_polygon(lat, lon, polygon):
+    """Ray casting point-in-polygon test over [[lat, lon], ...]."""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat) and \
+                lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+            inside = not inside
+        j = i
+    return inside
+
+
+class Geofence:
+    __slots__ = ('id', 'name', 'route', 'latitude', 'longitude', 'radius_m', 'polygon', 'bbox')
+
+    def __init__(self, id, name, route, latitude, longitude, radius_m=50.0, polygon=None):
+        self.id = id
+        self.name = name
+        self.route = route_key(route) if route else None
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_m = radius_m or 50.0
+        self.polygon = [tuple(point) for point in polygon] if polygon and len(polygon) >= 3 else None
+        if self.polygon:
+            lats = [p[0] for p in self.polygon]
+            lons = [p[1] for p in self.polygon]
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        else:
+            # Include the exit margin so a vehicle on its way out is still found
+            reach = self.radius_m + EXIT_MARGIN_M
+            dlat = math.degrees(reach / EARTH_RADIUS_M)
+            dlon = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+            self.bbox = (latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.id, row.name, row.route, row.latitude, row.longitude, row.radius_m, row.polygon)
+
+    def serves(self, route):
+        return self.route is None or self.route == route
+
+    def contains(self, lat, lon, margin_m=0.0):
+        if self.polygon:
+            return _in_polygon(lat, lon, self.polygon)
+        return _distance_m(self.latitude, self.longitude, lat, lon) <= self.radius_m + margin_m
+
+
+def _cell(lat, lon):
+    return (math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG))
+
+
+class GeofenceIndex:
+    """Geofences bucketed by grid cell."""
+
+    def __init__(self, geofences=()):
+        self._fences = {}
+        self._cells = {}
+        for fence in geofences:
+            self._fences[fence.id] = fence
+            south, west = _cell(fence.bbox[0], fence.bbox[1])
+            north, east = _cell(fence.bbox[2], fence.bbox[3])
+            for row in range(south, north + 1):
+                for col in range(west, east + 1):
+                    self._cells.setdefault((row, col), []).append(fence)
+
+    def __len__(self):
+        return len(self._fences)
+
+    def get(self, stop_id):
+        return self._fences.get(stop_id)
+
+    def containing(self, lat, lon, route=None):
+        """Geofences serving route that contain the point, nearest first."""
+        found = [fence for fence in self._cells.get(_cell(lat, lon), ())
+                 if fence.serves(route) and fence.contains(lat, lon)]
+        found.sort(key=lambda fence: _distance_m(fence.latitude, fence.longitude, lat, lon))
+        return found
+
+
+class StopTracker:
+    """Per-vehicle arrival/departure state machine over a GeofenceIndex."""
+
+    def __init__(self, on_event=None, on_visit=None):
+        self._index = GeofenceIndex()
+        self._current = {}  # vehicle_id -> (stop_id, arrived_at, route)
+        self._lock = threading.Lock()
+        # on_event(event_name, payload); on_visit(row dict for StopVisit)
+        self._on_event = on_event
+        self._on_visit = on_visit
+        self.loaded = False
+        self.arrivals = 0
+        self.departures = 0
+
+    def load(self, geofences):
+        with self._lock:
+            self._index = GeofenceIndex(geofences)
+            self.loaded = True
+
+    def current_stop(self, vehicle_id):
+        entry = self._current.get(vehicle_id)
+        return entry[0] if entry else None
+
+    def observe(self, vehicle_id, route, lat, lon, when=None):
+        """Run one fix through the state machine. Returns the (event, payload) pairs emitted."""
+        if lat is None or lon is None:
+            return []
+        when = when or datetime.utcnow()
+        key = route_key(route) if route else None
+        events = []
+        with self._lock:
+            current = self._current.get(vehicle_id)
+            if current is not None:
+                stop_id, arrived_at, visit_route = current
+                fence = self._index.get(stop_id)
+                if fence is not None and fence.serves(key) and fence.contains(lat, lon, EXIT_MARGIN_M):
+                    return []
+                del self._current[vehicle_id]
+                dwell = max(0.0, (when - arrived_at).total_seconds())
+                self.departures += 1
+                events.append(('departed_stop', {
+                    'vehicle_id': vehicle_id,
+                    'stop_id': stop_id,
+                    'stop_name': fence.name if fence else None,
+                    'route': visit_route,
+                    'arrived_at': arrived_at.isoformat(),
+                    'timestamp': when.isoformat(),
+                    'dwell_seconds': round(dwell, 1)
+                }))
+                if fence is not None and self._on_visit is not None:
+                    self._on_visit({
+                        'stop_id': stop_id,
+                        'vehicle_id': vehicle_id,
+                        'route': visit_route,
+                        'arrived_at': arrived_at,
+                        'departed_at': when,
+                        'dwell_seconds': dwell
+                    })
+
+            inside = self._index.containing(lat, lon, key)
+            if inside:
+                fence = inside[0]
+                self._current[vehicle_id] = (fence.id, when, route)
+                self.arrivals += 1
+                events.append(('arrived_at_stop', {
+                    'vehicle_id': vehicle_id,
+                    'stop_id': fence.id,
+                    'stop_name': fence.name,
+                    'route': route,
+                    'timestamp': when.isoformat()
+                }))
+
+        if self._on_event is not None:
+            for name, payload in events:
+                try:
+                    self._on_event(name, payload)
+                except Exception as e:
+                    logger.error(f"Stop event {name} failed: {e}")
+        return events
+
+    def forget(self, vehicle_id):
+        with self._lock:
+            self._current.pop(vehicle_id, None)
+
+    def stats(self):
+        return {
+            'stops': len(self._index),
+            'vehicles_at_stops': len(self._current),
+            'arrivals': self.arrivals,
+            'departures': self.departures,
+            'pending_visits': len(visit_writer._pending)
+        }
+
+
+class VisitWriter:
+    """Collects completed visits and bulk-inserts them from a background thread."""
+
+    def __init__(self, interval=VISIT_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self.written = 0
+
+    def add(self, row):
+        with self._lock:
+            self._pending.append(row)
+
+    def drop_vehicle(self, vehicle_id):
+        with self._lock:
+            self._pending = [row for row in self._pending if row['vehicle_id'] != vehicle_id]
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, name='stop-visit-writer', daemon=True)
+            self._thread.start()
+
+    def flush(self):
+        """Insert every pending visit in one transaction. Needs an app context."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            # A vehicle or stop deleted since the visit was queued would fail the whole batch
+            vehicle_ids = {row[0] for row in db.session.query(Vehicle.id).filter(
+                Vehicle.id.in_({row['vehicle_id'] for row in rows}))}
+            stop_ids = {row[0] for row in db.session.query(Stop.id).filter(
+                Stop.id.in_({row['stop_id'] for row in rows}))}
+            rows = [row for row in rows if row['vehicle_id'] in vehicle_ids and row['stop_id'] in stop_ids]
+            db.session.bulk_insert_mappings(StopVisit, rows)
+            db.session.commit()
+            self.written += len(rows)
+            return len(rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Writing {len(rows)} stop visits failed: {e}")
+            return 0
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._app.app_context():
+                try:
+                    self.flush()
+                finally:
+                    db.session.remove()
+
+
+def _emit(name, payload):
+    from events_optimized import emit_stop_event
+    emit_stop_event(name, payload)
+
+
+visit_writer = VisitWriter()
+tracker = StopTracker(on_event=_emit, on_visit=visit_writer.add)
+
+
+def reload_stops():
+    """(Re)load every stop into the tracker. Needs an app context.
+
+    Reads through its own connection, so it can run from after-commit hooks.
+    """
+    with db.engine.connect() as connection:
+        rows = connection.execute(Stop.__table__.select()).fetchall()
+    tracker.load([Geofence.from_row(row) for row in rows])
+
+
+def _ensure_started():
+    from flask import current_app, has_app_context
+    if not has_app_context():
+        return False
+    visit_writer.start(current_app._get_current_object())
+    if not tracker.loaded:
+        reload_stops()
+    return True
+
+
+def remove_vehicle(vehicle_id):
+    """Delete a vehicle's StopVisit rows before the vehicle itself is deleted.
+
+    Runs in the caller's transaction; the vehicle's open and queued visits are
+    dropped by the flush listener once the vehicle's delete commits.
+    """
+    StopVisit.query.filter_by(vehicle_id=vehicle_id).delete(synchronize_session=False)
+
+
+def _forget_vehicles(vehicle_ids):
+    for vehicle_id in vehicle_ids:
+        tracker.forget(vehicle_id)
+        visit_writer.drop_vehicle(vehicle_id)
+
+
+def observe_fixes(vehicle_id, route, fixes):
+    """Feed (lat, lon, timestamp) fixes, oldest first, through the tracker."""
+    if not _ensure_started():
+        return
+    for lat, lon, when in fixes:
+        tracker.observe(vehicle_id, route, lat, lon, when)
+
+
+def _apply_positions(positions):
+    if not _ensure_started():
+        return
+    for vehicle_id, route, lat, lon, when in positions:
+        tracker.observe(vehicle_id, route, lat, lon, when)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_positions(session, flush_context):
+    positions = []
+    for obj in session.dirty:
+        if isinstance(obj, Vehicle):
+            attrs = inspect(obj).attrs
+            if attrs.current_latitude.history.has_changes() or attrs.current_longitude.history.has_changes():
+                positions.append((obj.id, obj.route, obj.current_latitude, obj.current_longitude,
+                                  obj.last_updated))
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Vehicle)]
+    if deleted:
+        after_commit(session, _forget_vehicles, deleted)
+    stops_changed = any(isinstance(obj, Stop) for obj in
+                        list(session.new) + list(session.dirty) + list(session.deleted))
+    if stops_changed:
+        after_commit(session, reload_stops)
+    if positions:
+        after_commit(session, _apply_positions, positions)
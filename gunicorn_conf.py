@@ -0,0 +1,34 @@
+"""
+Gunicorn settings, chosen from SOCKETIO_ASYNC_MODE
+
+    gunicorn --config gunicorn_conf.py wsgi:app
+
+threading: one gthread worker with 32 threads (each connection holds a thread).
+gevent/eventlet: one evented worker holding up to GUNICORN_WORKER_CONNECTIONS
+connections; the worker monkey-patches the standard library before loading
+the app.
+"""
+import os
+
+from async_server import ASYNC_MODE, is_evented, worker_class as worker_class_for
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Socket.IO keeps client state in process memory, so stay on one worker
+# unless a message queue is configured
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_class = worker_class_for(ASYNC_MODE)
+
+if is_evented(ASYNC_MODE):
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 10000))
+    # Recycling the worker would drop every open socket at once
+    max_requests = 0
+else:
+    threads = int(os.environ.get('GUNICORN_THREADS', 32))
+    worker_connections = 1000
+    max_requests = 1000
+    max_requests_jitter = 100
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 60
+loglevel = 'info'
@@ -0,0 +1,286 @@
+"""
+Live headway and bunching analytics per route
+
+For every route, vehicles are kept ordered by how far along the route line
+they are. The route line is the straight segment between the origin and
+destination coordinates in the vehicles' route_info (the only route
+geometry stored), so positions are a projection onto it: good enough to
+order vehicles and measure the gaps between them, not a road distance.
+
+Each committed position change (a flush listener, like liveness and
+geofences) moves one vehicle in its route's sorted list. Only the gaps
+next to the vehicle's old and new places are recomputed, so a fix costs
+O(log n) to find its place plus constant gap work.
+
+A vehicle's headway is the gap to the vehicle ahead of it, in metres and
+(when it's moving) in seconds at its current speed. Gaps below
+BUNCHING_GAP_M are flagged as bunched, and gaps above GAP_FACTOR times the
+route's mean gap as gaps. Changes are pushed as route_headways socket
+events to the route's room, and served at /operator/routes/<route>/headways.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from commit_hooks import after_commit
+from models.vehicle import Vehicle
+from route_rooms import route_key
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+
+BUNCHING_GAP_M = float(os.environ.get('HEADWAY_BUNCHING_METERS', 300))
+GAP_FACTOR = 2.0
+# Vehicles further than this from the route line are off-route and not ranked
+MAX_OFFSET_M = float(os.environ.get('HEADWAY_MAX_OFFSET_METERS', 2000))
+MIN_MOVING_KMH = 3.0
+
+
+class RouteLine:
+    """Straight origin -> destination segment in a local flat projection."""
+
+    def __init__(self, origin, destination):
+        self.origin = origin
+        self.destination = destination
+        self._lat0 = math.radians(origin[0])
+        self._cos = math.cos(self._lat0)
+        self._dx, self._dy = self._xy(*destination)
+        self.length_m = math.hypot(self._dx, self._dy)
+
+    @classmethod
+    def from_route_info(cls, route_info):
+        """A RouteLine from route_info JSON (origin_coords/dest_coords), or None."""
+        try:
+            info = json.loads(route_info) if isinstance(route_info, str) else route_info
+            origin = info.get('origin_coords') or {}
+            destination = info.get('dest_coords') or {}
+            line = cls((float(origin['lat']), float(origin['lon'])),
+                       (float(destination['lat']), float(destination['lon'])))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        return line if line.length_m > 0 else None
+
+    def _xy(self, lat, lon):
+        return (EARTH_RADIUS_M * math.radians(lon - self.origin[1]) * self._cos,
+                EARTH_RADIUS_M * (math.radians(lat) - self._lat0))
+
+    def project(self, lat, lon):
+        """(metres along the line clamped to it, metres off the line)."""
+        x, y = self._xy(lat, lon)
+        t = max(0.0, min(1.0, (x * self._dx + y * self._dy) / (self.length_m ** 2)))
+        return t * self.length_m, math.hypot(x - t * self._dx, y - t * self._dy)
+
+
+class RouteHeadways:
+    """Vehicles on one route, ordered by position along its line, with the gap ahead of each."""
+
+    def __init__(self, route, line):
+        self.route = route
+        self.line = line
+        self._order = []     # sorted [(along_m, vehicle_id)]
+        self._vehicles = {}  # vehicle_id -> (along_m, speed_kmh, last_seen)
+        self._gaps = {}      # vehicle_id -> metres to the vehicle ahead (absent for the leader)
+        self._gap_total = 0.0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def update(self, vehicle_id, lat, lon, speed_kmh=None, when=None):
+        """Move a vehicle to a new fix. Returns False if it's off the route line."""
+        along, offset = self.line.project(lat, lon)
+        if offset > MAX_OFFSET_M:
+            self.remove(vehicle_id)
+            return False
+        self._take(vehicle_id)
+        bisect.insort(self._order, (along, vehicle_id))
+        self._vehicles[vehicle_id] = (along, speed_kmh, when or time.time())
+        index = self._index(vehicle_id, along)
+        self._refresh_gap(index - 1)
+        self._refresh_gap(index)
+        self.version += 1
+        return True
+
+    def remove(self, vehicle_id):
+        if self._take(vehicle_id):
+            self.version += 1
+
+    def _take(self, vehicle_id):
+        entry = self._vehicles.pop(vehicle_id, None)
+        if entry is None:
+            return False
+        index = self._index(vehicle_id, entry[0])
+        del self._order[index]
+        self._set_gap(vehicle_id, None)
+        # The vehicle behind now follows whoever was ahead of the removed one
+        self._refresh_gap(index - 1)
+        return True
+
+    def _index(self, vehicle_id, along):
+        return bisect.bisect_left(self._order, (along, vehicle_id))
+
+    def _refresh_gap(self, index):
+        if 0 <= index < len(self._order):
+            along, vehicle_id = self._order[index]
+            ahead = self._order[index + 1][0] - along if index + 1 < len(self._order) else None
+            self._set_gap(vehicle_id, ahead)
+
+    def _set_gap(self, vehicle_id, gap):
+        self._gap_total -= self._gaps.pop(vehicle_id, 0.0)
+        if gap is not None:
+            self._gaps[vehicle_id] = gap
+            self._gap_total += gap
+
+    def mean_gap(self):
+        return self._gap_total / len(self._gaps) if self._gaps else None
+
+    def summary(self):
+        """Vehicles from the front of the route back, with gaps and flags."""
+        mean = self.mean_gap()
+        vehicles, bunched, gaps = [], [], []
+        for along, vehicle_id in reversed(self._order):
+            _, speed_kmh, last_seen = self._vehicles[vehicle_id]
+            gap = self._gaps.get(vehicle_id)
+            headway_s = None
+            if gap is not None and speed_kmh and speed_kmh >= MIN_MOVING_KMH:
+                headway_s = round(gap / (speed_kmh / 3.6))
+            state = None
+            if gap is not None and gap < BUNCHING_GAP_M:
+                state = 'bunched'
+                bunched.append(vehicle_id)
+            elif gap is not None and mean and len(self._gaps) > 1 and gap > GAP_FACTOR * mean:
+                state = 'gap'
+                gaps.append(vehicle_id)
+            vehicles.append({
+                'id': vehicle_id,
+                'position_m': round(along),
+                'gap_ahead_m': round(gap) if gap is not None else None,
+                'headway_s': headway_s,
+                'speed_kmh': round(speed_kmh, 1) if speed_kmh else None,
+                'state': state
+            })
+        return {
+            'route': self.route,
+            'route_length_m': round(self.line.length_m),
+            'vehicles': vehicles,
+            'count': len(vehicles),
+            'mean_gap_m': round(mean) if mean is not None else None,
+            'bunched': bunched,
+            'gaps': gaps,
+            'version': self.version
+        }
+
+
+class HeadwayTracker:
+    """RouteHeadways for every route, fed one fix at a time."""
+
+    def __init__(self, on_change=None):
+        self._routes = {}    # route key -> RouteHeadways
+        self._vehicle_routes = {}  # vehicle_id -> route key
+        self._lock = threading.Lock()
+        self._on_change = on_change  # on_change(route_key, summary)
+
+    def observe(self, vehicle_id, route, route_info, lat, lon, speed_kmh=None):
+        key = route_key(route)
+        changed = []
+        with self._lock:
+            previous = self._vehicle_routes.get(vehicle_id)
+            if previous is not None and previous != key:
+                self._routes[previous].remove(vehicle_id)
+                del self._vehicle_routes[vehicle_id]
+                changed.append(previous)
+            if key is not None and lat is not None and lon is not None:
+                headways = self._route(key, route_info)
+                if headways is not None:
+                    if headways.update(vehicle_id, lat, lon, speed_kmh):
+                        self._vehicle_routes[vehicle_id] = key
+                    else:
+                        self._vehicle_routes.pop(vehicle_id, None)
+                    changed.append(key)
+            summaries = [(k, self._routes[k].summary()) for k in changed]
+        self._announce(summaries)
+
+    def forget(self, vehicle_id):
+        with self._lock:
+            key = self._vehicle_routes.pop(vehicle_id, None)
+            if key is None:
+                return
+            self._routes[key].remove(vehicle_id)
+            summary = self._routes[key].summary()
+        self._announce([(key, summary)])
+
+    def _route(self, key, route_info):
+        # Caller holds the lock. The first vehicle with route coordinates defines the line.
+        headways = self._routes.get(key)
+        if headways is None:
+            line = RouteLine.from_route_info(route_info) if route_info else None
+            if line is None:
+                return None
+            headways = self._routes[key] = RouteHeadways(key, line)
+        return headways
+
+    def has_route(self, route):
+        return route_key(route) in self._routes
+
+    def summary(self, route):
+        with self._lock:
+            headways = self._routes.get(route_key(route))
+            return headways.summary() if headways is not None else None
+
+    def _announce(self, summaries):
+        if self._on_change is None:
+            return
+        for key, summary in summaries:
+            try:
+                self._on_change(key, summary)
+            except Exception as e:
+                logger.error(f"route_headways for {key} failed: {e}")
+
+
+def _emit(key, summary):
+    from events_optimized import emit_route_headways
+    emit_route_headways(key, summary)
+
+
+tracker = HeadwayTracker(on_change=_emit)
+
+
+def load_route(route):
+    """Seed a route the tracker hasn't seen yet from the database. Needs an app context."""
+    if tracker.has_route(route):
+        return
+    key = route_key(route)
+    vehicles = [v for v in Vehicle.query.filter(
+        Vehicle.route.isnot(None),
+        Vehicle.status.in_(['active', 'delayed'])
+    ).all() if route_key(v.route) == key]
+    for vehicle in vehicles:
+        tracker.observe(vehicle.id, vehicle.route, vehicle.route_info,
+                        vehicle.current_latitude, vehicle.current_longitude, vehicle.last_speed_kmh)
+
+
+def _apply_positions(positions):
+    for position in positions:
+        tracker.observe(*position)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_positions(session, flush_context):
+    positions = []
+    for obj in session.dirty:
+        if isinstance(obj, Vehicle):
+            attrs = inspect(obj).attrs
+            if attrs.current_latitude.history.has_changes() or attrs.current_longitude.history.has_changes() \
+                    or attrs.route.history.has_changes():
+                positions.append((obj.id, obj.route, obj.route_info, obj.current_latitude,
+                                  obj.current_longitude, obj.last_speed_kmh))
+    if positions:
+        after_commit(session, _apply_positions, positions)
@@ -0,0 +1,259 @@
+"""
+Vehicle liveness tracking
+
+A vehicle whose driver's phone dies keeps its last position and "active"
+status forever. The tracker keeps each vehicle's last report time and moves
+it through live -> stale -> offline as reports stop coming:
+
+- live: reported within STALE_AFTER seconds
+- stale: silent for STALE_AFTER seconds (shown, but greyed out by clients)
+- offline: silent for OFFLINE_AFTER seconds (hidden from the public feeds)
+
+Deadlines sit in a min-heap, so a report costs one O(log n) push and a
+sweep only looks at vehicles whose deadline has passed. Superseded heap
+entries are skipped when popped. Each transition calls on_change once;
+read endpoints ask the tracker for a vehicle's state instead of
+re-filtering rows by timestamp.
+
+Reports are picked up automatically: a flush listener notices every commit
+that changes Vehicle.last_updated, from any ingestion path.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from commit_hooks import after_commit
+from models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+LIVE = 'live'
+STALE = 'stale'
+OFFLINE = 'offline'
+
+STALE_AFTER = float(os.environ.get('LIVENESS_STALE_SECONDS', 60))
+OFFLINE_AFTER = float(os.environ.get('LIVENESS_OFFLINE_SECONDS', 300))
+
+# Longest the sweeper sleeps between checks
+MAX_SWEEP_INTERVAL = 5.0
+
+
+def to_epoch(value):
+    """Epoch seconds for a naive-UTC datetime (as stored on Vehicle.last_updated)."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class LivenessTracker:
+    """live -> stale -> offline state machine driven by a deadline min-heap."""
+
+    def __init__(self, stale_after=STALE_AFTER, offline_after=OFFLINE_AFTER, on_change=None,
+                 name='vehicle-liveness'):
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.name = name
+        # on_change(changes) receives a list of (vehicle_id, previous, state, info)
+        self._on_change = on_change
+        self._heap = []      # (deadline, vehicle_id, generation)
+        self._entries = {}   # vehicle_id -> [last_seen, state, generation, info]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self.transitions = {STALE: 0, OFFLINE: 0, LIVE: 0}
+
+    def state(self, vehicle_id):
+        """Current state, or None for vehicles that haven't been seen yet."""
+        entry = self._entries.get(vehicle_id)
+        return entry[1] if entry is not None else None
+
+    def is_offline(self, vehicle_id):
+        return self.state(vehicle_id) == OFFLINE
+
+    def touch(self, vehicle_id, last_seen=None, info=None, now=None, announce=True):
+        """Record a report from a vehicle. info (e.g. position) is passed to on_change."""
+        now = time.time() if now is None else now
+        last_seen = now if last_seen is None else last_seen
+        changes = []
+        with self._lock:
+            entry = self._entries.get(vehicle_id)
+            if entry is not None and last_seen < entry[0]:
+                return  # Older than what we already have
+            previous = entry[1] if entry is not None else None
+            generation = entry[2] + 1 if entry is not None else 0
+            self._entries[vehicle_id] = [last_seen, LIVE, generation, info]
+            heapq.heappush(self._heap, (last_seen + self.stale_after, vehicle_id, generation))
+            if previous not in (None, LIVE):
+                self.transitions[LIVE] += 1
+                changes.append((vehicle_id, previous, LIVE, info))
+            self._compact()
+        if last_seen + self.stale_after <= now:
+            # A report that is already old should land in its real state right away
+            changes.extend(self.sweep(now, announce=False))
+        if announce:
+            self._announce(changes)
+
+    def forget(self, vehicle_id):
+        with self._lock:
+            self._entries.pop(vehicle_id, None)
+
+    def sweep(self, now=None, announce=True):
+        """Apply every transition whose deadline has passed. Returns the changes."""
+        now = time.time() if now is None else now
+        changes = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, vehicle_id, generation = heapq.heappop(self._heap)
+                entry = self._entries.get(vehicle_id)
+                if entry is None or entry[2] != generation:
+                    continue  # Superseded by a newer report
+                last_seen, state, _, info = entry
+                if state == LIVE:
+                    entry[1] = STALE
+                    heapq.heappush(self._heap, (last_seen + self.offline_after, vehicle_id, generation))
+                elif state == STALE:
+                    entry[1] = OFFLINE
+                else:
+                    continue
+                self.transitions[entry[1]] += 1
+                changes.append((vehicle_id, state, entry[1], info))
+        if announce:
+            self._announce(changes)
+        return changes
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def counts(self):
+        with self._lock:
+            counts = {LIVE: 0, STALE: 0, OFFLINE: 0}
+            for entry in self._entries.values():
+                counts[entry[1]] += 1
+            return counts
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'vehicles': self.counts(),
+            'transitions': dict(self.transitions),
+            'heap_size': len(self._heap),
+            'stale_after': self.stale_after,
+            'offline_after': self.offline_after
+        }
+
+    def start(self, app, seed=None):
+        """Start the sweeper once. seed() returns (vehicle_id, last_seen, info) rows to load first."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, args=(seed,), name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self, seed):
+        if seed is not None:
+            with self._app.app_context():
+                try:
+                    for vehicle_id, last_seen, info in seed():
+                        self.touch(vehicle_id, last_seen, info, announce=False)
+                except Exception as e:
+                    self._app.logger.error(f"{self.name}: seeding failed: {e}")
+        while True:
+            deadline = self.next_deadline()
+            timeout = MAX_SWEEP_INTERVAL if deadline is None else \
+                min(MAX_SWEEP_INTERVAL, max(0.0, deadline - time.time()))
+            self._wake.wait(timeout)
+            self._wake.clear()
+            with self._app.app_context():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    self._app.logger.error(f"{self.name}: sweep failed: {e}")
+
+    def _announce(self, changes):
+        if changes and self._on_change is not None:
+            try:
+                self._on_change(changes)
+            except Exception as e:
+                logger.error(f"{self.name}: on_change failed: {e}")
+
+    def _compact(self):
+        # Caller holds the lock. Drop superseded entries once they dominate the heap.
+        if len(self._heap) > 4 * len(self._entries) + 1024:
+            live = {(vehicle_id, entry[2]) for vehicle_id, entry in self._entries.items()}
+            self._heap = [item for item in self._heap if (item[1], item[2]) in live]
+            heapq.heapify(self._heap)
+
+
+def _announce_changes(changes):
+    from events_optimized import emit_vehicle_liveness
+    for vehicle_id, previous, state, info in changes:
+        emit_vehicle_liveness(vehicle_id, previous, state, info)
+    # Offline vehicles no longer hold a place in their route's headways
+    import headways
+    for vehicle_id, _, state, _ in changes:
+        if state == OFFLINE:
+            headways.tracker.forget(vehicle_id)
+    # The public feed hides offline vehicles; rebuild it now rather than on its next tick
+    from routes.public import clear_vehicle_cache
+    clear_vehicle_cache()
+
+
+tracker = LivenessTracker(on_change=_announce_changes)
+
+
+def _vehicle_info(vehicle):
+    return {
+        'latitude': vehicle.current_latitude,
+        'longitude': vehicle.current_longitude,
+        'route': vehicle.route
+    }
+
+
+def seed_from_database():
+    """Current vehicles and their last report times, for the sweeper's first load."""
+    rows = Vehicle.query.filter(
+        Vehicle.status.in_(['active', 'delayed']),
+        Vehicle.last_updated.isnot(None)
+    ).all()
+    return [(v.id, to_epoch(v.last_updated), _vehicle_info(v)) for v in rows]
+
+
+def start(app):
+    tracker.start(app, seed=seed_from_database)
+
+
+def _apply_reports(reports):
+    from flask import current_app, has_app_context
+    if has_app_context():
+        start(current_app._get_current_object())
+    for vehicle_id, last_seen, info in reports:
+        tracker.touch(vehicle_id, last_seen, info)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_reports(session, flush_context):
+    reports = []
+    for obj in session.new:
+        if isinstance(obj, Vehicle) and obj.last_updated is not None:
+            reports.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Vehicle) and inspect(obj).attrs.last_updated.history.has_changes() \
+                and obj.last_updated is not None:
+            reports.append(obj)
+    if reports:
+        after_commit(session, _apply_reports,
+                     [(v.id, to_epoch(v.last_updated), _vehicle_info(v)) for v in reports])
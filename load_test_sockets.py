@@ -0,0 +1,154 @@
+"""
+Idle Socket.IO connection load test
+
+Opens many WebSocket Socket.IO connections, keeps them idle (answering
+server pings) for a while, and reports how many stayed connected plus the
+server process' memory if its pid is given.
+
+    SOCKETIO_ASYNC_MODE=gevent gunicorn --config gunicorn_conf.py wsgi:app
+    python load_test_sockets.py --url http://127.0.0.1:5000 --clients 3000 --hold 60 --pid <worker pid>
+
+Uses only the standard library (asyncio and a minimal WebSocket client), so
+it can run from any machine. Raise the open-files limit (ulimit -n) on both
+ends for large client counts.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import struct
+import time
+from urllib.parse import urlparse
+
+
+def _frame(text):
+    """Encode a masked client text frame."""
+    payload = text.encode('utf-8')
+    mask = os.urandom(4)
+    header = bytes([0x81])
+    if len(payload) < 126:
+        header += bytes([0x80 | len(payload)])
+    elif len(payload) < 65536:
+        header += bytes([0x80 | 126]) + struct.pack('!H', len(payload))
+    else:
+        header += bytes([0x80 | 127]) + struct.pack('!Q', len(payload))
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return header + mask + masked
+
+
+async def _read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    payload = await reader.readexactly(length)
+    return first & 0x0f, payload
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.open = 0
+        self.failed = 0
+        self.pongs = 0
+        self.errors = {}
+
+    def error(self, e):
+        name = type(e).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def idle_client(host, port, path, hold, stats, start_gate):
+    await start_gate.wait()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 30)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET {path}?EIO=4&transport=websocket HTTP/1.1\r\n"
+                      f"Host: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        status = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 30)
+        if b' 101 ' not in status.split(b'\r\n', 1)[0]:
+            raise ConnectionError(status.split(b'\r\n', 1)[0].decode(errors='replace'))
+
+        _, opening = await asyncio.wait_for(_read_frame(reader), 30)  # Engine.IO open: 0{...}
+        writer.write(_frame('40'))                                   # Socket.IO connect
+        connected = False
+        deadline = time.time() + hold
+        while time.time() < deadline:
+            try:
+                opcode, payload = await asyncio.wait_for(_read_frame(reader), deadline - time.time())
+            except asyncio.TimeoutError:
+                break
+            if opcode == 0x8:
+                raise ConnectionError('server closed the socket')
+            if payload == b'2':
+                writer.write(_frame('3'))  # Engine.IO ping -> pong
+                stats.pongs += 1
+            elif payload.startswith(b'40') and not connected:
+                connected = True
+                stats.connected += 1
+                stats.open += 1
+        if not connected:
+            raise ConnectionError('no Socket.IO connect ack')
+        stats.open -= 1
+        writer.close()
+    except Exception as e:
+        stats.failed += 1
+        stats.error(e)
+        return
+    return True
+
+
+def _rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+async def main(args):
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+    stats = Stats()
+    gate = asyncio.Event()
+    rss_before = _rss_mb(args.pid) if args.pid else None
+
+    tasks = [asyncio.create_task(idle_client(host, port, args.path, args.hold, stats, gate))
+             for _ in range(args.clients)]
+    started = time.time()
+    gate.set()
+
+    # Report while the sockets are held open
+    peak_open, peak_rss = 0, rss_before
+    while not all(task.done() for task in tasks):
+        await asyncio.sleep(min(5, args.hold))
+        rss = _rss_mb(args.pid) if args.pid else None
+        if stats.open >= peak_open:
+            peak_open, peak_rss = stats.open, rss or peak_rss
+        print(f"[{time.time() - started:5.1f}s] open={stats.open} connected={stats.connected} "
+              f"failed={stats.failed} pongs={stats.pongs}" + (f" server_rss={rss:.0f}MB" if rss else ''))
+        if time.time() - started > args.hold + 60:
+            break
+
+    print(f"\nClients: {args.clients}  connected: {stats.connected}  peak open: {peak_open}  "
+          f"failed: {stats.failed}")
+    if stats.errors:
+        print(f"Errors: {stats.errors}")
+    if rss_before is not None and peak_rss is not None and peak_open:
+        print(f"Server RSS: {rss_before:.0f}MB idle -> {peak_rss:.0f}MB with {peak_open} sockets "
+              f"(~{(peak_rss - rss_before) * 1024 / peak_open:.1f}KB per socket)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hold many idle Socket.IO connections open')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--path', default='/socket.io/')
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--hold', type=float, default=30, help='seconds to keep each socket open')
+    parser.add_argument('--pid', type=int, help='server worker pid, to report its memory')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,197 @@
+"""
+Batched location uploads
+
+Drivers in dead zones buffer GPS fixes on the device and send them in one
+request once they're back online, instead of one HTTP request (auth, ORM
+load, commit) per fix. A batch is a list of fixes, each either a compact
+array
+
+    [timestamp, latitude, longitude, accuracy?, speed_kmh?, heading?, seq?]
+
+or an object with the same fields (lat/lng short keys are accepted).
+Timestamps are device time, as epoch milliseconds, epoch seconds or ISO
+strings.
+
+The server validates the fixes, orders them by device time, drops fixes it
+has already accepted (see location_dedup), inserts the remaining LocationLog
+rows in one transaction and moves the vehicle only to the newest fix.
+"""
+import math
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import geofences
+import location_dedup
+import trip_metrics
+from commit_hooks import after_commit
+from models import db
+from models.location_log import LocationLog
+
+MAX_BATCH_FIXES = 500
+
+# Fixes from further in the future than this are a broken device clock
+MAX_CLOCK_SKEW = 120  # seconds
+# A device that was offline longer than this has nothing useful to replay
+MAX_FIX_AGE = 24 * 3600  # seconds
+
+# Same sanity check as the single-fix paths
+MAX_SPEED_KMH = 120
+
+Fix = namedtuple('Fix', 'timestamp latitude longitude accuracy speed_kmh heading device_ts seq')
+
+ARRAY_FIELDS = ('timestamp', 'latitude', 'longitude', 'accuracy', 'speed_kmh', 'heading', 'seq')
+FIELD_ALIASES = {
+    'ts': 'timestamp',
+    'lat': 'latitude',
+    'lng': 'longitude',
+    'lon': 'longitude',
+    'acc': 'accuracy',
+    'speed': 'speed_kmh',
+    'sequence': 'seq',
+}
+
+
+class BatchError(ValueError):
+    """The batch as a whole can't be used."""
+
+
+def parse_timestamp(value):
+    """Epoch seconds from epoch ms, epoch seconds or an ISO string."""
+    if isinstance(value, bool):
+        raise ValueError('invalid timestamp')
+    if isinstance(value, (int, float)):
+        # Anything past year ~2286 in seconds is really milliseconds
+        return value / 1000.0 if value > 1e10 else float(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    raise ValueError('invalid timestamp')
+
+
+def _optional_float(value):
+    if value is None or value == '':
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def parse_fix(raw, now):
+    """A Fix from one raw array/object, or ValueError."""
+    if isinstance(raw, (list, tuple)):
+        fields = dict(zip(ARRAY_FIELDS, raw))
+    elif isinstance(raw, dict):
+        fields = {FIELD_ALIASES.get(key, key): value for key, value in raw.items()}
+    else:
+        raise ValueError('fix must be an array or object')
+
+    epoch = parse_timestamp(fields.get('timestamp'))
+    if epoch > now + MAX_CLOCK_SKEW or epoch < now - MAX_FIX_AGE:
+        raise ValueError('timestamp out of range')
+    latitude = float(fields.get('latitude'))
+    longitude = float(fields.get('longitude'))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('coordinates out of range')
+
+    return Fix(
+        # Stored like every other timestamp here: naive UTC, never ahead of the server
+        timestamp=datetime.utcfromtimestamp(min(epoch, now)),
+        latitude=latitude,
+        longitude=longitude,
+        accuracy=_optional_float(fields.get('accuracy')),
+        speed_kmh=_optional_float(fields.get('speed_kmh')),
+        heading=_optional_float(fields.get('heading')),
+        device_ts=epoch,
+        seq=location_dedup.parse_sequence(fields.get('seq'))
+    )
+
+
+def parse_batch(raw_fixes, now=None):
+    """Validate a batch. Returns (fixes ordered by device time, number rejected)."""
+    if not isinstance(raw_fixes, list) or not raw_fixes:
+        raise BatchError('fixes must be a non-empty list')
+    if len(raw_fixes) > MAX_BATCH_FIXES:
+        raise BatchError(f'at most {MAX_BATCH_FIXES} fixes per batch')
+
+    now = time.time() if now is None else now
+    fixes, rejected = [], 0
+    for raw in raw_fixes:
+        try:
+            fixes.append(parse_fix(raw, now))
+        except (TypeError, ValueError):
+            rejected += 1
+    fixes.sort(key=lambda fix: fix.timestamp)
+    return fixes, rejected
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    """Haversine distance in kilometers."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def _speed_kmh(previous, fix):
+    """Speed between two fixes from their device timestamps, or None."""
+    hours = (fix.timestamp - previous[2]).total_seconds() / 3600
+    if hours <= 0:
+        return None
+    speed = _distance_km(previous[0], previous[1], fix.latitude, fix.longitude) / hours
+    return speed if speed <= MAX_SPEED_KMH else None
+
+
+def store_batch(vehicle, fixes, occupancy_status=None):
+    """Insert all fixes and move the vehicle to the newest one, in one commit.
+
+    Returns (newest fix, its speed in km/h), or (None, None) when every fix is
+    older than the vehicle's current position; those are still logged, but
+    never move the vehicle backwards.
+    """
+    previous = None
+    if vehicle.current_latitude is not None and vehicle.current_longitude is not None \
+            and vehicle.last_updated is not None:
+        previous = (vehicle.current_latitude, vehicle.current_longitude, vehicle.last_updated)
+
+    db.session.bulk_insert_mappings(LocationLog, [{
+        'vehicle_id': vehicle.id,
+        'latitude': fix.latitude,
+        'longitude': fix.longitude,
+        'accuracy': fix.accuracy,
+        'speed_kmh': fix.speed_kmh,
+        'heading': fix.heading,
+        'timestamp': fix.timestamp
+    } for fix in fixes])
+
+    newest = fixes[-1]
+    if previous is not None and newest.timestamp <= previous[2]:
+        db.session.commit()
+        return None, None
+
+    # Speed over the last leg the server knows about
+    newer = [fix for fix in fixes if previous is None or fix.timestamp > previous[2]]
+    before = (newer[-2].latitude, newer[-2].longitude, newer[-2].timestamp) if len(newer) > 1 else previous
+    speed_kmh = newest.speed_kmh if newest.speed_kmh is not None else \
+        (_speed_kmh(before, newest) if before is not None else None)
+
+    # The vehicle only moves to the newest fix; run the ones before it
+    # through the stop geofences and trip metrics (after commit) so
+    # arrivals and distance aren't missed
+    if len(newer) > 1:
+        intermediate = [(fix.latitude, fix.longitude, fix.timestamp) for fix in newer[:-1]]
+        after_commit(db.session, geofences.observe_fixes, vehicle.id, vehicle.route, intermediate)
+        after_commit(db.session, trip_metrics.observe_fixes, vehicle.id, intermediate)
+
+    vehicle.current_latitude = newest.latitude
+    vehicle.current_longitude = newest.longitude
+    if newest.accuracy:
+        vehicle.accuracy = newest.accuracy
+    if occupancy_status in ('vacant', 'full'):
+        vehicle.occupancy_status = occupancy_status
+    vehicle.last_updated = newest.timestamp
+    if speed_kmh:
+        vehicle.last_speed_kmh = speed_kmh
+    db.session.commit()
+    return newest, speed_kmh
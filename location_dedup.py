@@ -0,0 +1,211 @@
+"""
+Duplicate and out-of-order location fix suppression
+
+Mobile clients retry requests whose response they never saw, and the same
+fix can arrive over both the socket and the HTTP path. Each copy used to
+cost a LocationLog row, a vehicle update and a broadcast.
+
+A fix that carries a device sequence number (seq) or a device timestamp is
+checked here before any database work:
+
+- duplicate: its fingerprint (seq, or device timestamp + coordinates) is in
+  the vehicle's ring of recently accepted fixes
+- out of order: it is older than the newest fix already accepted
+
+Both are dropped and counted. Fixes without seq or timestamp (older
+clients) are always accepted, since a parked vehicle legitimately repeats
+the same coordinates. An accepted fix is only recorded once the
+transaction storing it commits, so a retry of a fix whose write failed
+goes through.
+
+Sequence numbers must keep increasing per vehicle; a number far below the
+last one is taken as the device having reset its counter. State is
+in-memory and per process, so it starts empty after a restart.
+"""
+import threading
+from collections import OrderedDict, deque
+
+from commit_hooks import after_commit
+
+RING_SIZE = 32
+MAX_VEHICLES = 10000
+
+# A sequence number this far below the last accepted one is a counter reset
+SEQUENCE_RESET_GAP = 1000
+
+# Coordinates are compared at ~11 cm, like the compact payloads
+COORD_PRECISION = 6
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+OUT_OF_ORDER = 'out_of_order'
+
+
+class _VehicleFixes:
+    __slots__ = ('last_seq', 'last_ts', 'ring', 'seen')
+
+    def __init__(self, ring_size):
+        self.last_seq = None
+        self.last_ts = None
+        self.ring = deque(maxlen=ring_size)
+        self.seen = set()
+
+    def copy(self):
+        clone = _VehicleFixes(self.ring.maxlen)
+        clone.last_seq, clone.last_ts = self.last_seq, self.last_ts
+        clone.ring.extend(self.ring)
+        clone.seen.update(self.seen)
+        return clone
+
+    def classify(self, fingerprint, device_ts, seq):
+        if fingerprint in self.seen:
+            return DUPLICATE
+        if seq is not None and self.last_seq is not None and seq <= self.last_seq \
+                and seq > self.last_seq - SEQUENCE_RESET_GAP:
+            return OUT_OF_ORDER
+        if seq is None and self.last_ts is not None and device_ts < self.last_ts:
+            return OUT_OF_ORDER
+        return ACCEPTED
+
+    def remember(self, fingerprint, device_ts, seq):
+        if fingerprint in self.seen:
+            return
+        if seq is not None:
+            if self.last_seq is not None and seq <= self.last_seq:
+                # Counter reset: older fingerprints can't be trusted any more
+                self.ring.clear()
+                self.seen.clear()
+            self.last_seq = seq
+        if device_ts is not None:
+            self.last_ts = device_ts if self.last_ts is None else max(self.last_ts, device_ts)
+        if len(self.ring) == self.ring.maxlen:
+            self.seen.discard(self.ring[0])
+        self.ring.append(fingerprint)
+        self.seen.add(fingerprint)
+
+
+def _fingerprint(latitude, longitude, device_ts, seq):
+    if seq is not None:
+        return ('seq', seq)
+    return (device_ts, round(latitude, COORD_PRECISION), round(longitude, COORD_PRECISION))
+
+
+class FixDeduplicator:
+    """Per-vehicle high-water marks plus a small ring of recent fingerprints.
+
+    check() only classifies a fix; remember() records it and should run once
+    the fix is stored (see remember_after_commit), so a fix whose write
+    failed is accepted again when the client retries it.
+    """
+
+    def __init__(self, ring_size=RING_SIZE, max_vehicles=MAX_VEHICLES):
+        self.ring_size = ring_size
+        self.max_vehicles = max_vehicles
+        self._vehicles = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {ACCEPTED: 0, DUPLICATE: 0, OUT_OF_ORDER: 0}
+
+    def check(self, vehicle_id, latitude, longitude, device_ts=None, seq=None):
+        """Classify a fix as ACCEPTED, DUPLICATE or OUT_OF_ORDER without recording it.
+
+        device_ts is epoch seconds (or any increasing number); without it and
+        seq the fix is always accepted.
+        """
+        if seq is None and device_ts is None:
+            return ACCEPTED
+        with self._lock:
+            fixes = self._vehicles.get(vehicle_id)
+            result = ACCEPTED if fixes is None else \
+                fixes.classify(_fingerprint(latitude, longitude, device_ts, seq), device_ts, seq)
+            if result != ACCEPTED:
+                self.counts[result] += 1
+            return result
+
+    def check_batch(self, vehicle_id, batch):
+        """Fixes from an ordered batch (with latitude/longitude/device_ts/seq) that check() would accept.
+
+        Fixes are also checked against the ones before them in the batch.
+        Nothing is recorded. Returns (new fixes, number suppressed).
+        """
+        with self._lock:
+            fixes = self._vehicles.get(vehicle_id)
+            scratch = fixes.copy() if fixes is not None else _VehicleFixes(self.ring_size)
+            new = []
+            for fix in batch:
+                if fix.seq is None and fix.device_ts is None:
+                    new.append(fix)
+                    continue
+                fingerprint = _fingerprint(fix.latitude, fix.longitude, fix.device_ts, fix.seq)
+                result = scratch.classify(fingerprint, fix.device_ts, fix.seq)
+                if result == ACCEPTED:
+                    scratch.remember(fingerprint, fix.device_ts, fix.seq)
+                    new.append(fix)
+                else:
+                    self.counts[result] += 1
+            return new, len(batch) - len(new)
+
+    def remember(self, vehicle_id, latitude, longitude, device_ts=None, seq=None):
+        """Record a stored fix so later copies of it are suppressed."""
+        with self._lock:
+            self.counts[ACCEPTED] += 1
+            if seq is None and device_ts is None:
+                return
+            fixes = self._vehicles.get(vehicle_id)
+            if fixes is None:
+                fixes = self._vehicles[vehicle_id] = _VehicleFixes(self.ring_size)
+                if len(self._vehicles) > self.max_vehicles:
+                    self._vehicles.popitem(last=False)
+            else:
+                self._vehicles.move_to_end(vehicle_id)
+            fixes.remember(_fingerprint(latitude, longitude, device_ts, seq), device_ts, seq)
+
+    def remember_batch(self, vehicle_id, batch):
+        for fix in batch:
+            self.remember(vehicle_id, fix.latitude, fix.longitude, fix.device_ts, fix.seq)
+
+    def forget(self, vehicle_id):
+        with self._lock:
+            self._vehicles.pop(vehicle_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vehicles': len(self._vehicles),
+                'ring_size': self.ring_size,
+                'accepted': self.counts[ACCEPTED],
+                'duplicates': self.counts[DUPLICATE],
+                'out_of_order': self.counts[OUT_OF_ORDER],
+                'suppressed': self.counts[DUPLICATE] + self.counts[OUT_OF_ORDER]
+            }
+
+
+fixes = FixDeduplicator()
+
+
+def filter_new(vehicle_id, batch):
+    """Fixes from an ordered batch (with latitude/longitude/device_ts/seq) not seen before.
+
+    Returns (new fixes, number suppressed). Pass the new fixes to
+    remember_batch_after_commit() before committing them.
+    """
+    return fixes.check_batch(vehicle_id, batch)
+
+
+def remember_after_commit(session, vehicle_id, latitude, longitude, device_ts=None, seq=None):
+    """Record an accepted fix once the session's transaction commits."""
+    after_commit(session, fixes.remember, vehicle_id, latitude, longitude, device_ts, seq)
+
+
+def remember_batch_after_commit(session, vehicle_id, batch):
+    """Record the fixes of an accepted batch once the session's transaction commits."""
+    after_commit(session, fixes.remember_batch, vehicle_id, list(batch))
+
+
+def parse_sequence(value):
+    """A client's seq field as an int, or None if absent/invalid."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
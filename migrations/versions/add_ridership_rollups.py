@@ -0,0 +1,54 @@
+"""Add ridership rollups and per-trip passenger totals
+
+Revision ID: add_ridership_rollups
+Revises: add_stops_and_stop_visits
+Create Date: 2026-10-18 13:00:00.000000
+
+The rollups are filled from the existing trips by the app on its next start
+(or by backfill_ridership.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_ridership_rollups'
+down_revision = 'add_stops_and_stop_visits'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ridership_rollups',
+        sa.Column('id', sa.Integer(), nullable=False, autoincrement=True),
+        sa.Column('period', sa.String(5), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('operator_id', sa.Integer(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('driver_id', sa.Integer(), nullable=False),
+        sa.Column('route', sa.String(255), nullable=False),
+        sa.Column('boards', sa.Integer(), nullable=False),
+        sa.Column('alights', sa.Integer(), nullable=False),
+        sa.Column('trips_started', sa.Integer(), nullable=False),
+        sa.Column('trips_completed', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('period', 'bucket', 'operator_id', 'vehicle_id', 'driver_id', 'route',
+                            name='uq_ridership_rollup_key'),
+    )
+    op.create_index('ix_ridership_rollup_driver', 'ridership_rollups', ['driver_id', 'period', 'bucket'])
+    op.create_index('ix_ridership_rollup_operator', 'ridership_rollups', ['operator_id', 'period', 'bucket'])
+
+    op.create_table('trip_passenger_totals',
+        sa.Column('trip_id', sa.Integer(), nullable=False),
+        sa.Column('boards', sa.Integer(), nullable=False),
+        sa.Column('alights', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('trip_id'),
+        sa.ForeignKeyConstraint(['trip_id'], ['trips.id'], ondelete='CASCADE'),
+    )
+
+
+def downgrade():
+    op.drop_table('trip_passenger_totals')
+    op.drop_index('ix_ridership_rollup_operator', table_name='ridership_rollups')
+    op.drop_index('ix_ridership_rollup_driver', table_name='ridership_rollups')
+    op.drop_table('ridership_rollups')
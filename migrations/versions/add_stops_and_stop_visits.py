@@ -0,0 +1,54 @@
+"""Add stops and stop visits for geofenced arrival/departure tracking
+
+Revision ID: add_stops_and_stop_visits
+Revises: add_vehicle_seat_mask
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_stops_and_stop_visits'
+down_revision = 'add_vehicle_seat_mask'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stops',
+        sa.Column('id', sa.Integer(), nullable=False, autoincrement=True),
+        sa.Column('name', sa.String(100), nullable=False),
+        sa.Column('route', sa.String(100), nullable=True),
+        sa.Column('operator_id', sa.Integer(), nullable=True),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('radius_m', sa.Float(), nullable=True),
+        sa.Column('polygon', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['operator_id'], ['users.id'], ),
+    )
+
+    op.create_table('stop_visits',
+        sa.Column('id', sa.Integer(), nullable=False, autoincrement=True),
+        sa.Column('stop_id', sa.Integer(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('route', sa.String(100), nullable=True),
+        sa.Column('arrived_at', sa.DateTime(), nullable=False),
+        sa.Column('departed_at', sa.DateTime(), nullable=False),
+        sa.Column('dwell_seconds', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['stop_id'], ['stops.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['vehicle_id'], ['vehicles.id'], ondelete='CASCADE'),
+    )
+    op.create_index('ix_stop_visits_stop_id', 'stop_visits', ['stop_id'])
+    op.create_index('ix_stop_visits_vehicle_id', 'stop_visits', ['vehicle_id'])
+
+
+def downgrade():
+    op.drop_index('ix_stop_visits_vehicle_id', table_name='stop_visits')
+    op.drop_index('ix_stop_visits_stop_id', table_name='stop_visits')
+    op.drop_table('stop_visits')
+    op.drop_table('stops')
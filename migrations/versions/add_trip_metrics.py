@@ -0,0 +1,44 @@
+"""Add per-trip distance, moving/idle time and passenger-km
+
+Revision ID: add_trip_metrics
+Revises: add_ridership_rollups
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_trip_metrics'
+down_revision = 'add_ridership_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trip_metrics',
+        sa.Column('trip_id', sa.Integer(), nullable=False),
+        sa.Column('operator_id', sa.Integer(), nullable=False),
+        sa.Column('vehicle_id', sa.Integer(), nullable=False),
+        sa.Column('driver_id', sa.Integer(), nullable=False),
+        sa.Column('route', sa.String(255), nullable=True),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('ended_at', sa.DateTime(), nullable=False),
+        sa.Column('distance_m', sa.Float(), nullable=False),
+        sa.Column('moving_seconds', sa.Float(), nullable=False),
+        sa.Column('idle_seconds', sa.Float(), nullable=False),
+        sa.Column('passenger_km', sa.Float(), nullable=False),
+        sa.Column('fixes', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('trip_id'),
+        sa.ForeignKeyConstraint(['trip_id'], ['trips.id'], ondelete='CASCADE'),
+    )
+    op.create_index('ix_trip_metrics_operator_day', 'trip_metrics', ['operator_id', 'day'])
+    op.create_index('ix_trip_metrics_vehicle_day', 'trip_metrics', ['vehicle_id', 'day'])
+
+
+def downgrade():
+    op.drop_index('ix_trip_metrics_vehicle_day', table_name='trip_metrics')
+    op.drop_index('ix_trip_metrics_operator_day', table_name='trip_metrics')
+    op.drop_table('trip_metrics')
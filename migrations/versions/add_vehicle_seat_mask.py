@@ -0,0 +1,61 @@
+"""Store vehicle seats as a bitmask column
+
+Revision ID: add_vehicle_seat_mask
+Revises: add_55_scope_features
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import text
+
+SEAT_COUNT = 15
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_vehicle_seat_mask'
+down_revision = 'add_55_scope_features'
+branch_labels = None
+depends_on = None
+
+
+def _route_data(route_info):
+    try:
+        route_data = json.loads(route_info) if isinstance(route_info, str) else route_info
+    except ValueError:
+        return None
+    return route_data if isinstance(route_data, dict) else None
+
+
+def upgrade():
+    # Bit i = seat i; replaces the seat_status list in route_info
+    op.add_column('vehicles', sa.Column('seat_mask', sa.SmallInteger(), nullable=False, server_default='0'))
+
+    # Move the existing seat maps out of route_info
+    connection = op.get_bind()
+    rows = connection.execute(text("SELECT id, route_info FROM vehicles WHERE route_info LIKE '%seat_status%'"))
+    for vehicle_id, route_info in rows.fetchall():
+        route_data = _route_data(route_info)
+        if route_data is None or not isinstance(route_data.get('seat_status'), list):
+            continue
+        seats = route_data.pop('seat_status')
+        mask = sum(1 << i for i, occupied in enumerate(seats[:SEAT_COUNT]) if occupied)
+        connection.execute(text("UPDATE vehicles SET seat_mask = :mask, route_info = :route_info WHERE id = :id"),
+                           {'mask': mask, 'route_info': json.dumps(route_data), 'id': vehicle_id})
+
+
+def downgrade():
+    # Put the seat maps back into route_info
+    connection = op.get_bind()
+    rows = connection.execute(text("SELECT id, route_info, seat_mask FROM vehicles WHERE seat_mask <> 0"))
+    for vehicle_id, route_info, mask in rows.fetchall():
+        route_data = _route_data(route_info) if route_info else {}
+        if route_data is None:
+            continue
+        route_data['seat_status'] = [bool(mask >> i & 1) for i in range(SEAT_COUNT)]
+        connection.execute(text("UPDATE vehicles SET route_info = :route_info WHERE id = :id"),
+                           {'route_info': json.dumps(route_data), 'id': vehicle_id})
+
+    op.drop_column('vehicles', 'seat_mask')
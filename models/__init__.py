@@ -10,4 +10,7 @@ db = SQLAlchemy(session_options={
 from .user import User
 from .vehicle import Vehicle
 from .location_log import LocationLog
-from .notification import Notification, NotificationSetting 
\ No newline at end of file
+from .notification import Notification, NotificationSetting 
+from .stop import Stop, StopVisit
+from .ridership import RidershipRollup, TripPassengerTotal
+from .trip_metrics import TripMetrics
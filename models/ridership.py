@@ -0,0 +1,50 @@
+"""
+Ridership rollup models, maintained incrementally by ridership.py
+"""
+from models import db
+
+class RidershipRollup(db.Model):
+    """Boardings, alightings and trip counts for one vehicle/driver/route in one period"""
+
+    __tablename__ = 'ridership_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket', 'operator_id', 'vehicle_id', 'driver_id', 'route',
+                            name='uq_ridership_rollup_key'),
+        db.Index('ix_ridership_rollup_driver', 'driver_id', 'period', 'bucket'),
+        db.Index('ix_ridership_rollup_operator', 'operator_id', 'period', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)  # 'hour', 'day' or 'total'
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the hour/day (epoch for 'total')
+    operator_id = db.Column(db.Integer, nullable=False, default=0)  # 0: vehicle without an owner
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    driver_id = db.Column(db.Integer, nullable=False)
+    route = db.Column(db.String(255), nullable=False, default='')
+    boards = db.Column(db.Integer, nullable=False, default=0)
+    alights = db.Column(db.Integer, nullable=False, default=0)
+    trips_started = db.Column(db.Integer, nullable=False, default=0)
+    trips_completed = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'period': self.period,
+            'bucket': self.bucket.isoformat(),
+            'operator_id': self.operator_id or None,
+            'vehicle_id': self.vehicle_id,
+            'driver_id': self.driver_id,
+            'route': self.route or None,
+            'boards': self.boards,
+            'alights': self.alights,
+            'trips_started': self.trips_started,
+            'trips_completed': self.trips_completed
+        }
+
+class TripPassengerTotal(db.Model):
+    """Running boardings/alightings of one trip"""
+
+    __tablename__ = 'trip_passenger_totals'
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trips.id', ondelete='CASCADE'), primary_key=True)
+    boards = db.Column(db.Integer, nullable=False, default=0)
+    alights = db.Column(db.Integer, nullable=False, default=0)
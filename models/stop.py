@@ -0,0 +1,58 @@
+"""
+Stop and stop visit models for geofenced arrival/departure tracking
+"""
+from models import db
+from datetime import datetime
+
+class Stop(db.Model):
+    """A stop or terminal: a circle (radius_m around the point) or a polygon"""
+
+    __tablename__ = 'stops'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    route = db.Column(db.String(100), nullable=True)  # None: applies to every route
+    operator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    latitude = db.Column(db.Float, nullable=False)  # Center (or label point for polygons)
+    longitude = db.Column(db.Float, nullable=False)
+    radius_m = db.Column(db.Float, default=50.0)
+    polygon = db.Column(db.JSON, nullable=True)  # [[lat, lon], ...] overrides the circle
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Stop {self.name}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'route': self.route,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'radius_m': self.radius_m,
+            'polygon': self.polygon
+        }
+
+class StopVisit(db.Model):
+    """One completed stay of a vehicle inside a stop's geofence"""
+
+    __tablename__ = 'stop_visits'
+
+    id = db.Column(db.Integer, primary_key=True)
+    stop_id = db.Column(db.Integer, db.ForeignKey('stops.id', ondelete='CASCADE'), nullable=False, index=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'), nullable=False, index=True)
+    route = db.Column(db.String(100), nullable=True)
+    arrived_at = db.Column(db.DateTime, nullable=False)
+    departed_at = db.Column(db.DateTime, nullable=False)
+    dwell_seconds = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'stop_id': self.stop_id,
+            'vehicle_id': self.vehicle_id,
+            'route': self.route,
+            'arrived_at': self.arrived_at.isoformat(),
+            'departed_at': self.departed_at.isoformat(),
+            'dwell_seconds': self.dwell_seconds
+        }
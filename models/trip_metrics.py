@@ -0,0 +1,27 @@
+"""
+Per-trip distance, moving/idle time and passenger-km, written when a trip ends
+"""
+from models import db
+
+class TripMetrics(db.Model):
+    """Totals accumulated from a trip's location stream (see trip_metrics.py)"""
+
+    __tablename__ = 'trip_metrics'
+    __table_args__ = (
+        db.Index('ix_trip_metrics_operator_day', 'operator_id', 'day'),
+        db.Index('ix_trip_metrics_vehicle_day', 'vehicle_id', 'day'),
+    )
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trips.id', ondelete='CASCADE'), primary_key=True)
+    operator_id = db.Column(db.Integer, nullable=False, default=0)  # 0: vehicle without an owner
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    driver_id = db.Column(db.Integer, nullable=False)
+    route = db.Column(db.String(255), nullable=True)
+    day = db.Column(db.Date, nullable=False)  # Day the trip started (UTC)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)
+    distance_m = db.Column(db.Float, nullable=False, default=0.0)
+    moving_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    idle_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    passenger_km = db.Column(db.Float, nullable=False, default=0.0)
+    fixes = db.Column(db.Integer, nullable=False, default=0)
@@ -5,6 +5,28 @@ from models import db
 from datetime import datetime
 from sqlalchemy.dialects.mysql import TEXT
 from sqlalchemy.dialects.postgresql import TEXT as PG_TEXT
+from sqlalchemy import select
+
+# Seat layout: driver (index 0) + 2 + 4 + 4 + 4. The seat map shows the
+# driver and passenger seats 1-12, so only those count as occupied seats.
+SEAT_COUNT = 15
+ALL_SEATS = (1 << SEAT_COUNT) - 1
+PASSENGER_SEATS = ((1 << 13) - 1) & ~1
+
+
+def seats_to_list(mask):
+    """Seat mask -> list of SEAT_COUNT booleans."""
+    return [bool(mask >> i & 1) for i in range(SEAT_COUNT)]
+
+
+def seats_from_list(seats):
+    """List of booleans -> seat mask."""
+    return sum(1 << i for i, occupied in enumerate(seats[:SEAT_COUNT]) if occupied)
+
+
+def occupied_passenger_seats(mask):
+    return (mask & PASSENGER_SEATS).bit_count()
+
 
 class Vehicle(db.Model):
     """Vehicle model for storing vehicle information"""
@@ -31,6 +53,9 @@ class Vehicle(db.Model):
     route = db.Column(db.String(100))
     route_info = db.Column(db.Text)
     
+    # Occupied seats, bit i = seat i (see SEAT_COUNT)
+    seat_mask = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
+    
     # Relationship fields
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     assigned_driver_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -47,48 +72,26 @@ class Vehicle(db.Model):
     
     def get_seat_status(self):
         """Get seat status array (15 seats: driver + 2 + 4 + 4 + 4)"""
-        import json
-        if self.route_info:
-            try:
-                route_data = json.loads(self.route_info) if isinstance(self.route_info, str) else self.route_info
-                if isinstance(route_data, dict) and 'seat_status' in route_data:
-                    return route_data['seat_status']
-            except (json.JSONDecodeError, TypeError):
-                pass
-        # Default: all seats free (15 seats total)
-        return [False] * 15
-    
-    def set_seat_status(self, seat_index, occupied):
-        """Set seat status for a specific seat (0-14)"""
-        import json
-        if seat_index < 0 or seat_index >= 15:
-            raise ValueError("Seat index must be between 0 and 14")
-        
-        # Get current route_info
-        if self.route_info:
-            try:
-                route_data = json.loads(self.route_info) if isinstance(self.route_info, str) else self.route_info
-            except (json.JSONDecodeError, TypeError):
-                route_data = {}
-        else:
-            route_data = {}
-        
-        # Initialize seat_status if not exists
-        if 'seat_status' not in route_data:
-            route_data['seat_status'] = [False] * 15
-        
-        # Update seat status
-        route_data['seat_status'][seat_index] = occupied
-        
-        # Save back to route_info
-        self.route_info = json.dumps(route_data) if isinstance(route_data, dict) else route_data
+        return seats_to_list(self.seat_mask or 0)
     
     def get_occupied_seat_count(self):
         """Get count of occupied passenger seats (excludes driver seat at index 0)"""
-        seat_status = self.get_seat_status()
-        # Only count passenger seats (indices 1-12), exclude driver seat (index 0)
-        # Since we only show 13 seats total (driver + 12 passengers), count indices 1-12
-        return sum(1 for i, seat in enumerate(seat_status) if seat and i > 0 and i < 13)
+        return occupied_passenger_seats(self.seat_mask or 0)
+    
+    @staticmethod
+    def update_seats(vehicle_id, mask, bits):
+        """Atomically set the seats in mask to bits; returns the new seat mask (None if no such vehicle).
+        
+        A single UPDATE, so concurrent changes to other seats are never lost.
+        Runs in the session's transaction; the caller commits.
+        """
+        table = Vehicle.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == vehicle_id)
+            .values(seat_mask=table.c.seat_mask.op('&')(ALL_SEATS & ~mask).op('|')(bits & mask))
+        )
+        return db.session.execute(select(table.c.seat_mask).where(table.c.id == vehicle_id)).scalar()
     
     def to_dict(self):
         """Convert vehicle to dictionary"""
@@ -110,6 +113,7 @@ class Vehicle(db.Model):
             'route_info': self.route_info,
             'owner_id': self.owner_id,
             'assigned_driver_id': self.assigned_driver_id,
+            'seat_mask': self.seat_mask,
             'seat_status': seat_status,
             'occupied_seats': self.get_occupied_seat_count()
         }
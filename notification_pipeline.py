@@ -0,0 +1,213 @@
+"""
+Notification fan-out pipeline
+
+Proximity and route notifications used to be produced inside the Socket.IO
+handlers: a NotificationSetting query per user for the cooldown, one
+Notification insert and commit per match, then the emits, all before the
+handler returned. Handlers now only queue work:
+
+- submit(key, job, *args) queues a matching job. A job still waiting under
+  the same key is replaced, so a commuter sending several fixes within one
+  interval is matched once, against the newest.
+- A background worker runs the queued jobs every FLUSH_INTERVAL seconds.
+  Jobs return NotificationIntents (who gets which notification).
+- The worker loads the settings of every user in the batch with one query,
+  drops intents that are still inside their user's cooldown (an in-memory
+  table of last notification times), inserts the remaining Notification
+  rows and the new last_notification_time values in a single commit, and
+  only then emits them.
+
+The cooldown table is per process. last_notification_time is still
+written, and the later of the two times wins, so a restarted worker
+doesn't notify anyone early.
+"""
+import logging
+import os
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from models import db
+from models.notification import Notification, NotificationSetting
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.environ.get('NOTIFICATION_FLUSH_SECONDS', 0.5))
+MAX_JOBS_PER_BATCH = 500
+
+# Cooldowns by notification type; other types use the user's notification_cooldown
+TYPE_COOLDOWNS = {'vehicle_approaching': 15, 'nearby_commuter': 15, 'manual_refresh': 5}
+DEFAULT_COOLDOWN = 60
+DEFAULT_RADIUS = 500
+
+# Once the cooldown table is this big, entries older than an hour are dropped
+# (they are also in last_notification_time)
+MAX_COOLDOWN_ENTRIES = 10000
+COOLDOWN_RETENTION = 3600
+
+# extra_events: (event, payload) pairs emitted to the user's room after the notification
+# force: skip the cooldown check and don't start a new cooldown
+NotificationIntent = namedtuple('NotificationIntent', ['user_id', 'type', 'title', 'message', 'data',
+                                                       'extra_events', 'force'], defaults=((), False))
+
+# What matching needs from a user's NotificationSetting
+UserSettings = namedtuple('UserSettings', ['setting_id', 'enabled', 'radius', 'notify_specific_routes',
+                                           'routes', 'cooldown', 'last_time'])
+DEFAULT_SETTINGS = UserSettings(None, True, DEFAULT_RADIUS, False, None, DEFAULT_COOLDOWN, None)
+
+
+class NotificationPipeline:
+    """Queue of matching jobs, and the worker that turns their intents into notifications."""
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._jobs = {}        # key -> (job, args), oldest first
+        self._lock = threading.Lock()
+        self._last_sent = {}   # user_id -> time of their last notification
+        self._settings = {}    # user_id -> UserSettings, for the batch being run
+        self._emit = None
+        self._started = False
+        self._metrics = Counter()
+
+    def submit(self, key, job, *args):
+        """Queue job(*args), replacing a job with the same key that hasn't run yet."""
+        with self._lock:
+            if self._jobs.pop(key, None) is not None:
+                self._metrics['coalesced'] += 1
+            self._jobs[key] = (job, args)
+            self._metrics['jobs'] += 1
+
+    def settings(self, user_ids):
+        """{user_id: UserSettings}, loaded once per batch. For jobs running on the worker."""
+        missing = {user_id for user_id in user_ids if user_id not in self._settings}
+        if missing:
+            for row in NotificationSetting.query.filter(NotificationSetting.user_id.in_(missing)).all():
+                self._settings[row.user_id] = UserSettings(
+                    row.id, bool(row.enabled), row.notification_radius or DEFAULT_RADIUS,
+                    bool(row.notify_specific_routes), row.routes, row.notification_cooldown or DEFAULT_COOLDOWN,
+                    row.last_notification_time)
+            for user_id in missing:
+                # Users without a settings row get the defaults
+                self._settings.setdefault(user_id, DEFAULT_SETTINGS)
+        return {user_id: self._settings[user_id] for user_id in user_ids}
+
+    def run_once(self):
+        """Run the queued jobs and deliver their notifications. Needs an app context."""
+        with self._lock:
+            keys = list(self._jobs)[:MAX_JOBS_PER_BATCH]
+            jobs = [self._jobs.pop(key) for key in keys]
+        if not jobs:
+            return 0
+        self._settings = {}
+        try:
+            intents = []
+            for job, args in jobs:
+                try:
+                    intents.extend(job(*args) or ())
+                except Exception as e:
+                    logger.error(f"Notification job {getattr(job, '__name__', job)} failed: {e}")
+                    db.session.rollback()
+            return self._deliver(intents)
+        finally:
+            self._settings = {}
+            self._metrics['batches'] += 1
+
+    def _cooling_down(self, intent, settings, now):
+        last = self._last_sent.get(intent.user_id)
+        if settings.last_time and (last is None or settings.last_time > last):
+            last = settings.last_time
+        if last is None:
+            return False
+        cooldown = TYPE_COOLDOWNS.get(intent.type, settings.cooldown)
+        return (now - last).total_seconds() <= cooldown
+
+    def _deliver(self, intents):
+        self._metrics['intents'] += len(intents)
+        if not intents:
+            return 0
+        now = datetime.utcnow()
+        settings = self.settings([intent.user_id for intent in intents])
+
+        accepted = []
+        for intent in intents:
+            if not intent.force:
+                if self._cooling_down(intent, settings[intent.user_id], now):
+                    self._metrics['cooled_down'] += 1
+                    continue
+                self._last_sent[intent.user_id] = now
+            accepted.append(intent)
+        self._prune(now)
+        if not accepted:
+            return 0
+
+        notifications = [Notification(user_id=intent.user_id, type=intent.type, title=intent.title,
+                                      message=intent.message, data=intent.data, created_at=now)
+                         for intent in accepted]
+        db.session.add_all(notifications)
+        started = {intent.user_id for intent in accepted if not intent.force}
+        db.session.bulk_update_mappings(NotificationSetting, [
+            {'id': settings[user_id].setting_id, 'last_notification_time': now}
+            for user_id in started if settings[user_id].setting_id is not None
+        ])
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not store {len(notifications)} notifications: {e}")
+            return 0
+
+        for intent, notification in zip(accepted, notifications):
+            room = f'user_{intent.user_id}'
+            try:
+                self._emit('notification', notification.to_dict(), room)
+                for event, payload in intent.extra_events:
+                    self._emit(event, payload, room)
+            except Exception as e:
+                logger.error(f"Could not emit notification to {room}: {e}")
+        self._metrics['sent'] += len(accepted)
+        return len(accepted)
+
+    def _prune(self, now):
+        if len(self._last_sent) > MAX_COOLDOWN_ENTRIES:
+            self._last_sent = {user_id: last for user_id, last in self._last_sent.items()
+                               if (now - last).total_seconds() < COOLDOWN_RETENTION}
+
+    def start(self, app, start_background_task, sleep, emit):
+        """Start the worker once, using the server's task and sleep primitives.
+
+        emit(event, payload, room) performs the actual send.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._emit = emit
+
+        def run():
+            while True:
+                sleep(self.interval)
+                if not self._jobs:
+                    continue
+                with app.app_context():
+                    try:
+                        self.run_once()
+                    except Exception as e:
+                        logger.error(f"Notification worker failed: {e}")
+
+        start_background_task(run)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, pending_jobs=len(self._jobs), cooldown_entries=len(self._last_sent))
+
+
+pipeline = NotificationPipeline()
+
+
+def submit(key, job, *args):
+    """Queue a matching job, starting the worker on first use. Needs an app context."""
+    from flask import current_app
+    from app import socketio
+    pipeline.start(current_app._get_current_object(), socketio.start_background_task, socketio.sleep,
+                   lambda event, payload, room: socketio.emit(event, payload, room=room, namespace='/'))
+    pipeline.submit(key, job, *args)
@@ -0,0 +1,109 @@
+"""
+Compact MessagePack encoding for Socket.IO vehicle payloads
+
+Opt-in per client: a client connects with {payload_mode: 'msgpack'} in its
+Socket.IO connect auth and, if msgpack is installed, receives
+vehicle_positions, vehicle_update_batch and vehicle_updated as a single
+binary argument instead of JSON. The server answers with a payload_mode
+event saying which format it will send.
+
+The binary form shortens the repeated keys to one- or two-letter codes,
+sends coordinates as fixed-point integers (degrees * COORD_SCALE) and
+timestamps as integer epoch seconds. Clients expand it back to the JSON
+shape, so event handlers don't care which mode is in use. Clients that never
+ask keep getting JSON.
+
+msgpack is listed in requirements.txt; if it is missing anyway, every client
+stays on JSON.
+"""
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PAYLOAD_MODE_JSON = 'json'
+PAYLOAD_MODE_MSGPACK = 'msgpack'
+
+# Degrees are sent as int(round(degrees * COORD_SCALE)), ~11 cm resolution
+COORD_SCALE = 10 ** 6
+
+FIELD_CODES = {
+    'id': 'i',
+    'vehicle_id': 'vi',
+    'latitude': 'a',
+    'longitude': 'o',
+    'status': 's',
+    'occupancy_status': 'c',
+    'type': 't',
+    'route': 'r',
+    'last_updated': 'u',
+    'speed_kmh': 'k',
+    'timestamp': 'ts',
+    'vehicles': 'V',
+    'updates': 'U',
+    'count': 'n',
+    'bbox': 'b',
+}
+
+COORD_FIELDS = {'latitude', 'longitude'}
+TIMESTAMP_FIELDS = {'last_updated', 'timestamp'}
+
+
+def msgpack_available():
+    return msgpack is not None
+
+
+def _epoch_seconds(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            # Vehicle timestamps are stored as naive UTC
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return value
+
+
+def compact(value):
+    """Rewrite a payload with field codes, fixed-point coordinates and epoch-int timestamps."""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if item is None:
+                continue  # Missing keys decode as undefined; saves the bytes of a nil
+            if key in COORD_FIELDS and isinstance(item, (int, float)):
+                item = int(round(item * COORD_SCALE))
+            elif key in TIMESTAMP_FIELDS:
+                item = _epoch_seconds(item)
+            elif key == 'bbox':
+                item = [int(round(c * COORD_SCALE)) for c in item]
+            else:
+                item = compact(item)
+            result[FIELD_CODES.get(key, key)] = item
+        return result
+    if isinstance(value, (list, tuple)):
+        return [compact(item) for item in value]
+    return value
+
+
+def pack(payload):
+    """Encode a payload in the compact binary form. Requires msgpack."""
+    return msgpack.packb(compact(payload), use_bin_type=True, default=str)
+
+
+def describe():
+    """What a client needs to decode compact payloads."""
+    return {
+        'mode': PAYLOAD_MODE_MSGPACK,
+        'fields': FIELD_CODES,
+        'coord_scale': COORD_SCALE,
+        'coord_fields': sorted(COORD_FIELDS) + ['bbox'],
+        'timestamp_fields': sorted(TIMESTAMP_FIELDS)
+    }
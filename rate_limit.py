@@ -0,0 +1,220 @@
+"""
+In-process token-bucket rate limiting
+
+Each limited endpoint has a RateLimiter: a token bucket per client key
+(user, IP or vehicle) that refills at `rate` tokens per second up to
+`burst`. Buckets live in a fixed-size open-addressed table (parallel
+arrays, a few probes per lookup), so memory stays constant however many
+clients show up; when every probed slot is taken, the least recently used
+one is recycled.
+
+Limits are "rate:burst" per endpoint and can be overridden with
+RATE_LIMITS, e.g. "vehicles_active=5:30,location_update=2:10". A rate of 0
+disables the limit.
+
+OncePer gates an expensive action (like a forced snapshot rebuild) to at
+most once per interval for everyone, however many clients ask.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from functools import wraps
+
+from flask import jsonify, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+# endpoint -> (tokens per second, burst)
+DEFAULT_LIMITS = {
+    'vehicles_active': (5.0, 30),      # Public map polls every 2s; leaves room for shared IPs
+    'vehicle_positions': (2.0, 10),    # request_vehicle_positions socket event, per connection
+    'location_update': (2.0, 10),      # Single fixes (socket and HTTP), per vehicle
+    'location_batch': (0.5, 5),        # Batched fixes, per vehicle
+}
+DEFAULT_LIMIT = (5.0, 30)
+
+TABLE_SIZE = 4096  # Buckets per endpoint (power of two)
+PROBES = 4
+
+# Forced public feed rebuilds are shared by everyone: at most one per interval
+FORCE_REFRESH_INTERVAL = float(os.environ.get('FORCE_REFRESH_INTERVAL', 5))
+
+
+def parse_limits(value):
+    """Parse "endpoint=rate:burst,..." into a dict, ignoring malformed entries."""
+    limits = {}
+    for part in (value or '').split(','):
+        if not part.strip():
+            continue
+        name, _, spec = part.partition('=')
+        rate, _, burst = spec.partition(':')
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else max(rate, 1.0)
+            if name.strip() and rate >= 0 and burst > 0:
+                limits[name.strip()] = (rate, burst)
+        except ValueError:
+            logger.warning(f"Ignoring invalid rate limit: {part!r}")
+    return limits
+
+
+def configured_limits():
+    return {**DEFAULT_LIMITS, **parse_limits(os.environ.get('RATE_LIMITS'))}
+
+
+class RateLimiter:
+    """Token buckets for one endpoint, in a fixed-size table."""
+
+    def __init__(self, name, rate, burst, size=TABLE_SIZE, probes=PROBES):
+        if size & (size - 1):
+            raise ValueError('size must be a power of two')
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.probes = probes
+        self._mask = size - 1
+        self._keys = [None] * size
+        self._tokens = array('d', [0.0]) * size
+        self._stamps = array('d', [0.0]) * size
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.recycled = 0
+
+    def allow(self, key, cost=1.0, now=None):
+        """Take cost tokens from key's bucket. False if it doesn't have them."""
+        if self.rate <= 0:
+            return True
+        now = time.time() if now is None else now
+        with self._lock:
+            slot = self._slot(key, now)
+            tokens = min(self.burst, self._tokens[slot] + (now - self._stamps[slot]) * self.rate)
+            self._stamps[slot] = now
+            if tokens >= cost:
+                self._tokens[slot] = tokens - cost
+                self.allowed += 1
+                return True
+            self._tokens[slot] = tokens
+            self.rejected += 1
+            return False
+
+    def retry_after(self, cost=1.0):
+        """Seconds until an empty bucket can afford cost again."""
+        return cost / self.rate if self.rate > 0 else 0
+
+    def _slot(self, key, now):
+        # Caller holds the lock
+        start = hash(key) & self._mask
+        victim = None
+        for i in range(self.probes):
+            slot = (start + i) & self._mask
+            existing = self._keys[slot]
+            if existing == key:
+                return slot
+            if existing is None:
+                victim = slot
+                break
+            if victim is None or self._stamps[slot] < self._stamps[victim]:
+                victim = slot
+        if self._keys[victim] is not None:
+            self.recycled += 1
+        self._keys[victim] = key
+        self._tokens[victim] = self.burst
+        self._stamps[victim] = now
+        return victim
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'recycled': self.recycled,
+            'table_size': self._mask + 1
+        }
+
+
+class OncePer:
+    """Lets an action through at most once per interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.coalesced = 0
+
+    def ready(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now < self._next:
+                self.coalesced += 1
+                return False
+            self._next = now + self.interval
+            self.passed += 1
+            return True
+
+    def stats(self):
+        return {'interval': self.interval, 'passed': self.passed, 'coalesced': self.coalesced}
+
+
+_limits = configured_limits()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+force_refresh_gate = OncePer(FORCE_REFRESH_INTERVAL)
+
+
+def limiter(name):
+    """The shared RateLimiter for an endpoint, created on first use."""
+    found = _limiters.get(name)
+    if found is not None:
+        return found
+    with _limiters_lock:
+        if name not in _limiters:
+            rate, burst = _limits.get(name, DEFAULT_LIMIT)
+            _limiters[name] = RateLimiter(name, rate, burst)
+        return _limiters[name]
+
+
+def allow(name, key, cost=1.0):
+    return limiter(name).allow(key, cost)
+
+
+def client_key():
+    """Rate-limit key for an HTTP/socket client: the user if logged in, else the IP."""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    # Behind the hosting proxy the client is the address the proxy appended
+    # last; earlier entries are whatever the client chose to send
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return f"ip:{forwarded.split(',')[-1].strip() or request.remote_addr}"
+
+
+def rate_limited(name, key=None):
+    """Decorator answering 429 when the client's bucket for name is empty.
+
+    key(**view_args) picks the bucket; defaults to client_key().
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            bucket = limiter(name)
+            if not bucket.allow(key(**kwargs) if key else client_key()):
+                response = jsonify({'success': False, 'error': 'Too many requests, slow down'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, round(bucket.retry_after())))
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stats():
+    return {
+        'limiters': {name: bucket.stats() for name, bucket in list(_limiters.items())},
+        'force_refresh': force_refresh_gate.stats()
+    }
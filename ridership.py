@@ -0,0 +1,245 @@
+"""
+Hourly/daily ridership rollups, maintained incrementally
+
+Every flushed PassengerEvent and Trip write is turned into counter
+increments on RidershipRollup rows keyed by (operator, vehicle, driver,
+route, hour), plus the matching day row and an all-time 'total' row, and on
+the trip's TripPassengerTotal. The increments run as upserts
+(x = x + n) on the flush's own connection, so they commit or roll back with
+the write that caused them and concurrent writers can't lose updates.
+
+Reads are then a handful of rows instead of a COUNT/SUM over raw trips and
+events: today's trips for a driver is the driver's day rows, a trip's
+passenger count is one primary-key lookup.
+
+History written before the rollups existed (or after a manual fix-up of raw
+rows) is loaded with rebuild(), see backfill_ridership.py. Deleting a
+vehicle's trips in bulk must go through remove_vehicle() first.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import db
+from models.ridership import RidershipRollup, TripPassengerTotal
+from models.user import PassengerEvent, Trip
+from models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('hour', 'day', 'total')
+TOTAL_BUCKET = datetime(1970, 1, 1)
+COUNTERS = ('boards', 'alights', 'trips_started', 'trips_completed')
+ROLLUP_KEY = ('period', 'bucket', 'operator_id', 'vehicle_id', 'driver_id', 'route')
+
+
+def bucket(when, period):
+    """Start of the hour/day containing when ('total' has a single bucket)."""
+    if period == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return TOTAL_BUCKET
+
+
+class Increments:
+    """Counter deltas collected from one flush, merged per rollup row."""
+
+    def __init__(self):
+        self.rollups = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self.trips = defaultdict(lambda: {'boards': 0, 'alights': 0})
+
+    def add(self, trip_key, when, counter, amount):
+        # trip_key: (operator_id, vehicle_id, driver_id, route)
+        for period in PERIODS:
+            self.rollups[(period, bucket(when, period)) + trip_key][counter] += amount
+
+    def add_passengers(self, trip_id, trip_key, event_type, count, when):
+        counter = 'boards' if event_type == 'board' else 'alights'
+        self.add(trip_key, when, counter, count)
+        self.trips[trip_id][counter] += count
+
+    def __bool__(self):
+        return bool(self.rollups or self.trips)
+
+
+def _upsert(connection, table, key, increments):
+    """INSERT the row, or add increments to the existing one."""
+    if not any(increments.values()):
+        return
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite_insert if dialect == 'sqlite' else pg_insert)(table).values(**key, **increments)
+        connection.execute(insert.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + insert.excluded[name] for name in increments}
+        ))
+        return
+    # Other databases: update, and insert when there was nothing to update
+    where = [table.c[name] == value for name, value in key.items()]
+    result = connection.execute(table.update().where(*where).values(
+        **{name: table.c[name] + amount for name, amount in increments.items()}))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**key, **increments))
+
+
+def apply(connection, increments):
+    rollups = RidershipRollup.__table__
+    for key, counters in increments.rollups.items():
+        _upsert(connection, rollups, dict(zip(ROLLUP_KEY, key)), counters)
+    totals = TripPassengerTotal.__table__
+    for trip_id, counters in increments.trips.items():
+        _upsert(connection, totals, {'trip_id': trip_id}, counters)
+
+
+def trip_keys(connection, trip_ids):
+    """trip_id -> (operator_id, vehicle_id, driver_id, route) read through connection."""
+    if not trip_ids:
+        return {}
+    trips, vehicles = Trip.__table__, Vehicle.__table__
+    rows = connection.execute(
+        select(trips.c.id, vehicles.c.owner_id, trips.c.vehicle_id, trips.c.driver_id, trips.c.route_name)
+        .select_from(trips.outerjoin(vehicles, vehicles.c.id == trips.c.vehicle_id))
+        .where(trips.c.id.in_(list(trip_ids)))
+    )
+    return {row[0]: (row[1] or 0, row[2], row[3], row[4] or '') for row in rows}
+
+
+def _status_change(trip):
+    """(old, new) status of a flushed Trip, or None if the status didn't change."""
+    history = inspect(trip).attrs.status.history
+    if not history.has_changes():
+        return None
+    return (history.deleted[0] if history.deleted else None), trip.status
+
+
+@event.listens_for(Session, 'after_flush')
+def _roll_up(session, flush_context):
+    events, trips = [], []
+    for obj in session.new:
+        if isinstance(obj, PassengerEvent):
+            events.append((obj, 1))
+        elif isinstance(obj, Trip):
+            trips.append((obj, True))
+    for obj in session.deleted:
+        if isinstance(obj, PassengerEvent):
+            events.append((obj, -1))
+    for obj in session.dirty:
+        if isinstance(obj, Trip) and _status_change(obj):
+            trips.append((obj, False))
+    if not events and not trips:
+        return
+
+    connection = session.connection()
+    keys = trip_keys(connection, {e.trip_id for e, _ in events} | {t.id for t, _ in trips})
+    now = datetime.utcnow()
+    increments = Increments()
+    for passenger_event, sign in events:
+        key = keys.get(passenger_event.trip_id)
+        if key is not None:
+            increments.add_passengers(passenger_event.trip_id, key, passenger_event.event_type,
+                                      sign * (passenger_event.count or 0), passenger_event.created_at or now)
+    for trip, is_new in trips:
+        key = keys.get(trip.id)
+        if key is None:
+            continue
+        if is_new:
+            increments.add(key, trip.start_time or now, 'trips_started', 1)
+            old_status = None
+        else:
+            old_status = _status_change(trip)[0]
+        if trip.status == 'completed' and old_status != 'completed':
+            increments.add(key, trip.end_time or now, 'trips_completed', 1)
+        elif old_status == 'completed' and trip.status != 'completed':
+            increments.add(key, trip.end_time or now, 'trips_completed', -1)
+    apply(connection, increments)
+
+
+def rebuild():
+    """Recompute every rollup from the raw Trip and PassengerEvent rows. Needs an app context."""
+    connection = db.session.connection()
+    connection.execute(RidershipRollup.__table__.delete())
+    connection.execute(TripPassengerTotal.__table__.delete())
+
+    trips, vehicles = Trip.__table__, Vehicle.__table__
+    keys = {}
+    increments = Increments()
+    rows = connection.execute(
+        select(trips.c.id, vehicles.c.owner_id, trips.c.vehicle_id, trips.c.driver_id, trips.c.route_name,
+               trips.c.start_time, trips.c.end_time, trips.c.status)
+        .select_from(trips.outerjoin(vehicles, vehicles.c.id == trips.c.vehicle_id))
+    )
+    for trip_id, owner_id, vehicle_id, driver_id, route, start_time, end_time, status in rows:
+        key = keys[trip_id] = (owner_id or 0, vehicle_id, driver_id, route or '')
+        increments.add(key, start_time, 'trips_started', 1)
+        if status == 'completed':
+            increments.add(key, end_time or start_time, 'trips_completed', 1)
+
+    events = PassengerEvent.__table__
+    rows = connection.execute(select(events.c.trip_id, events.c.event_type, events.c.count, events.c.created_at))
+    for trip_id, event_type, count, created_at in rows:
+        if trip_id in keys and event_type in ('board', 'alight'):
+            increments.add_passengers(trip_id, keys[trip_id], event_type, count or 0, created_at)
+
+    db.session.bulk_insert_mappings(RidershipRollup, [
+        {**dict(zip(ROLLUP_KEY, key)), **counters} for key, counters in increments.rollups.items()
+    ])
+    db.session.bulk_insert_mappings(TripPassengerTotal, [
+        {'trip_id': trip_id, **counters} for trip_id, counters in increments.trips.items()
+    ])
+    db.session.commit()
+    return len(increments.rollups), len(increments.trips)
+
+
+def remove_vehicle(vehicle_id):
+    """Delete the rollups and passenger totals of a vehicle whose trips are being deleted.
+
+    For bulk deletes that bypass the flush listener; runs in the caller's transaction.
+    """
+    connection = db.session.connection()
+    trips, totals = Trip.__table__, TripPassengerTotal.__table__
+    connection.execute(totals.delete().where(
+        totals.c.trip_id.in_(select(trips.c.id).where(trips.c.vehicle_id == vehicle_id))))
+    connection.execute(RidershipRollup.__table__.delete().where(RidershipRollup.vehicle_id == vehicle_id))
+
+
+def trip_passengers(trip_id):
+    """(boards, alights) of a trip so far."""
+    total = TripPassengerTotal.query.get(trip_id)
+    return (total.boards, total.alights) if total else (0, 0)
+
+
+def totals(period, start, end=None, **filters):
+    """Counters summed over the period's rows with bucket in [start, end), filtered by key columns."""
+    query = db.session.query(*[func.coalesce(func.sum(getattr(RidershipRollup, name)), 0) for name in COUNTERS])
+    query = query.filter(RidershipRollup.period == period, RidershipRollup.bucket >= bucket(start, period))
+    if end is not None:
+        query = query.filter(RidershipRollup.bucket < end)
+    for name, value in filters.items():
+        query = query.filter(getattr(RidershipRollup, name) == value)
+    return dict(zip(COUNTERS, (int(value) for value in query.one())))
+
+
+def series(period, start, end, **filters):
+    """Counters per bucket for [start, end), oldest first."""
+    columns = [func.sum(getattr(RidershipRollup, name)) for name in COUNTERS]
+    query = db.session.query(RidershipRollup.bucket, *columns).filter(
+        RidershipRollup.period == period,
+        RidershipRollup.bucket >= bucket(start, period),
+        RidershipRollup.bucket < end
+    )
+    for name, value in filters.items():
+        query = query.filter(getattr(RidershipRollup, name) == value)
+    return [
+        {'bucket': row[0].isoformat(), **dict(zip(COUNTERS, (int(value or 0) for value in row[1:])))}
+        for row in query.group_by(RidershipRollup.bucket).order_by(RidershipRollup.bucket)
+    ]
+
+
+def today():
+    return bucket(datetime.utcnow(), 'day')
@@ -0,0 +1,79 @@
+"""
+Route-keyed subscription rooms
+
+Commuters usually follow a handful of jeepney routes. A client that
+subscribes to routes joins one Socket.IO room (and can open one SSE stream)
+per route and receives updates only for vehicles on those routes.
+
+Vehicles move between rooms on their own: a flush listener notices when
+Vehicle.route changes (set_vehicle_route, update_vehicle_route or anything
+else that writes it) and, once the transaction commits, announces the move
+so subscribers of the old route drop the vehicle and subscribers of the new
+route pick it up.
+"""
+import re
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from commit_hooks import after_commit
+from models.vehicle import Vehicle
+
+# A client can follow at most this many routes at once
+MAX_ROUTE_SUBSCRIPTIONS = 20
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def route_key(route):
+    """Normalize a route name so 'Carmen to Lapasan' and ' carmen  TO lapasan' match."""
+    if route is None:
+        return None
+    key = _WHITESPACE.sub(' ', str(route)).strip().lower()
+    return key or None
+
+
+def route_room(route):
+    key = route_key(route)
+    return f"route_{key}" if key else None
+
+
+def parse_routes(value):
+    """Parse a route list (list or comma-separated string) into unique route keys."""
+    if value is None:
+        return []
+    items = value.split(',') if isinstance(value, str) else value
+    if not isinstance(items, (list, tuple)):
+        raise ValueError('routes must be a list')
+
+    keys = []
+    for item in items:
+        key = route_key(item)
+        if key and key not in keys:
+            keys.append(key)
+    if len(keys) > MAX_ROUTE_SUBSCRIPTIONS:
+        raise ValueError(f"at most {MAX_ROUTE_SUBSCRIPTIONS} routes can be followed")
+    return keys
+
+
+def _announce_route_changes(changes):
+    from events_optimized import emit_vehicle_route_change
+    for vehicle, old_route in changes:
+        emit_vehicle_route_change(vehicle, old_route)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_route_changes(session, flush_context):
+    changes = []
+    for obj in session.dirty:
+        if not isinstance(obj, Vehicle):
+            continue
+        history = inspect(obj).attrs.route.history
+        if not history.has_changes():
+            continue
+        old_route = history.deleted[0] if history.deleted else None
+        if route_key(old_route) != route_key(obj.route):
+            changes.append((obj, old_route))
+
+    if changes:
+        after_commit(session, _announce_route_changes, changes)
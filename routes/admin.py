@@ -11,6 +11,7 @@ import io
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
+import dashboard_aggregates
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -21,24 +22,50 @@ def dashboard():
         flash('Access denied. Admin account required.', 'error')
         return redirect(url_for('index'))
     
-    # Get counts for dashboard
-    vehicle_count = Vehicle.query.count()
-    active_vehicle_count = Vehicle.query.filter_by(status='active').count()
-    driver_count = User.query.filter_by(user_type='driver').count()
-    operator_count = User.query.filter_by(user_type='operator').count()
-    
-    # Get recent logs
-    recent_logs = DriverActionLog.query.order_by(desc(DriverActionLog.created_at)).limit(5).all()
+    # Counts come from the in-memory dashboard aggregates, no COUNT queries
+    aggregates = dashboard_aggregates.ensure_started()
+    vehicles = aggregates.vehicle_counts()
     
     return render_template(
         'admin/dashboard.html',
-        vehicle_count=vehicle_count,
-        active_vehicle_count=active_vehicle_count,
-        driver_count=driver_count,
-        operator_count=operator_count,
-        recent_logs=recent_logs
+        vehicle_count=vehicles['total'],
+        active_vehicle_count=vehicles['active'],
+        driver_count=aggregates.user_counts('driver')['total'],
+        operator_count=aggregates.user_counts('operator')['total'],
+        recent_logs=aggregates.recent_logs()
     )
 
+@admin_bp.route('/fleet/overview')
+@login_required
+def fleet_overview():
+    """Fleet, driver and trip figures for the dashboard stat cards, from the in-memory aggregates."""
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied. Admin account required.'}), 403
+
+    aggregates = dashboard_aggregates.ensure_started()
+    vehicles = aggregates.vehicle_counts()
+    drivers = aggregates.user_counts('driver')
+    last_24h = aggregates.last_24h()
+
+    return jsonify({
+        'fleet': {
+            'total_vehicles': vehicles['total'],
+            'active_vehicles': vehicles['active'],
+            'delayed_vehicles': vehicles['delayed'],
+            'inactive_vehicles': vehicles['inactive']
+        },
+        'drivers': {
+            'total_drivers': drivers['total'],
+            'active_drivers': drivers['active'],
+            'inactive_drivers': drivers['inactive']
+        },
+        'activity': {
+            'recent_logs_24h': last_24h['driver_logs'],
+            'recent_trips_24h': last_24h['trips_started'],
+            'active_trips': aggregates.active_trip_count()
+        }
+    })
+
 @admin_bp.route('/logs/actions')
 @login_required
 def action_logs():
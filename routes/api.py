@@ -7,9 +7,28 @@ from models import db
 from datetime import datetime
 from sqlalchemy import func
 import json
+from caching import get_cache, MemoryBackend
+from spatial_index import SpatialIndex, parse_bbox
 
 api_bp = Blueprint('api', __name__)
 
+# Positions of active vehicles for bbox lookups, rebuilt at most every few seconds
+ACTIVE_INDEX_TTL = 5
+_active_index_cache = get_cache('api-active-vehicle-index', ttl=ACTIVE_INDEX_TTL,
+                                backend=MemoryBackend(max_entries=1))
+
+
+def _load_active_vehicle_index():
+    index = SpatialIndex()
+    rows = db.session.query(Vehicle.id, Vehicle.current_latitude, Vehicle.current_longitude).filter(
+        Vehicle.status.in_(['active', 'delayed']),
+        Vehicle.current_latitude.isnot(None),
+        Vehicle.current_longitude.isnot(None)
+    ).all()
+    for vehicle_id, latitude, longitude in rows:
+        index.upsert(vehicle_id, latitude, longitude)
+    return index
+
 def _build_vehicle_response(vehicle):
     """Helper to include passenger summary information with a vehicle."""
     data = vehicle.to_dict()
@@ -36,13 +55,13 @@ def _get_vehicle_passenger_summary(vehicle_id):
     
     boards = (
         db.session.query(func.coalesce(func.sum(PassengerEvent.count), 0))
-        .filter_by(trip_id=active_trip.id, event_type='board')
+        .filter(PassengerEvent.trip_id == active_trip.id, PassengerEvent.event_type == 'board')
         .scalar() or 0
     )
     
     alights = (
         db.session.query(func.coalesce(func.sum(PassengerEvent.count), 0))
-        .filter_by(trip_id=active_trip.id, event_type='alight')
+        .filter(PassengerEvent.trip_id == active_trip.id, PassengerEvent.event_type == 'alight')
         .scalar() or 0
     )
     
@@ -104,14 +123,25 @@ def get_operator_vehicles():
 
 @api_bp.route('/api/vehicles/active', methods=['GET'])
 def get_active_vehicles():
-    """Get all active vehicles."""
+    """Get all active vehicles, optionally only those inside bbox=west,south,east,north."""
     try:
-        # Get all active vehicles
-        active_vehicles = Vehicle.query.filter(
-            Vehicle.status.in_(['active', 'delayed']),
-            Vehicle.current_latitude.isnot(None),
-            Vehicle.current_longitude.isnot(None)
-        ).all()
+        try:
+            bbox = parse_bbox(request.args.get('bbox'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid bbox: {e}'}), 400
+        
+        if bbox is not None:
+            # Look up ids in the in-memory index, then load only those rows
+            index = _active_index_cache.get_or_load('index', _load_active_vehicle_index)
+            vehicle_ids = index.within(bbox)
+            active_vehicles = Vehicle.query.filter(Vehicle.id.in_(vehicle_ids)).all() if vehicle_ids else []
+        else:
+            # Get all active vehicles
+            active_vehicles = Vehicle.query.filter(
+                Vehicle.status.in_(['active', 'delayed']),
+                Vehicle.current_latitude.isnot(None),
+                Vehicle.current_longitude.isnot(None)
+            ).all()
         
         vehicle_payload = [_build_vehicle_response(v) for v in active_vehicles]
         
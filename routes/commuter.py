@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, jsonify, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
 from models.vehicle import Vehicle
 from datetime import datetime, timedelta
+import liveness
 
 commuter_bp = Blueprint('commuter', __name__)
 
@@ -23,11 +24,12 @@ def get_active_vehicles():
         print(f"[COMMUTER DASHBOARD] DEBUG: Vehicle #{v.id}: Status={v.status}, "
               f"Updated={v.last_updated}, Coords=({v.current_latitude}, {v.current_longitude})")
     
-    # Get all active and delayed vehicles WITHOUT a timestamp filter
-    # This is the key change from before - no time restriction
-    active_vehicles = Vehicle.query.filter(
+    # Get all active and delayed vehicles WITHOUT a timestamp filter; vehicles
+    # that stopped reporting are dropped by the liveness tracker instead
+    liveness.start(current_app._get_current_object())
+    active_vehicles = [v for v in Vehicle.query.filter(
         Vehicle.status.in_(['active', 'delayed'])
-    ).all()
+    ).all() if not liveness.tracker.is_offline(v.id)]
     
     # Debug information
     print(f"[COMMUTER DASHBOARD] Found {len(active_vehicles)} active/delayed vehicles")
@@ -41,6 +43,7 @@ def get_active_vehicles():
     vehicle_dicts = []
     for v in active_vehicles:
         v_dict = v.to_dict()
+        v_dict['liveness'] = liveness.tracker.state(v.id) or liveness.LIVE
         # Check if coordinates are present
         if v.current_latitude and v.current_longitude:
             vehicle_dicts.append(v_dict)
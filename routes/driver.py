@@ -1,12 +1,20 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app, make_response
 from flask_login import login_required, current_user
 from models.user import User, DriverActionLog, Trip, PassengerEvent
-from models.vehicle import Vehicle
+from models.vehicle import Vehicle, SEAT_COUNT, ALL_SEATS, seats_from_list, seats_to_list, occupied_passenger_seats
 from models import db
+from commit_hooks import after_commit
 from datetime import datetime
 from werkzeug.security import check_password_hash, generate_password_hash
 import json
 import math
+from vehicle_access import vehicle_access_or_404
+import batch_loader
+import location_batch
+import location_dedup
+import rate_limit
+import ridership
+from snapshots import build_snapshot, snapshot_response
 
 driver_bp = Blueprint('driver', __name__)
 
@@ -59,13 +67,12 @@ def update_occupancy(vehicle_id):
     if current_user.user_type != 'driver':
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Get the new occupancy status from the request
     data = request.get_json()
     new_status = data.get('occupancy_status')
@@ -108,11 +115,8 @@ def update_seat_status(vehicle_id):
     if current_user.user_type != 'driver':
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # Get the seat data from the request
@@ -123,16 +127,16 @@ def update_seat_status(vehicle_id):
     if seat_index is None or occupied is None:
         return jsonify({'error': 'Missing required fields: seat_index and occupied'}), 400
     
-    if not isinstance(seat_index, int) or seat_index < 0 or seat_index >= 15:
+    if not isinstance(seat_index, int) or seat_index < 0 or seat_index >= SEAT_COUNT:
         return jsonify({'error': 'Invalid seat_index. Must be between 0 and 14.'}), 400
     
     if not isinstance(occupied, bool):
         return jsonify({'error': 'Invalid occupied value. Must be boolean.'}), 400
     
     try:
-        # Update seat status
-        vehicle.set_seat_status(seat_index, occupied)
-        db.session.commit()
+        # Flip just this seat's bit in one UPDATE (other seats are left alone)
+        seat_bit = 1 << seat_index
+        seat_mask = Vehicle.update_seats(vehicle_id, seat_bit, seat_bit if occupied else 0)
         
         # Create a driver action log
         log = DriverActionLog(
@@ -151,12 +155,7 @@ def update_seat_status(vehicle_id):
         # Emit WebSocket event for real-time updates
         try:
             from events_optimized import emit_vehicle_update
-            emit_vehicle_update(vehicle_id, 'seat_updated', {
-                'seat_index': seat_index,
-                'occupied': occupied,
-                'seat_status': vehicle.get_seat_status(),
-                'occupied_seats': vehicle.get_occupied_seat_count()
-            })
+            emit_vehicle_update(vehicle_id, 'seat_updated', {'seat_mask': seat_mask})
         except ImportError:
             pass  # WebSocket events not available
         
@@ -165,8 +164,9 @@ def update_seat_status(vehicle_id):
             'message': f'Seat {seat_index + 1} status updated',
             'seat_index': seat_index,
             'occupied': occupied,
-            'seat_status': vehicle.get_seat_status(),
-            'occupied_seats': vehicle.get_occupied_seat_count()
+            'seat_mask': seat_mask,
+            'seat_status': seats_to_list(seat_mask),
+            'occupied_seats': occupied_passenger_seats(seat_mask)
         })
     except Exception as e:
         db.session.rollback()
@@ -175,43 +175,29 @@ def update_seat_status(vehicle_id):
 @driver_bp.route('/vehicle/<int:vehicle_id>/seat-status/bulk', methods=['POST'])
 @login_required
 def update_seat_status_bulk(vehicle_id):
-    """Update multiple seat statuses at once."""
+    """Update multiple seat statuses at once (seat_status list or seat_mask)."""
     if current_user.user_type != 'driver':
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
-    # Get the seat status array from the request
+    # Get the seat status array (or mask) from the request
     data = request.get_json()
-    seat_status = data.get('seat_status')
-    
-    if not isinstance(seat_status, list) or len(seat_status) != 15:
-        return jsonify({'error': 'Invalid seat_status. Must be an array of 15 boolean values.'}), 400
+    if 'seat_mask' in data:
+        bits = data.get('seat_mask')
+        if not isinstance(bits, int) or isinstance(bits, bool) or bits < 0 or bits > ALL_SEATS:
+            return jsonify({'error': 'Invalid seat_mask. Must be an integer between 0 and 32767.'}), 400
+    else:
+        seat_status = data.get('seat_status')
+        if not isinstance(seat_status, list) or len(seat_status) != SEAT_COUNT:
+            return jsonify({'error': 'Invalid seat_status. Must be an array of 15 boolean values.'}), 400
+        bits = seats_from_list(seat_status)
     
     try:
-        import json
-        # Get current route_info
-        if vehicle.route_info:
-            try:
-                route_data = json.loads(vehicle.route_info) if isinstance(vehicle.route_info, str) else vehicle.route_info
-            except (json.JSONDecodeError, TypeError):
-                route_data = {}
-        else:
-            route_data = {}
-        
-        # Update seat status
-        route_data['seat_status'] = seat_status
-        vehicle.route_info = json.dumps(route_data) if isinstance(route_data, dict) else route_data
-        db.session.commit()
-        
-        # Calculate occupied passenger seats (exclude driver seat at index 0)
-        # Only count passenger seats (indices 1-12), exclude driver seat (index 0)
-        occupied_passenger_seats = sum(1 for i, s in enumerate(seat_status) if s and i > 0 and i < 13)
+        seat_mask = Vehicle.update_seats(vehicle_id, ALL_SEATS, bits)
+        occupied_count = occupied_passenger_seats(seat_mask)
         
         # Create a driver action log
         log = DriverActionLog(
@@ -219,8 +205,8 @@ def update_seat_status_bulk(vehicle_id):
             vehicle_id=vehicle_id,
             action='seat_status_bulk_update',
             meta_data={
-                'seat_status': seat_status,
-                'occupied_count': occupied_passenger_seats,
+                'seat_mask': seat_mask,
+                'occupied_count': occupied_count,
                 'timestamp': datetime.utcnow().isoformat()
             }
          )
@@ -230,18 +216,16 @@ def update_seat_status_bulk(vehicle_id):
         # Emit WebSocket event for real-time updates
         try:
             from events_optimized import emit_vehicle_update
-            emit_vehicle_update(vehicle_id, 'seat_updated', {
-                'seat_status': seat_status,
-                'occupied_seats': occupied_passenger_seats
-            })
+            emit_vehicle_update(vehicle_id, 'seat_updated', {'seat_mask': seat_mask})
         except ImportError:
             pass  # WebSocket events not available
         
         return jsonify({
             'success': True,
             'message': 'Seat status updated',
-            'seat_status': seat_status,
-            'occupied_seats': occupied_passenger_seats
+            'seat_mask': seat_mask,
+            'seat_status': seats_to_list(seat_mask),
+            'occupied_seats': occupied_count
         })
     except Exception as e:
         db.session.rollback()
@@ -254,12 +238,12 @@ def get_vehicle_details(vehicle_id):
     if current_user.user_type != 'driver':
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Get seat status
     seat_status = vehicle.get_seat_status()
     occupied_seats = vehicle.get_occupied_seat_count()
@@ -275,6 +259,7 @@ def get_vehicle_details(vehicle_id):
             'occupancy_status': vehicle.occupancy_status,
             'route': vehicle.route,
             'route_info': vehicle.route_info,
+            'seat_mask': vehicle.seat_mask,
             'seat_status': seat_status,
             'occupied_seats': occupied_seats
         }
@@ -298,11 +283,8 @@ def start_trip():
     if not route_name:
         return jsonify({'error': 'Route name is required.'}), 400
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # Check if there's already an active trip for this vehicle
@@ -323,10 +305,10 @@ def start_trip():
         status='active'
     )
     
-    # Clear the public vehicle cache so the vehicle immediately appears on the map
+    # Refresh the public vehicle feed once the trip is committed, so the vehicle immediately appears on the map
     try:
         from routes.public import clear_vehicle_cache
-        clear_vehicle_cache()
+        after_commit(db.session, clear_vehicle_cache)
     except Exception as e:
         print(f"Could not clear vehicle cache: {e}")
     
@@ -378,11 +360,8 @@ def end_trip():
     if not vehicle_id:
         return jsonify({'error': 'Vehicle ID is required.'}), 400
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # Get the active trip for this vehicle
@@ -398,10 +377,10 @@ def end_trip():
     active_trip.end_time = datetime.utcnow()
     active_trip.status = 'completed'
     
-    # Clear the public vehicle cache so the vehicle is immediately hidden from the map
+    # Refresh the public vehicle feed once the trip is committed, so the vehicle is immediately hidden from the map
     try:
         from routes.public import clear_vehicle_cache
-        clear_vehicle_cache()
+        after_commit(db.session, clear_vehicle_cache)
     except Exception as e:
         print(f"Could not clear vehicle cache: {e}")
     
@@ -463,11 +442,8 @@ def record_passenger_event():
     except ValueError:
         return jsonify({'error': 'Count must be a valid integer.'}), 400
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # Get the active trip for this vehicle
@@ -500,6 +476,13 @@ def record_passenger_event():
         }
     )
     
+    # Refresh the public vehicle feed once the event is committed, so the map shows the new passenger count
+    try:
+        from routes.public import clear_vehicle_cache
+        after_commit(db.session, clear_vehicle_cache)
+    except ImportError as e:
+        print(f"❌ Failed to clear vehicle cache: {e}")
+    
     # Save changes to database
     db.session.add(event)
     db.session.add(log)
@@ -507,14 +490,6 @@ def record_passenger_event():
     
     print(f"✅ Passenger event saved: trip_id={active_trip.id}, vehicle_id={vehicle_id}, type={event_type}, count={count}")
     
-    # Clear vehicle cache so map updates with new passenger count
-    try:
-        from routes.public import clear_vehicle_cache
-        clear_vehicle_cache()
-        print("✅ Vehicle cache cleared successfully")
-    except ImportError as e:
-        print(f"❌ Failed to clear vehicle cache: {e}")
-    
     return jsonify({
         'success': True,
         'message': f'Passenger {event_type} event recorded successfully',
@@ -594,11 +569,11 @@ def export_trip_history():
         # Create CSV content
         csv_content = "Trip ID,Vehicle ID,Route Name,Start Time,End Time,Status,Total Passengers\n"
         
+        # Passenger totals for every trip in one query
+        passengers = batch_loader.trip_passengers.load_many([trip.id for trip in trips])
+        
         for trip in trips:
-            # Calculate total passengers for this trip
-            passenger_events = PassengerEvent.query.filter_by(trip_id=trip.id).all()
-            boards = sum(event.count for event in passenger_events if event.event_type == 'board')
-            alights = sum(event.count for event in passenger_events if event.event_type == 'alight')
+            boards, alights = passengers[trip.id] or (0, 0)
             total_passengers = max(0, boards - alights)
             
             end_time = trip.end_time.isoformat() if trip.end_time else 'N/A'
@@ -738,8 +713,8 @@ def delete_account():
         db.session.add(log)
         db.session.commit()
         
-        # Delete the user account
-        db.session.delete(current_user)
+        # Delete the user account (current_user is a cached proxy, delete the real row)
+        db.session.delete(current_user.get_user())
         db.session.commit()
         
         return jsonify({
@@ -759,18 +734,9 @@ def get_trip_stats():
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
     try:
-        # Get today's date
-        today = datetime.utcnow().date()
-        
-        # Count today's trips
-        today_trips = Trip.query.filter(
-            Trip.driver_id == current_user.id,
-            Trip.start_time >= datetime.combine(today, datetime.min.time()),
-            Trip.start_time < datetime.combine(today, datetime.max.time())
-        ).count()
-        
-        # Count total trips
-        total_trips = Trip.query.filter_by(driver_id=current_user.id).count()
+        # Trips started today and ever, from the ridership rollups
+        today_trips = ridership.totals('day', ridership.today(), driver_id=current_user.id)['trips_started']
+        total_trips = ridership.totals('total', ridership.TOTAL_BUCKET, driver_id=current_user.id)['trips_started']
         
         return jsonify({
             'success': True,
@@ -792,11 +758,8 @@ def get_current_trip(vehicle_id):
     if current_user.user_type != 'driver':
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # Get the active trip for this vehicle
@@ -811,12 +774,8 @@ def get_current_trip(vehicle_id):
             'trip': None
         })
     
-    # Get passenger events for this trip
-    passenger_events = PassengerEvent.query.filter_by(trip_id=active_trip.id).all()
-    
-    # Calculate current passenger count (boards - alights)
-    boards = sum(event.count for event in passenger_events if event.event_type == 'board')
-    alights = sum(event.count for event in passenger_events if event.event_type == 'alight')
+    # Current passenger count (boards - alights) from the trip's running totals
+    boards, alights = ridership.trip_passengers(active_trip.id)
     current_passengers = max(0, boards - alights)
     
     return jsonify({
@@ -906,11 +865,8 @@ def calculate_route():
     if not end_point:
         return jsonify({'error': 'End point is required.'}), 400
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You are not assigned to this vehicle.'}), 403
     
     # In a real application, you would use a mapping API to calculate the route
@@ -964,14 +920,13 @@ def passenger_counter(vehicle_id):
         flash('Access denied. Driver account required.', 'error')
         return redirect(url_for('index'))
     
-    # Get the vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    
     # Check if the driver is assigned to this vehicle
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         flash('Access denied. You are not assigned to this vehicle.', 'error')
         return redirect(url_for('driver.dashboard'))
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     return render_template('operator/passenger_counter.html', vehicle=vehicle)
 
 @driver_bp.route('/settings')
@@ -1026,6 +981,76 @@ def get_driver_vehicle_assignment():
         'count': len(vehicles_data)
     })
 
+@driver_bp.route('/bootstrap')
+@login_required
+def get_driver_bootstrap():
+    """Everything the driver dashboard needs on load, in one response.
+    
+    Combines trip-stats, vehicle-assignment, vehicle details and current-trip
+    for every assigned vehicle from a fixed set of queries. The position
+    fields are left out (they change with every fix and the dashboard doesn't
+    read them) so the ETag stays stable while nothing the page shows changes.
+    """
+    if current_user.user_type != 'driver':
+        return jsonify({'error': 'Access denied. Driver account required.'}), 403
+    
+    vehicles = Vehicle.query.filter_by(assigned_driver_id=current_user.id).order_by(Vehicle.id).all()
+    
+    # Active trips for all assigned vehicles at once, then their passenger totals
+    active_trips = {}
+    if vehicles:
+        for trip in Trip.query.filter(Trip.vehicle_id.in_([vehicle.id for vehicle in vehicles]),
+                                      Trip.status == 'active').order_by(Trip.start_time).all():
+            active_trips[trip.vehicle_id] = trip
+    passengers = batch_loader.trip_passengers.load_many([trip.id for trip in active_trips.values()])
+    
+    vehicles_data = []
+    for vehicle in vehicles:
+        trip = active_trips.get(vehicle.id)
+        current_trip = None
+        if trip:
+            boards, alights = passengers.get(trip.id) or (0, 0)
+            current_trip = {
+                'id': trip.id,
+                'vehicle_id': trip.vehicle_id,
+                'driver_id': trip.driver_id,
+                'route_name': trip.route_name,
+                'start_time': trip.start_time.isoformat(),
+                'status': trip.status,
+                'passenger_summary': {
+                    'boards': boards,
+                    'alights': alights,
+                    'current_passengers': max(0, boards - alights)
+                }
+            }
+        vehicles_data.append({
+            'id': vehicle.id,
+            'registration_number': vehicle.registration_number,
+            'vehicle_type': vehicle.vehicle_type,
+            'status': vehicle.status,
+            'occupancy_status': vehicle.occupancy_status,
+            'route': vehicle.route,
+            'route_info': vehicle.route_info,
+            'capacity': vehicle.capacity,
+            'assigned_driver_id': vehicle.assigned_driver_id,
+            'seat_mask': vehicle.seat_mask,
+            'seat_status': vehicle.get_seat_status(),
+            'occupied_seats': vehicle.get_occupied_seat_count(),
+            'current_trip': current_trip
+        })
+    
+    payload = {
+        'success': True,
+        'stats': {
+            'today_trips': ridership.totals('day', ridership.today(), driver_id=current_user.id)['trips_started'],
+            'total_trips': ridership.totals('total', ridership.TOTAL_BUCKET, driver_id=current_user.id)['trips_started']
+        },
+        'vehicles': vehicles_data,
+        'count': len(vehicles_data)
+    }
+    # Per-driver data: the browser may keep it but must revalidate with the ETag
+    return snapshot_response(build_snapshot(payload, compress=False), cache_control='private, no-cache')
+
 @driver_bp.route('/vehicle/<int:vehicle_id>/route-info')
 @login_required
 def get_vehicle_route_info(vehicle_id):
@@ -1034,10 +1059,11 @@ def get_vehicle_route_info(vehicle_id):
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
     # Check if driver is assigned to this vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You can only access your assigned vehicles.'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Debug logging
     print(f"🔍 DEBUG: Route info request for vehicle {vehicle_id}")
     print(f"🔍 DEBUG: Vehicle route field: {vehicle.route}")
@@ -1070,10 +1096,11 @@ def update_vehicle_route(vehicle_id):
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
     # Check if driver is assigned to this vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You can only update your assigned vehicles.'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Get data from request
     data = request.get_json()
     route_name = data.get('route_name')
@@ -1132,10 +1159,13 @@ def update_vehicle_location(vehicle_id):
         return jsonify({'error': 'Access denied. Driver account required.'}), 403
     
     # Check if driver is assigned to this vehicle
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.assigned_driver_id != current_user.id:
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
         return jsonify({'error': 'Access denied. You can only update your assigned vehicles.'}), 403
     
+    # Shares the socket location_update bucket for the vehicle
+    if not rate_limit.allow('location_update', f"vehicle:{vehicle_id}"):
+        return jsonify({'error': 'Too many location updates, slow down'}), 429
+    
     # Handle both JSON and form data
     data = request.get_json() if request.is_json else request.form
     
@@ -1154,6 +1184,22 @@ def update_vehicle_location(vehicle_id):
     except ValueError:
         return jsonify({'error': 'Invalid location format'}), 400
     
+    # Drop retried and out-of-order fixes (optional seq / device timestamp) before any database work
+    try:
+        device_ts = location_batch.parse_timestamp(data['timestamp']) if data.get('timestamp') else None
+    except (TypeError, ValueError):
+        device_ts = None
+    seq = location_dedup.parse_sequence(data.get('seq'))
+    result = location_dedup.fixes.check(vehicle_id, latitude, longitude, device_ts, seq)
+    if result != location_dedup.ACCEPTED:
+        return jsonify({
+            'success': True,
+            'duplicate': True,
+            'message': f'Fix ignored ({result.replace("_", " ")})'
+        })
+    
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Calculate speed if we have previous location (SAME LOGIC AS events_optimized.py)
     speed_kmh = None
     if vehicle.current_latitude and vehicle.current_longitude and vehicle.last_updated:
@@ -1196,8 +1242,9 @@ def update_vehicle_location(vehicle_id):
         accuracy=accuracy
     )
     
-    # Save to database
+    # Save to database; the fix only counts as seen once it is stored
     db.session.add(location_log)
+    location_dedup.remember_after_commit(db.session, vehicle_id, latitude, longitude, device_ts, seq)
     db.session.commit()
     
     # Emit WebSocket event for real-time updates
@@ -1225,6 +1272,65 @@ def update_vehicle_location(vehicle_id):
         }
     })
 
+@driver_bp.route('/vehicle/<int:vehicle_id>/locations', methods=['POST'])
+@login_required
+def upload_vehicle_locations(vehicle_id):
+    """Upload a batch of buffered fixes (for assigned drivers only).
+
+    Body: {"fixes": [[timestamp, lat, lon, accuracy?], ...], "occupancy_status"?}
+    """
+    if current_user.user_type != 'driver':
+        return jsonify({'error': 'Access denied. Driver account required.'}), 403
+
+    if vehicle_access_or_404(vehicle_id).driver_id != current_user.id:
+        return jsonify({'error': 'Access denied. You can only update your assigned vehicles.'}), 403
+
+    if not rate_limit.allow('location_batch', f"vehicle:{vehicle_id}"):
+        return jsonify({'error': 'Too many uploads, slow down'}), 429
+
+    data = request.get_json(silent=True) or {}
+    try:
+        fixes, rejected = location_batch.parse_batch(data.get('fixes'))
+    except location_batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    if not fixes:
+        return jsonify({'error': 'No valid fixes in batch', 'rejected': rejected}), 400
+
+    # A retried batch succeeds without touching the database
+    fixes, duplicates = location_dedup.filter_new(vehicle_id, fixes)
+    if not fixes:
+        return jsonify({'success': True, 'accepted': 0, 'duplicates': duplicates, 'rejected': rejected})
+
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    location_dedup.remember_batch_after_commit(db.session, vehicle_id, fixes)
+    newest, speed_kmh = location_batch.store_batch(vehicle, fixes, data.get('occupancy_status'))
+
+    if newest is not None:
+        try:
+            from events_optimized import emit_vehicle_update
+            emit_vehicle_update(vehicle_id, 'vehicle_updated', {
+                'latitude': newest.latitude,
+                'longitude': newest.longitude,
+                'occupancy_status': vehicle.occupancy_status,
+                'last_updated': vehicle.last_updated.isoformat()
+            })
+        except ImportError:
+            pass  # WebSocket events not available
+
+    return jsonify({
+        'success': True,
+        'accepted': len(fixes),
+        'duplicates': duplicates,
+        'rejected': rejected,
+        'location': {
+            'latitude': vehicle.current_latitude,
+            'longitude': vehicle.current_longitude,
+            'occupancy_status': vehicle.occupancy_status,
+            'last_updated': vehicle.last_updated.isoformat() if vehicle.last_updated else None,
+            'speed_kmh': round(speed_kmh, 2) if speed_kmh else None
+        }
+    })
+
 def _calculate_distance_km(lat1, lon1, lat2, lon2):
     """Calculate distance between two points using Haversine formula (in kilometers)."""
     # Earth radius in kilometers
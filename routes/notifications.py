@@ -224,4 +224,4 @@ def force_notify(commuter_id, vehicle_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     force_notify_commuter(commuter_id, vehicle_id)
-    return jsonify({'success': True, 'message': f'Notification sent to commuter {commuter_id} about vehicle {vehicle_id}'}) 
\ No newline at end of file
+    return jsonify({'success': True, 'message': f'Notification queued for commuter {commuter_id} about vehicle {vehicle_id}'}) 
\ No newline at end of file
@@ -6,12 +6,15 @@ from models.location_log import LocationLog
 from models import db
 from datetime import datetime, timedelta
 from sqlalchemy import text, desc, func, and_, or_
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import json
 import requests
 import time # Added for rate limiting retry logic
 import os
+from vehicle_access import vehicle_access_or_404
+import batch_loader
 
 operator_bp = Blueprint('operator', __name__)
 
@@ -64,22 +67,16 @@ def dashboard():
         Vehicle.status == 'active'
     ).all()
     
-    # Get active trip information for each vehicle
-    from models.user import Trip
+    # Active trips come from the in-memory dashboard aggregates
+    import dashboard_aggregates
+    aggregates = dashboard_aggregates.ensure_started()
+    # Assigned drivers in one query instead of a lazy load per vehicle
+    drivers = batch_loader.users.load_many([vehicle.assigned_driver_id for vehicle in vehicles])
     for vehicle in vehicles:
-        if vehicle.assigned_driver_id:
-            # This will trigger the relationship to load if not already loaded
-            _ = vehicle.assigned_driver
-        
-        # Check for active trip
-        active_trip = Trip.query.filter_by(
-            vehicle_id=vehicle.id,
-            status='active'
-        ).first()
+        set_committed_value(vehicle, 'assigned_driver', drivers.get(vehicle.assigned_driver_id))
         
         # Add trip status to vehicle object for template use
-        vehicle.has_active_trip = active_trip is not None
-        vehicle.active_trip = active_trip
+        vehicle.has_active_trip = aggregates.active_trip(vehicle.id) is not None
     
     return render_template('operator/dashboard.html', vehicles=vehicles)
 
@@ -333,10 +330,11 @@ def update_vehicle_location(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     # Handle both JSON and form data
     data = request.get_json() if request.is_json else request.form
     
@@ -407,15 +405,9 @@ def manage_drivers_page():
         flash('Access denied. Operator account required.', 'error')
         return redirect(url_for('index'))
     
-    # Force fresh database query - expire any cached User objects
-    db.session.expire_all()
-    
-    # Get drivers created by this operator - force fresh query
-    drivers = User.query.filter_by(created_by_id=current_user.id, user_type='driver').all()
-    
-    # Refresh each driver object to ensure we have latest profile_image_url
-    for driver in drivers:
-        db.session.refresh(driver)
+    # Get drivers created by this operator; populate_existing overwrites any
+    # cached User objects in one query, so profile_image_url is always fresh
+    drivers = User.query.filter_by(created_by_id=current_user.id, user_type='driver').populate_existing().all()
     
     # Render template with aggressive cache busting
     response = make_response(render_template('operator/manage_drivers.html', drivers=drivers))
@@ -801,11 +793,9 @@ def get_driver_details(driver_id):
     if driver.created_by_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You did not create this driver.'}), 403
     
-    # Get vehicles assigned to this driver
-    vehicles = Vehicle.query.filter_by(owner_id=driver.id).all()
-    
-    # Get recent activity logs
-    recent_activity = DriverActionLog.query.filter_by(driver_id=driver.id).order_by(desc(DriverActionLog.created_at)).limit(5).all()
+    # Get vehicles assigned to this driver and recent activity logs
+    vehicles = batch_loader.vehicles_by_driver.load(driver.id)
+    recent_activity = batch_loader.recent_logs.load(driver.id)
     
     return jsonify({
         'success': True,
@@ -849,10 +839,11 @@ def update_vehicle_occupancy(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to access this vehicle'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     data = request.get_json()
     occupancy_status = data.get('occupancy_status')
     
@@ -890,8 +881,7 @@ def start_vehicle_trip(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to access this vehicle'}), 403
     
     data = request.get_json()
@@ -951,8 +941,7 @@ def end_vehicle_trip(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to access this vehicle'}), 403
     
     try:
@@ -999,8 +988,7 @@ def get_current_trip(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to access this vehicle'}), 403
     
     try:
@@ -1013,16 +1001,10 @@ def get_current_trip(vehicle_id):
         if not active_trip:
             return jsonify({'trip': None})
         
-        # Get passenger summary
-        from models.user import PassengerEvent
-        passenger_events = PassengerEvent.query.filter_by(trip_id=active_trip.id).all()
-        
-        current_passengers = 0
-        for event in passenger_events:
-            if event.event_type == 'board':
-                current_passengers += event.count
-            elif event.event_type == 'alight':
-                current_passengers -= event.count
+        # Passenger summary from the trip's running totals
+        import ridership
+        boards, alights = ridership.trip_passengers(active_trip.id)
+        current_passengers = boards - alights
         
         return jsonify({
             'trip': {
@@ -1044,8 +1026,7 @@ def record_passenger_event(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to access this vehicle'}), 403
     
     data = request.get_json()
@@ -1315,10 +1296,11 @@ def assign_vehicle_to_driver(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to assign this vehicle'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     data = request.get_json()
     driver_id = data.get('driver_id')
     
@@ -1406,10 +1388,11 @@ def unassign_vehicle_from_driver(vehicle_id):
     if current_user.user_type != 'operator' and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. Operator account required.'}), 403
     
-    vehicle = Vehicle.query.get_or_404(vehicle_id)
-    if vehicle.owner_id != current_user.id and current_user.user_type != 'admin':
+    if vehicle_access_or_404(vehicle_id).owner_id != current_user.id and current_user.user_type != 'admin':
         return jsonify({'error': 'Access denied. You do not have permission to unassign this vehicle'}), 403
     
+    vehicle = Vehicle.query.get_or_404(vehicle_id)
+    
     if not vehicle.assigned_driver_id:
         return jsonify({'error': 'Vehicle is not assigned to any driver.'}), 400
     
@@ -1644,24 +1627,36 @@ def delete_vehicle(vehicle_id):
     try:
         # First, delete all related records in the correct order
         
-        # 1. Delete passenger events (they reference trips)
+        # 1. Delete the vehicle's trip metrics (they reference trips)
+        import trip_metrics
+        trip_metrics.remove_vehicle(vehicle_id)
+        
+        # 2. Delete the vehicle's ridership rollups and passenger totals (they reference trips)
+        import ridership
+        ridership.remove_vehicle(vehicle_id)
+        
+        # 3. Delete passenger events (they reference trips)
         from models.user import PassengerEvent, Trip
         trips = Trip.query.filter_by(vehicle_id=vehicle_id).all()
         for trip in trips:
             PassengerEvent.query.filter_by(trip_id=trip.id).delete()
         
-        # 2. Delete trips (they reference vehicles)
+        # 4. Delete trips (they reference vehicles)
         Trip.query.filter_by(vehicle_id=vehicle_id).delete()
         
-        # 3. Delete driver action logs (they reference vehicles)
+        # 5. Delete driver action logs (they reference vehicles)
         from models.user import DriverActionLog
         DriverActionLog.query.filter_by(vehicle_id=vehicle_id).delete()
         
-        # 4. Delete location logs (they reference vehicles)
+        # 6. Delete location logs (they reference vehicles)
         from models.location_log import LocationLog
         LocationLog.query.filter_by(vehicle_id=vehicle_id).delete()
         
-        # 5. Create action log BEFORE deleting
+        # 7. Delete stop visits (they reference vehicles)
+        import geofences
+        geofences.remove_vehicle(vehicle_id)
+        
+        # 8. Create action log BEFORE deleting
         operator_log = OperatorActionLog(
             operator_id=current_user.id,
             action='vehicle_deleted',
@@ -1676,7 +1671,7 @@ def delete_vehicle(vehicle_id):
         )
         db.session.add(operator_log)
         
-        # 6. Finally, delete the vehicle
+        # 9. Finally, delete the vehicle
         db.session.delete(vehicle)
         db.session.commit()
         return jsonify({'success': True, 'message': 'Vehicle deleted successfully.'})
@@ -2471,6 +2466,207 @@ def set_vehicle_route():
         error_response.headers['Content-Type'] = 'application/json'
         return error_response, 500
 
+@operator_bp.route('/routes/<path:route>/headways', methods=['GET'])
+@login_required
+def get_route_headways(route):
+    """Live order, gaps and headways of the vehicles on a route (own vehicles are marked)."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    import headways
+    from vehicle_access import get_vehicle_access
+    headways.load_route(route)
+    summary = headways.tracker.summary(route)
+    if summary is None:
+        return jsonify({'error': 'No vehicles with route coordinates on this route'}), 404
+    
+    for vehicle in summary['vehicles']:
+        access = get_vehicle_access(vehicle['id'])
+        vehicle['own'] = bool(access) and access.owner_id == current_user.id
+    return jsonify(summary)
+
+@operator_bp.route('/stops', methods=['GET'])
+@login_required
+def list_stops():
+    """List the operator's stops (plus shared stops that apply to every operator)."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from models.stop import Stop
+    query = Stop.query
+    if current_user.user_type != 'admin':
+        query = query.filter(or_(Stop.operator_id == current_user.id, Stop.operator_id.is_(None)))
+    route = request.args.get('route')
+    if route:
+        query = query.filter(or_(Stop.route == route, Stop.route.is_(None)))
+    return jsonify({'stops': [stop.to_dict() for stop in query.order_by(Stop.name).all()]})
+
+@operator_bp.route('/stops', methods=['POST'])
+@login_required
+def create_stop():
+    """Create a stop: {name, latitude, longitude, radius_m?, route?, polygon?: [[lat, lon], ...]}."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({'error': 'Stop name is required'}), 400
+    try:
+        latitude = float(data.get('latitude'))
+        longitude = float(data.get('longitude'))
+        radius_m = float(data.get('radius_m') or 50)
+        polygon = data.get('polygon')
+        if polygon is not None:
+            polygon = [[float(lat), float(lon)] for lat, lon in polygon]
+            if len(polygon) < 3:
+                raise ValueError('polygon needs at least 3 points')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid stop geometry: {e}'}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or not (5 <= radius_m <= 2000):
+        return jsonify({'error': 'Coordinates out of range or radius_m not between 5 and 2000'}), 400
+    
+    from models.stop import Stop
+    stop = Stop(name=name, route=(data.get('route') or None), operator_id=current_user.id,
+                latitude=latitude, longitude=longitude, radius_m=radius_m, polygon=polygon)
+    db.session.add(stop)
+    db.session.commit()
+    return jsonify({'success': True, 'stop': stop.to_dict()}), 201
+
+@operator_bp.route('/stops/from-routes', methods=['POST'])
+@login_required
+def create_terminal_stops():
+    """Create stops for the origin/destination terminals of the operator's vehicle routes."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from models.stop import Stop
+    radius_m = float((request.get_json(silent=True) or {}).get('radius_m') or 100)
+    existing = {(stop.name, stop.route) for stop in Stop.query.filter_by(operator_id=current_user.id).all()}
+    created = []
+    for vehicle in Vehicle.query.filter_by(owner_id=current_user.id).all():
+        try:
+            info = json.loads(vehicle.route_info) if vehicle.route_info else {}
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(info, dict) or not vehicle.route:
+            continue
+        for name_key, coords_key in (('origin', 'origin_coords'), ('destination', 'dest_coords')):
+            coords = info.get(coords_key) or {}
+            name = info.get(name_key)
+            if not name or coords.get('lat') is None or coords.get('lon') is None \
+                    or (name, vehicle.route) in existing:
+                continue
+            stop = Stop(name=name, route=vehicle.route, operator_id=current_user.id,
+                        latitude=float(coords['lat']), longitude=float(coords['lon']), radius_m=radius_m)
+            db.session.add(stop)
+            existing.add((name, vehicle.route))
+            created.append(stop)
+    db.session.commit()
+    return jsonify({'success': True, 'created': [stop.to_dict() for stop in created]})
+
+@operator_bp.route('/stops/<int:stop_id>', methods=['DELETE'])
+@login_required
+def delete_stop(stop_id):
+    """Delete one of the operator's stops (and its visit history)."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from models.stop import Stop, StopVisit
+    stop = Stop.query.get_or_404(stop_id)
+    if stop.operator_id != current_user.id and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied to this stop'}), 403
+    StopVisit.query.filter_by(stop_id=stop_id).delete(synchronize_session=False)
+    db.session.delete(stop)
+    db.session.commit()
+    return jsonify({'success': True})
+
+@operator_bp.route('/stops/<int:stop_id>/visits', methods=['GET'])
+@login_required
+def get_stop_visits(stop_id):
+    """Recent completed visits to a stop with dwell times, and the average dwell."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from models.stop import Stop, StopVisit
+    stop = Stop.query.get_or_404(stop_id)
+    if stop.operator_id not in (current_user.id, None) and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied to this stop'}), 403
+    
+    query = StopVisit.query.filter_by(stop_id=stop_id)
+    if current_user.user_type != 'admin':
+        owned = db.session.query(Vehicle.id).filter(Vehicle.owner_id == current_user.id)
+        query = query.filter(StopVisit.vehicle_id.in_(owned))
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    visits = query.order_by(StopVisit.departed_at.desc()).limit(limit).all()
+    average = sum(visit.dwell_seconds for visit in visits) / len(visits) if visits else None
+    return jsonify({
+        'stop': stop.to_dict(),
+        'visits': [visit.to_dict() for visit in visits],
+        'average_dwell_seconds': round(average, 1) if average is not None else None
+    })
+
+@operator_bp.route('/ridership', methods=['GET'])
+@login_required
+def get_ridership():
+    """Boards, alights and trips per hour or day (?period=, ?days=, ?vehicle_id=, ?route=) from the rollups."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    import ridership
+    period = request.args.get('period', 'day')
+    if period not in ('hour', 'day'):
+        return jsonify({'error': 'period must be "hour" or "day"'}), 400
+    days = max(1, min(request.args.get('days', 1 if period == 'hour' else 30, type=int), 366))
+
+    filters = {}
+    if current_user.user_type != 'admin':
+        filters['operator_id'] = current_user.id
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    if vehicle_id is not None:
+        filters['vehicle_id'] = vehicle_id
+    if request.args.get('route'):
+        filters['route'] = request.args['route']
+
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    return jsonify({
+        'period': period,
+        'start': ridership.bucket(start, period).isoformat(),
+        'end': end.isoformat(),
+        'series': ridership.series(period, start, end, **filters),
+        'totals': ridership.totals(period, start, end, **filters)
+    })
+
+@operator_bp.route('/analytics/vehicles', methods=['GET'])
+@login_required
+def get_vehicle_analytics():
+    """Distance, moving/idle/revenue hours, average speed and passenger-km per vehicle per day (?days=, ?vehicle_id=)."""
+    if current_user.user_type != 'operator' and current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    import trip_metrics
+    days = max(1, min(request.args.get('days', 7, type=int), 366))
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    start_day = (datetime.utcnow() - timedelta(days=days - 1)).date()
+
+    vehicles = Vehicle.query if current_user.user_type == 'admin' else Vehicle.query.filter_by(owner_id=current_user.id)
+    if vehicle_id is not None:
+        vehicles = vehicles.filter(Vehicle.id == vehicle_id)
+    registrations = dict(vehicles.with_entities(Vehicle.id, Vehicle.registration_number).all())
+
+    operator_id = None if current_user.user_type == 'admin' else current_user.id
+    rows = trip_metrics.stored_rows(start_day, operator_id=operator_id, vehicle_id=vehicle_id)
+    # Trips still in progress count towards the day they started
+    rows += [row for row in trip_metrics.tracker.live(set(registrations)) if row['day'] >= start_day]
+    analytics = trip_metrics.summarize(row for row in rows if row['vehicle_id'] in registrations)
+    for entry in analytics:
+        entry['registration_number'] = registrations[entry['vehicle_id']]
+    return jsonify({
+        'start_day': start_day.isoformat(),
+        'vehicles': analytics
+    })
+
 @operator_bp.route('/logs/actions')
 @login_required
 def operator_action_logs():
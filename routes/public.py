@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app, Response
 from models.vehicle import Vehicle
 from models.location_log import LocationLog
 from models.user import Trip, User, PassengerEvent
@@ -8,19 +8,33 @@ from sqlalchemy import desc, func, case
 import math
 import requests
 import json
-import time
+import os
+import hashlib
+import threading
+from snapshots import SnapshotRefresher, snapshot_response, build_snapshot
+from broadcast_hub import BroadcastHub, encode_event
+from spatial_index import SpatialIndex, parse_bbox
+from clustering import ClusterIndex, MAX_CLUSTER_ZOOM
+from route_rooms import route_key
+from async_server import is_evented
+import liveness
+import rate_limit
 
-# Simple in-memory cache for vehicle data
-_vehicle_cache = {}
-_cache_timestamp = 0
-CACHE_DURATION = 30  # Cache for 30 seconds
+# Refresh interval for the public vehicle feed snapshot
+CACHE_DURATION = 5  # Seconds - good balance between performance and freshness
+
+# Live stream settings. Under gthread each open stream holds a worker thread,
+# so keep SSE_MAX_STREAMS below the gunicorn threads setting; evented workers
+# hold streams as greenlets and can afford many more.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 2000 if is_evented() else 24))
+SSE_STREAM_SECONDS = 60  # Streams close after this and the browser reconnects
+SSE_HEARTBEAT_SECONDS = 15
+MAX_ROUTE_STREAMS = 256  # Distinct routes with their own stream hub
 
 def clear_vehicle_cache():
-    """Clear the vehicle cache to force refresh."""
-    global _vehicle_cache, _cache_timestamp
-    _vehicle_cache = {}
-    _cache_timestamp = 0
-    print("🔄 Vehicle cache cleared")
+    """Ask the background refresher to rebuild the public feed soon."""
+    _vehicle_feed.request_refresh()
+    print("🔄 Vehicle cache refresh requested")
 
 
 def get_current_passenger_count(trip_id):
@@ -61,298 +75,58 @@ def clear_cache_endpoint():
     return jsonify({'success': True, 'message': 'Cache cleared successfully'})
 
 @public_bp.route('/vehicles/active')
+@rate_limit.rate_limited('vehicles_active')
 def get_active_vehicles():
-    """Get all active vehicles for the public map - OPTIMIZED VERSION with aggressive caching."""
-    global _vehicle_cache, _cache_timestamp
+    """Get all active vehicles for the public map - OPTIMIZED VERSION with aggressive caching.
     
+    The feed is rebuilt by a background refresher and encoded once per refresh
+    into a shared snapshot. Handlers only copy the latest completed snapshot,
+    and unchanged polls are answered with 304 Not Modified.
+    """
     try:
-        # Check if cache should be bypassed (for manual refresh)
-        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
+        _vehicle_feed.start(current_app._get_current_object())
         
-        # Check cache first - use shorter cache for better UX (10 seconds)
-        current_time = time.time()
-        CACHE_DURATION_SECONDS = 5  # 10 seconds cache - good balance between performance and freshness
+        # Optional viewport filter: bbox=west,south,east,north (Leaflet toBBoxString)
+        try:
+            bbox = parse_bbox(request.args.get('bbox'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid bbox: {e}'}), 400
         
-        if not force_refresh and _vehicle_cache and (current_time - _cache_timestamp) < CACHE_DURATION_SECONDS:
-            # Return cached data with no-cache headers
-            response = jsonify(_vehicle_cache)
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            return response
+        # Optional clustering: cluster=true&zoom=<map zoom> returns per-cell
+        # aggregates instead of full vehicle records (ignored above MAX_CLUSTER_ZOOM)
+        zoom = request.args.get('zoom', type=int)
+        cluster = request.args.get('cluster', 'false').lower() == 'true'
+        if cluster and (zoom is None or zoom < 0):
+            return jsonify({'success': False, 'error': 'cluster=true requires a zoom level'}), 400
         
-        # Try to get vehicles from database with error handling
-        try:
-            # Expire all cached objects to ensure fresh data
-            db.session.expire_all()
-            
-            # OPTIMIZATION: Use a single efficient query with eager loading of drivers AND trips
-            # This is a critical performance bottleneck on Render - FIXED N+1 QUERY ISSUE
-            from sqlalchemy.orm import joinedload, subqueryload
-            from models.user import Trip
-            
-            # Get all active trips first (single query)
-            active_trip_ids = db.session.query(Trip.vehicle_id).filter(
-                Trip.status == 'active'
-            ).subquery()
-            
-            # Query vehicles with eager loading AND filter for those with active trips
-            active_vehicles = Vehicle.query.options(
-                joinedload(Vehicle.assigned_driver)
-            ).filter(
-                Vehicle.status.in_(['active', 'delayed']),
-                Vehicle.current_latitude.isnot(None),
-                Vehicle.current_longitude.isnot(None),
-                Vehicle.id.in_(db.session.query(active_trip_ids.c.vehicle_id))
-            ).all()
-            
-            # Get all active trips in one query (avoid N+1)
-            vehicle_ids = [v.id for v in active_vehicles]
-            active_trips_dict = {}
-            trip_ids_list = []
-            if vehicle_ids:
-                active_trips = Trip.query.filter(
-                    Trip.vehicle_id.in_(vehicle_ids),
-                    Trip.status == 'active'
-                ).all()
-                active_trips_dict = {trip.vehicle_id: trip for trip in active_trips}
-                trip_ids_list = [trip.id for trip in active_trips]
-            
-            # CRITICAL FIX: Get ALL passenger counts in ONE query instead of N queries
-            # This was causing 20+ second delays with multiple vehicles!
-            passenger_counts_dict = {}
-            if trip_ids_list:
-                # Get all passenger events for all trips in one query
-                passenger_events = db.session.query(
-                    PassengerEvent.trip_id,
-                    func.sum(
-                        case(
-                            (PassengerEvent.event_type == 'board', PassengerEvent.count),
-                            else_=0
-                        )
-                    ).label('boards'),
-                    func.sum(
-                        case(
-                            (PassengerEvent.event_type == 'alight', PassengerEvent.count),
-                            else_=0
-                        )
-                    ).label('alights')
-                ).filter(
-                    PassengerEvent.trip_id.in_(trip_ids_list)
-                ).group_by(PassengerEvent.trip_id).all()
-                
-                # Build dictionary: trip_id -> passenger_count
-                for event in passenger_events:
-                    trip_id = event.trip_id
-                    boards = event.boards or 0
-                    alights = event.alights or 0
-                    passenger_counts_dict[trip_id] = max(0, boards - alights)
-            
-            # Format vehicle data for public consumption (no PII) - SIMPLIFIED
-            vehicles_data = []
-            for vehicle in active_vehicles:
-                # Get active trip from dictionary (no query!)
-                active_trip = active_trips_dict.get(vehicle.id)
-                
-                # Only show vehicles with active trips (departed)
-                if not active_trip:
-                    continue  # Skip vehicles without active trips
-                
-                # Calculate route distance and ETA from route_info - ALWAYS calculate, no delays!
-                route_distance_km = None
-                eta_minutes = None
-                
-                # Variables for coordinates (used for both ETA calculation and route_info)
-                dest_lat = None
-                dest_lon = None
-                
-                # Always calculate distance/ETA if we have vehicle coordinates
-                if vehicle.current_latitude and vehicle.current_longitude:
-                    try:
-                        route_info = None
-                        if vehicle.route_info:
-                            route_info = json.loads(vehicle.route_info) if isinstance(vehicle.route_info, str) else vehicle.route_info
-                        
-                        # Try to get destination coordinates from route_info
-                        
-                        # Debug: Log route_info structure
-                        if route_info:
-                            print(f"🔍 Vehicle {vehicle.id}: route_info keys={list(route_info.keys()) if isinstance(route_info, dict) else 'not dict'}")
-                        
-                        # Check for dest_coords (primary destination)
-                        if route_info and isinstance(route_info, dict):
-                            if 'dest_coords' in route_info and route_info['dest_coords']:
-                                dest_coords = route_info['dest_coords']
-                                if isinstance(dest_coords, dict):
-                                    dest_lat = float(dest_coords.get('lat')) if dest_coords.get('lat') is not None else None
-                                    dest_lon = float(dest_coords.get('lon')) if dest_coords.get('lon') is not None else None
-                                    print(f"🔍 Vehicle {vehicle.id}: dest_coords found - lat={dest_lat}, lon={dest_lon}")
-                            
-                            # Fallback: Use origin_coords if dest_coords is missing or invalid
-                            if (not dest_lat or not dest_lon) and 'origin_coords' in route_info and route_info['origin_coords']:
-                                origin_coords = route_info['origin_coords']
-                                if isinstance(origin_coords, dict):
-                                    dest_lat = float(origin_coords.get('lat')) if origin_coords.get('lat') is not None else None
-                                    dest_lon = float(origin_coords.get('lon')) if origin_coords.get('lon') is not None else None
-                                    print(f"🔍 Vehicle {vehicle.id}: Using origin_coords as destination - lat={dest_lat}, lon={dest_lon}")
-                            
-                            # Final fallback: Geocode destination string if coordinates are still missing
-                            if (not dest_lat or not dest_lon) and 'destination' in route_info:
-                                destination_name = route_info['destination']
-                                print(f"🔍 Vehicle {vehicle.id}: No coordinates found, geocoding destination: {destination_name}")
-                                try:
-                                    geocoded = geocode_place_for_eta(destination_name)
-                                    if geocoded:
-                                        dest_lat = geocoded.get('lat')
-                                        dest_lon = geocoded.get('lon')
-                                        print(f"✓ Vehicle {vehicle.id}: Geocoded destination - lat={dest_lat}, lon={dest_lon}")
-                                except Exception as geocode_error:
-                                    print(f"⚠ Vehicle {vehicle.id}: Geocoding failed: {geocode_error}")
-                        
-                        # Calculate distance if we have destination coordinates
-                        if dest_lat is not None and dest_lon is not None:
-                            route_distance_km = round(calculate_distance_km(
-                                vehicle.current_latitude, vehicle.current_longitude,
-                                dest_lat, dest_lon
-                            ), 2)
-                            
-                            # Calculate ETA based on current speed (always provide ETA, never show "Calculating")
-                            speed_kmh = vehicle.last_speed_kmh or 40  # Default 40 km/h for instant calculation
-                            if speed_kmh > 0 and route_distance_km > 0:
-                                eta_minutes = round((route_distance_km / speed_kmh) * 60)
-                            else:
-                                # Fallback: calculate with default speed if speed is 0
-                                eta_minutes = round((route_distance_km / 40) * 60)
-                            
-                            print(f"✓ Vehicle {vehicle.id}: distance={route_distance_km}km, eta={eta_minutes}min, speed={speed_kmh}km/h")
-                        else:
-                            if not vehicle.route_info:
-                                print(f"⚠ Vehicle {vehicle.id}: No route_info at all")
-                            elif not route_info:
-                                print(f"⚠ Vehicle {vehicle.id}: route_info is None or empty after parsing")
-                            else:
-                                print(f"⚠ Vehicle {vehicle.id}: route_info exists but no valid dest_coords or origin_coords found. route_info={route_info}")
-                    except Exception as e:
-                        print(f"✗ Error calculating route info for vehicle {vehicle.id}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                
-                # Get driver information (already loaded via joinedload, no extra query!)
-                driver_name = None
-                driver_image_url = None
-                driver_contact_number = None
-                if vehicle.assigned_driver:
-                    driver_name = vehicle.assigned_driver.get_full_name()
-                    driver_image_url = vehicle.assigned_driver.profile_image_url
-                    driver_contact_number = vehicle.assigned_driver.contact_number
-                    print(f"✓ Vehicle {vehicle.id}: Driver = {driver_name}")
-                else:
-                    print(f"✗ Vehicle {vehicle.id}: No assigned driver")
-                
-                # Parse route_info if it's a JSON string
-                parsed_route_info = None
-                if vehicle.route_info:
-                    try:
-                        parsed_route_info = json.loads(vehicle.route_info) if isinstance(vehicle.route_info, str) else vehicle.route_info
-                    except json.JSONDecodeError:
-                        print(f"⚠ Vehicle {vehicle.id}: Failed to parse route_info")
-                        parsed_route_info = None
-                
-                # Add geocoded coordinates to route_info if missing (for map markers)
-                # We already geocoded destination for ETA calculation, so reuse it here
-                if parsed_route_info and isinstance(parsed_route_info, dict):
-                    # If we geocoded destination during ETA calculation, add it to route_info
-                    if dest_lat is not None and dest_lon is not None:
-                        if not parsed_route_info.get('dest_coords'):
-                            parsed_route_info['dest_coords'] = {'lat': dest_lat, 'lon': dest_lon}
-                            print(f"✓ Vehicle {vehicle.id}: Added geocoded dest_coords to route_info for map markers")
-                    
-                    # Only geocode origin if dest_coords exists (means geocoding is working)
-                    # Skip if network is down to prevent 502 errors
-                    if not parsed_route_info.get('origin_coords') and 'origin' in parsed_route_info:
-                        # Only try if we successfully have dest_coords (indicates geocoding is working)
-                        if parsed_route_info.get('dest_coords'):
-                            origin_name = parsed_route_info.get('origin')
-                            if origin_name:
-                                try:
-                                    origin_geocoded = geocode_place_for_eta(origin_name)
-                                    if origin_geocoded:
-                                        parsed_route_info['origin_coords'] = origin_geocoded
-                                        print(f"✓ Vehicle {vehicle.id}: Geocoded and added origin_coords to route_info")
-                                except Exception:
-                                    # Silently skip if geocoding fails - don't block the request
-                                    pass
-                
-                current_passengers = 0
-                active_trip_id = None
-                if active_trip:
-                    active_trip_id = active_trip.id
-                    # Get passenger count from dictionary (no query!) - CRITICAL PERFORMANCE FIX
-                    current_passengers = passenger_counts_dict.get(active_trip_id, 0)
-                    print(f"📊 Vehicle {vehicle.id}: active_trip_id={active_trip_id}, current_passengers={current_passengers}")
-
-                capacity = vehicle.capacity or 15  # default capacity if not set
-                
-                # Get seat status from vehicle
-                seat_status = vehicle.get_seat_status()
-                occupied_seats = vehicle.get_occupied_seat_count()
-                
-                vehicles_data.append({
-                    'id': vehicle.id,
-                    'registration_number': vehicle.registration_number,
-                    'type': vehicle.vehicle_type,
-                    'status': vehicle.status,
-                    'trip_status': 'departed',  # Vehicle is on an active trip
-                    'occupancy_status': vehicle.occupancy_status or 'unknown',
-                    'latitude': vehicle.current_latitude,
-                    'longitude': vehicle.current_longitude,
-                    'route': vehicle.route,
-                    'route_info': parsed_route_info,  # Send parsed object instead of JSON string
-                    'last_updated': vehicle.last_updated.isoformat() if vehicle.last_updated else None,
-                    'speed_kmh': vehicle.last_speed_kmh or 60,
-                    'route_distance_km': route_distance_km,
-                    'eta_minutes': eta_minutes,
-                    'driver_name': driver_name,
-                    'driver_image_url': driver_image_url,
-                    'driver_contact_number': driver_contact_number,
-                    'capacity': capacity,
-                    'current_passengers': current_passengers,
-                    'available_seats': max(capacity - current_passengers, 0),
-                    'active_trip_id': active_trip_id,
-                    'seat_status': seat_status,
-                    'occupied_seats': occupied_seats
+        # Manual refresh only nudges the refresher; it never blocks this request.
+        # However many clients ask, that's at most one extra rebuild per interval.
+        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
+        if force_refresh and rate_limit.force_refresh_gate.ready():
+            _vehicle_feed.request_refresh()
+        
+        snapshot = _vehicle_feed.current()
+        if snapshot is None:
+            # Cold start - nothing built yet, so build once (concurrent callers share it)
+            try:
+                snapshot = _vehicle_feed.refresh_now()
+            except Exception as db_error:
+                # No snapshot available, return empty result
+                print(f"Database error in /vehicles/active: {db_error}")
+                return jsonify({
+                    'success': True,
+                    'vehicles': [],
+                    'count': 0,
+                    'message': 'No vehicles available at the moment'
                 })
-            
-            # Cache the result
-            result = {
-                'success': True,
-                'vehicles': vehicles_data,
-                'count': len(vehicles_data)
-            }
-            _vehicle_cache = result
-            _cache_timestamp = current_time
-            
-            # Return with cache-busting headers to prevent browser caching
-            response = jsonify(result)
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            return response
-            
-        except Exception as db_error:
-            # If database fails but we have a cache (even if expired), use it as fallback
-            if _vehicle_cache:
-                print(f"Database error in /vehicles/active, using expired cache: {db_error}")
-                return jsonify(_vehicle_cache)
-            
-            # No cache available, return empty result
-            print(f"Database error in /vehicles/active: {db_error}")
-            return jsonify({
-                'success': True,
-                'vehicles': [],
-                'count': 0,
-                'message': 'No vehicles available at the moment'
-            })
+        
+        if cluster and zoom <= MAX_CLUSTER_ZOOM:
+            return _cluster_response(zoom, bbox)
+        
+        if bbox is not None:
+            return _viewport_response(snapshot, bbox)
+        
+        return snapshot_response(snapshot)
         
     except Exception as e:
         # Ultimate fallback - return empty result
@@ -363,6 +137,481 @@ def get_active_vehicles():
             'message': 'Service temporarily unavailable'
         })
 
+def _build_active_vehicles_payload():
+    """Query the database and build the public vehicle feed payload."""
+    # Expire all cached objects to ensure fresh data
+    db.session.expire_all()
+
+    # OPTIMIZATION: Use a single efficient query with eager loading of drivers AND trips
+    # This is a critical performance bottleneck on Render - FIXED N+1 QUERY ISSUE
+    from sqlalchemy.orm import joinedload, subqueryload
+    from models.user import Trip
+
+    # Get all active trips first (single query)
+    active_trip_ids = db.session.query(Trip.vehicle_id).filter(
+        Trip.status == 'active'
+    ).subquery()
+
+    # Query vehicles with eager loading AND filter for those with active trips
+    active_vehicles = Vehicle.query.options(
+        joinedload(Vehicle.assigned_driver)
+    ).filter(
+        Vehicle.status.in_(['active', 'delayed']),
+        Vehicle.current_latitude.isnot(None),
+        Vehicle.current_longitude.isnot(None),
+        Vehicle.id.in_(db.session.query(active_trip_ids.c.vehicle_id))
+    ).all()
+
+    # Get all active trips in one query (avoid N+1)
+    vehicle_ids = [v.id for v in active_vehicles]
+    active_trips_dict = {}
+    trip_ids_list = []
+    if vehicle_ids:
+        active_trips = Trip.query.filter(
+            Trip.vehicle_id.in_(vehicle_ids),
+            Trip.status == 'active'
+        ).all()
+        active_trips_dict = {trip.vehicle_id: trip for trip in active_trips}
+        trip_ids_list = [trip.id for trip in active_trips]
+
+    # CRITICAL FIX: Get ALL passenger counts in ONE query instead of N queries
+    # This was causing 20+ second delays with multiple vehicles!
+    passenger_counts_dict = {}
+    if trip_ids_list:
+        # Get all passenger events for all trips in one query
+        passenger_events = db.session.query(
+            PassengerEvent.trip_id,
+            func.sum(
+                case(
+                    (PassengerEvent.event_type == 'board', PassengerEvent.count),
+                    else_=0
+                )
+            ).label('boards'),
+            func.sum(
+                case(
+                    (PassengerEvent.event_type == 'alight', PassengerEvent.count),
+                    else_=0
+                )
+            ).label('alights')
+        ).filter(
+            PassengerEvent.trip_id.in_(trip_ids_list)
+        ).group_by(PassengerEvent.trip_id).all()
+
+        # Build dictionary: trip_id -> passenger_count
+        for event in passenger_events:
+            trip_id = event.trip_id
+            boards = event.boards or 0
+            alights = event.alights or 0
+            passenger_counts_dict[trip_id] = max(0, boards - alights)
+
+    # Format vehicle data for public consumption (no PII) - SIMPLIFIED
+    liveness.start(current_app._get_current_object())
+    vehicles_data = []
+    for vehicle in active_vehicles:
+        # Vehicles that stopped reporting long ago are hidden, stale ones are flagged
+        vehicle_liveness = liveness.tracker.state(vehicle.id) or liveness.LIVE
+        if vehicle_liveness == liveness.OFFLINE:
+            continue
+        
+        # Get active trip from dictionary (no query!)
+        active_trip = active_trips_dict.get(vehicle.id)
+
+        # Only show vehicles with active trips (departed)
+        if not active_trip:
+            continue  # Skip vehicles without active trips
+
+        # Calculate route distance and ETA from route_info - ALWAYS calculate, no delays!
+        route_distance_km = None
+        eta_minutes = None
+
+        # Variables for coordinates (used for both ETA calculation and route_info)
+        dest_lat = None
+        dest_lon = None
+
+        # Always calculate distance/ETA if we have vehicle coordinates
+        if vehicle.current_latitude and vehicle.current_longitude:
+            try:
+                route_info = None
+                if vehicle.route_info:
+                    route_info = json.loads(vehicle.route_info) if isinstance(vehicle.route_info, str) else vehicle.route_info
+
+                # Try to get destination coordinates from route_info
+
+                # Debug: Log route_info structure
+                if route_info:
+                    print(f"🔍 Vehicle {vehicle.id}: route_info keys={list(route_info.keys()) if isinstance(route_info, dict) else 'not dict'}")
+
+                # Check for dest_coords (primary destination)
+                if route_info and isinstance(route_info, dict):
+                    if 'dest_coords' in route_info and route_info['dest_coords']:
+                        dest_coords = route_info['dest_coords']
+                        if isinstance(dest_coords, dict):
+                            dest_lat = float(dest_coords.get('lat')) if dest_coords.get('lat') is not None else None
+                            dest_lon = float(dest_coords.get('lon')) if dest_coords.get('lon') is not None else None
+                            print(f"🔍 Vehicle {vehicle.id}: dest_coords found - lat={dest_lat}, lon={dest_lon}")
+
+                    # Fallback: Use origin_coords if dest_coords is missing or invalid
+                    if (not dest_lat or not dest_lon) and 'origin_coords' in route_info and route_info['origin_coords']:
+                        origin_coords = route_info['origin_coords']
+                        if isinstance(origin_coords, dict):
+                            dest_lat = float(origin_coords.get('lat')) if origin_coords.get('lat') is not None else None
+                            dest_lon = float(origin_coords.get('lon')) if origin_coords.get('lon') is not None else None
+                            print(f"🔍 Vehicle {vehicle.id}: Using origin_coords as destination - lat={dest_lat}, lon={dest_lon}")
+
+                    # Final fallback: Geocode destination string if coordinates are still missing
+                    if (not dest_lat or not dest_lon) and 'destination' in route_info:
+                        destination_name = route_info['destination']
+                        print(f"🔍 Vehicle {vehicle.id}: No coordinates found, geocoding destination: {destination_name}")
+                        try:
+                            geocoded = geocode_place_for_eta(destination_name)
+                            if geocoded:
+                                dest_lat = geocoded.get('lat')
+                                dest_lon = geocoded.get('lon')
+                                print(f"✓ Vehicle {vehicle.id}: Geocoded destination - lat={dest_lat}, lon={dest_lon}")
+                        except Exception as geocode_error:
+                            print(f"⚠ Vehicle {vehicle.id}: Geocoding failed: {geocode_error}")
+
+                # Calculate distance if we have destination coordinates
+                if dest_lat is not None and dest_lon is not None:
+                    route_distance_km = round(calculate_distance_km(
+                        vehicle.current_latitude, vehicle.current_longitude,
+                        dest_lat, dest_lon
+                    ), 2)
+
+                    # Calculate ETA based on current speed (always provide ETA, never show "Calculating")
+                    speed_kmh = vehicle.last_speed_kmh or 40  # Default 40 km/h for instant calculation
+                    if speed_kmh > 0 and route_distance_km > 0:
+                        eta_minutes = round((route_distance_km / speed_kmh) * 60)
+                    else:
+                        # Fallback: calculate with default speed if speed is 0
+                        eta_minutes = round((route_distance_km / 40) * 60)
+
+                    print(f"✓ Vehicle {vehicle.id}: distance={route_distance_km}km, eta={eta_minutes}min, speed={speed_kmh}km/h")
+                else:
+                    if not vehicle.route_info:
+                        print(f"⚠ Vehicle {vehicle.id}: No route_info at all")
+                    elif not route_info:
+                        print(f"⚠ Vehicle {vehicle.id}: route_info is None or empty after parsing")
+                    else:
+                        print(f"⚠ Vehicle {vehicle.id}: route_info exists but no valid dest_coords or origin_coords found. route_info={route_info}")
+            except Exception as e:
+                print(f"✗ Error calculating route info for vehicle {vehicle.id}: {e}")
+                import traceback
+                traceback.print_exc()
+
+        # Get driver information (already loaded via joinedload, no extra query!)
+        driver_name = None
+        driver_image_url = None
+        driver_contact_number = None
+        if vehicle.assigned_driver:
+            driver_name = vehicle.assigned_driver.get_full_name()
+            driver_image_url = vehicle.assigned_driver.profile_image_url
+            driver_contact_number = vehicle.assigned_driver.contact_number
+            print(f"✓ Vehicle {vehicle.id}: Driver = {driver_name}")
+        else:
+            print(f"✗ Vehicle {vehicle.id}: No assigned driver")
+
+        # Parse route_info if it's a JSON string
+        parsed_route_info = None
+        if vehicle.route_info:
+            try:
+                parsed_route_info = json.loads(vehicle.route_info) if isinstance(vehicle.route_info, str) else vehicle.route_info
+            except json.JSONDecodeError:
+                print(f"⚠ Vehicle {vehicle.id}: Failed to parse route_info")
+                parsed_route_info = None
+
+        # Add geocoded coordinates to route_info if missing (for map markers)
+        # We already geocoded destination for ETA calculation, so reuse it here
+        if parsed_route_info and isinstance(parsed_route_info, dict):
+            # If we geocoded destination during ETA calculation, add it to route_info
+            if dest_lat is not None and dest_lon is not None:
+                if not parsed_route_info.get('dest_coords'):
+                    parsed_route_info['dest_coords'] = {'lat': dest_lat, 'lon': dest_lon}
+                    print(f"✓ Vehicle {vehicle.id}: Added geocoded dest_coords to route_info for map markers")
+
+            # Only geocode origin if dest_coords exists (means geocoding is working)
+            # Skip if network is down to prevent 502 errors
+            if not parsed_route_info.get('origin_coords') and 'origin' in parsed_route_info:
+                # Only try if we successfully have dest_coords (indicates geocoding is working)
+                if parsed_route_info.get('dest_coords'):
+                    origin_name = parsed_route_info.get('origin')
+                    if origin_name:
+                        try:
+                            origin_geocoded = geocode_place_for_eta(origin_name)
+                            if origin_geocoded:
+                                parsed_route_info['origin_coords'] = origin_geocoded
+                                print(f"✓ Vehicle {vehicle.id}: Geocoded and added origin_coords to route_info")
+                        except Exception:
+                            # Silently skip if geocoding fails - don't block the request
+                            pass
+
+        current_passengers = 0
+        active_trip_id = None
+        if active_trip:
+            active_trip_id = active_trip.id
+            # Get passenger count from dictionary (no query!) - CRITICAL PERFORMANCE FIX
+            current_passengers = passenger_counts_dict.get(active_trip_id, 0)
+            print(f"📊 Vehicle {vehicle.id}: active_trip_id={active_trip_id}, current_passengers={current_passengers}")
+
+        capacity = vehicle.capacity or 15  # default capacity if not set
+
+        # Get seat status from vehicle
+        seat_status = vehicle.get_seat_status()
+        occupied_seats = vehicle.get_occupied_seat_count()
+
+        vehicles_data.append({
+            'id': vehicle.id,
+            'registration_number': vehicle.registration_number,
+            'type': vehicle.vehicle_type,
+            'status': vehicle.status,
+            'trip_status': 'departed',  # Vehicle is on an active trip
+            'occupancy_status': vehicle.occupancy_status or 'unknown',
+            'latitude': vehicle.current_latitude,
+            'longitude': vehicle.current_longitude,
+            'route': vehicle.route,
+            'route_info': parsed_route_info,  # Send parsed object instead of JSON string
+            'last_updated': vehicle.last_updated.isoformat() if vehicle.last_updated else None,
+            'liveness': vehicle_liveness,
+            'speed_kmh': vehicle.last_speed_kmh or 60,
+            'route_distance_km': route_distance_km,
+            'eta_minutes': eta_minutes,
+            'driver_name': driver_name,
+            'driver_image_url': driver_image_url,
+            'driver_contact_number': driver_contact_number,
+            'capacity': capacity,
+            'current_passengers': current_passengers,
+            'available_seats': max(capacity - current_passengers, 0),
+            'active_trip_id': active_trip_id,
+            'seat_status': seat_status,
+            'occupied_seats': occupied_seats
+        })
+    
+    return {
+        'success': True,
+        'vehicles': vehicles_data,
+        'count': len(vehicles_data)
+    }
+
+
+# Every stream, whole-feed or per-route, takes one of these slots
+_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Live change feed for /vehicles/stream, fed by the refresher below
+vehicle_stream = BroadcastHub(name='public-vehicle-stream', max_subscribers=SSE_MAX_STREAMS,
+                              slots=_stream_slots)
+
+# Per-route change feeds for /vehicles/stream?route=..., created on first use
+_route_streams = {}  # route key -> BroadcastHub
+_route_streams_lock = threading.Lock()
+
+
+def _route_stream(key):
+    """Return the hub for a route, creating it if needed, or None if there are too many."""
+    with _route_streams_lock:
+        hub = _route_streams.get(key)
+        if hub is None:
+            if len(_route_streams) >= MAX_ROUTE_STREAMS:
+                # Forget routes nobody is listening to before giving up
+                for idle in [k for k, h in _route_streams.items() if h.subscriber_count() == 0]:
+                    del _route_streams[idle]
+                if len(_route_streams) >= MAX_ROUTE_STREAMS:
+                    return None
+            hub = _route_streams[key] = BroadcastHub(name=f'public-route-stream:{key}',
+                                                     max_subscribers=SSE_MAX_STREAMS,
+                                                     slots=_stream_slots)
+        return hub
+
+
+# Spatial index over the current snapshot's vehicles, for bbox queries
+_vehicle_index = SpatialIndex()
+
+# Per-zoom marker clusters, seeded from the index and updated from snapshot diffs
+_vehicle_clusters = ClusterIndex(_vehicle_index.items)
+
+# Encoded whole-map cluster payloads: zoom -> (cluster version, Snapshot)
+_cluster_snapshots = {}
+
+
+def _index_vehicle(vehicle):
+    if vehicle['latitude'] is not None and vehicle['longitude'] is not None:
+        _vehicle_index.upsert(vehicle['id'], vehicle['latitude'], vehicle['longitude'], vehicle)
+    else:
+        _vehicle_index.remove(vehicle['id'])
+
+
+def _publish_vehicle_changes(previous, snapshot):
+    """Apply the vehicles that changed between two feed snapshots to the
+    spatial index and publish them to stream subscribers."""
+    if previous is None:
+        # New subscribers always start from the full snapshot
+        _vehicle_index.clear()
+        for vehicle in snapshot.payload['vehicles']:
+            _index_vehicle(vehicle)
+        _vehicle_clusters.reset()
+        return
+    
+    old_vehicles = {v['id']: v for v in previous.payload['vehicles']}
+    changed = [v for v in snapshot.payload['vehicles'] if old_vehicles.get(v['id']) != v]
+    current_ids = {v['id'] for v in snapshot.payload['vehicles']}
+    removed = [vehicle_id for vehicle_id in old_vehicles if vehicle_id not in current_ids]
+    
+    for vehicle in changed:
+        _index_vehicle(vehicle)
+    for vehicle_id in removed:
+        _vehicle_index.remove(vehicle_id)
+    _vehicle_clusters.apply(changed, removed)
+    
+    if changed or removed:
+        vehicle_stream.publish('vehicles', {
+            'changed': changed,
+            'removed': removed,
+            'count': snapshot.payload['count']
+        })
+        if _route_streams:
+            _publish_route_changes(old_vehicles, changed, removed)
+
+
+def _publish_route_changes(old_vehicles, changed, removed):
+    """Publish changes to each route's stream; a vehicle that switched
+    routes is sent as removed on its old route."""
+    per_route = {}
+    
+    def changes_for(key):
+        return per_route.setdefault(key, {'changed': [], 'removed': []})
+    
+    for vehicle in changed:
+        key = route_key(vehicle.get('route'))
+        old = old_vehicles.get(vehicle['id'])
+        old_key = route_key(old.get('route')) if old else None
+        if key:
+            changes_for(key)['changed'].append(vehicle)
+        if old_key and old_key != key:
+            changes_for(old_key)['removed'].append(vehicle['id'])
+    for vehicle_id in removed:
+        key = route_key(old_vehicles[vehicle_id].get('route'))
+        if key:
+            changes_for(key)['removed'].append(vehicle_id)
+    
+    for key, changes in per_route.items():
+        hub = _route_streams.get(key)
+        if hub is not None:
+            hub.publish('vehicles', {**changes, 'route': key})
+
+
+# Background refresher for the public feed; request handlers only read its snapshots
+_vehicle_feed = SnapshotRefresher(_build_active_vehicles_payload, interval=CACHE_DURATION,
+                                  name='public-vehicle-feed', on_change=_publish_vehicle_changes)
+
+
+def _viewport_response(snapshot, bbox):
+    """Serve only the snapshot's vehicles inside bbox, with an ETag tied to the snapshot."""
+    etag = f"{snapshot.etag}-{hashlib.sha1(repr(bbox).encode('utf-8')).hexdigest()[:12]}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        vehicles = _vehicle_index.within(bbox)
+        response = jsonify({
+            'success': True,
+            'vehicles': vehicles,
+            'count': len(vehicles),
+            # Echoed in the request's west,south,east,north order
+            'bbox': [bbox[1], bbox[0], bbox[3], bbox[2]]
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache, must-revalidate, max-age=0'
+    return response
+
+
+def _cluster_response(zoom, bbox):
+    """Serve marker clusters for a zoom level, optionally limited to bbox."""
+    if bbox is not None:
+        clusters, _ = _vehicle_clusters.clusters(zoom, bbox)
+        return jsonify(_cluster_payload(zoom, clusters))
+    
+    # Whole-map clusters are encoded once per zoom and change
+    version = _vehicle_clusters.version(zoom)
+    cached = _cluster_snapshots.get(zoom)
+    if cached is None or version is None or cached[0] != version:
+        clusters, version = _vehicle_clusters.clusters(zoom)
+        cached = _cluster_snapshots[zoom] = (version, build_snapshot(_cluster_payload(zoom, clusters)))
+    return snapshot_response(cached[1])
+
+
+def _cluster_payload(zoom, clusters):
+    return {
+        'success': True,
+        'mode': 'clusters',
+        'zoom': zoom,
+        'clusters': clusters,
+        'count': sum(c['count'] for c in clusters)
+    }
+
+
+@public_bp.route('/vehicles/stream')
+def stream_active_vehicles():
+    """Server-Sent Events feed of the public vehicle list.
+    
+    New connections get a 'snapshot' event with the full feed, then 'vehicles'
+    events carrying only changed and removed vehicles. Reconnects that send
+    Last-Event-ID resume from the hub's history instead of a new snapshot.
+    With ?route=<name> both are limited to vehicles on that route.
+    """
+    _vehicle_feed.start(current_app._get_current_object())
+    
+    key = route_key(request.args.get('route'))
+    hub = _route_stream(key) if key else vehicle_stream
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = hub.subscribe(last_event_id) if hub is not None else None
+    if subscription is None:
+        # Every stream slot is taken; the client falls back to polling
+        response = jsonify({'success': False, 'error': 'Live feed is busy, use /public/vehicles/active'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    initial = []
+    if not subscription.resumed:
+        snapshot = _vehicle_feed.current()
+        if snapshot is None:
+            try:
+                snapshot = _vehicle_feed.refresh_now()
+            except Exception as e:
+                hub.unsubscribe(subscription)
+                print(f"Database error in /vehicles/stream: {e}")
+                return jsonify({'success': False, 'error': 'Service temporarily unavailable'}), 503
+        if key:
+            vehicles = [v for v in snapshot.payload['vehicles'] if route_key(v.get('route')) == key]
+            initial.append(encode_event('snapshot', data={
+                'success': True,
+                'vehicles': vehicles,
+                'count': len(vehicles),
+                'route': key
+            }, event_id=subscription.start_id))
+        else:
+            initial.append(encode_event('snapshot', body=snapshot.body, event_id=subscription.start_id))
+    
+    response = Response(
+        subscription.stream(initial, heartbeat=SSE_HEARTBEAT_SECONDS, max_duration=SSE_STREAM_SECONDS),
+        mimetype='text/event-stream'
+    )
+    # The generator's own cleanup doesn't run if the client leaves before the first byte
+    response.call_on_close(lambda: hub.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+    return response
+
+@public_bp.route('/stops')
+def get_stops():
+    """Stops commuters can follow (socket subscribe_stops), optionally for one route."""
+    from models.stop import Stop
+    query = Stop.query
+    route = request.args.get('route')
+    if route:
+        query = query.filter((Stop.route == route) | Stop.route.is_(None))
+    stops = query.order_by(Stop.name).all()
+    return jsonify({'success': True, 'stops': [stop.to_dict() for stop in stops], 'count': len(stops)})
+
 @public_bp.route('/vehicle/<int:vehicle_id>/eta', methods=['GET'])
 def calculate_eta(vehicle_id):
     """Calculate ETA from vehicle to destination."""
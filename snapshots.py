@@ -0,0 +1,146 @@
+"""
+Pre-encoded response snapshots for hot polling endpoints
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+from flask import request, Response
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+# A snapshot is built once per refresh and shared by every request that
+# serves it. The payload is kept for callers that need to filter it, and
+# must be treated as read-only.
+Snapshot = namedtuple('Snapshot', ['payload', 'body', 'gzip_body', 'etag', 'built_at'])
+
+
+def build_snapshot(payload, compress=True):
+    """Encode a payload once into JSON bytes, an optional gzip body and a strong ETag."""
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+
+    gzip_body = None
+    if compress and len(body) >= GZIP_MIN_BYTES:
+        # mtime=0 keeps the compressed bytes deterministic for the same body
+        gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+
+    return Snapshot(payload, body, gzip_body, etag, time.time())
+
+
+def _accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+def snapshot_response(snapshot, cache_control='no-cache, must-revalidate, max-age=0'):
+    """Serve a snapshot, answering 304 Not Modified when the client already has it.
+
+    The gzip representation gets its own ETag so the identity and compressed
+    bodies never share a strong validator.
+    """
+    use_gzip = snapshot.gzip_body is not None and _accepts_gzip()
+    etag = f"{snapshot.etag}-gz" if use_gzip else snapshot.etag
+
+    if request.if_none_match.contains_weak(snapshot.etag) or \
+            request.if_none_match.contains_weak(f"{snapshot.etag}-gz"):
+        response = Response(status=304)
+    else:
+        response = Response(
+            snapshot.gzip_body if use_gzip else snapshot.body,
+            mimetype='application/json'
+        )
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+class SnapshotRefresher:
+    """Rebuilds a snapshot in the background so request handlers never wait on it.
+
+    Rebuilds run on a fixed interval, or sooner when a write path calls
+    request_refresh(). Only one build runs at a time; notifications that arrive
+    while a build is running are coalesced into the next one.
+
+    on_change(previous, snapshot) is called after each build whose content
+    differs from the previous snapshot (previous is None for the first build),
+    before the new snapshot is returned by current().
+    """
+
+    def __init__(self, build, interval=5.0, min_interval=0.5, name='snapshot-refresher', on_change=None):
+        self._build = build
+        self._on_change = on_change
+        self.interval = interval
+        self.min_interval = min_interval
+        self.name = name
+        self._snapshot = None
+        self._build_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._app = None
+        self.builds = 0
+        self.failures = 0
+
+    def current(self):
+        """Return the latest completed snapshot, or None before the first build."""
+        return self._snapshot
+
+    def start(self, app):
+        """Start the background thread once; later calls are no-ops."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def request_refresh(self):
+        """Ask the background thread to rebuild soon (non-blocking)."""
+        self._wake.set()
+
+    def refresh_now(self):
+        """Rebuild synchronously. Concurrent callers share a single build."""
+        requested_at = time.time()
+        with self._build_lock:
+            # Someone else finished a build while we were waiting for the lock
+            if self._snapshot is not None and self._snapshot.built_at >= requested_at:
+                return self._snapshot
+            previous = self._snapshot
+            snapshot = build_snapshot(self._build())
+            self.builds += 1
+            try:
+                if self._on_change is not None and (previous is None or previous.etag != snapshot.etag):
+                    self._on_change(previous, snapshot)
+            finally:
+                # Published last, so state derived in on_change is never older than current()
+                self._snapshot = snapshot
+            return snapshot
+
+    def _run(self):
+        last_build = 0
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+            # Coalesce bursts of change notifications into one rebuild
+            delay = self.min_interval - (time.time() - last_build)
+            if delay > 0:
+                time.sleep(delay)
+            last_build = time.time()
+
+            with self._app.app_context():
+                try:
+                    self.refresh_now()
+                except Exception as e:
+                    self.failures += 1
+                    self._app.logger.error(f"{self.name}: snapshot rebuild failed, keeping previous snapshot: {e}")
@@ -0,0 +1,165 @@
+"""
+Grid spatial index and map tile helpers for viewport-scoped vehicle feeds
+"""
+import math
+import threading
+
+# Grid cell size in degrees (~5.5 km at the equator)
+DEFAULT_CELL_DEGREES = 0.05
+
+# Tile zoom levels used for Socket.IO viewport rooms, finest first. A client
+# joins rooms at the finest level whose tiles cover its viewport within
+# MAX_VIEWPORT_TILES rooms; larger viewports fall back to the global room.
+ROOM_TILE_ZOOMS = (12, 10, 8)
+MAX_VIEWPORT_TILES = 16
+
+
+def parse_bbox(value):
+    """Parse a bounding box into (south, west, north, east).
+
+    Accepts Leaflet's toBBoxString() format 'west,south,east,north' or a
+    list of the same four numbers. Returns None for an empty value and
+    raises ValueError for a malformed one.
+    """
+    if value is None or value == '':
+        return None
+    parts = value.split(',') if isinstance(value, str) else list(value)
+    if len(parts) != 4:
+        raise ValueError('bbox must be west,south,east,north')
+    west, south, east, north = (float(part) for part in parts)
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError('bbox is out of range')
+    return (south, west, north, east)
+
+
+def in_bbox(lat, lon, bbox):
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lon <= east
+
+
+def tile_xy(lat, lon, zoom):
+    """Web Mercator (slippy map) tile containing a point."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bbox(bbox, zoom, limit=MAX_VIEWPORT_TILES):
+    """Tiles covering a bbox at a zoom level, or None if there are more than limit."""
+    south, west, north, east = bbox
+    x0, y0 = tile_xy(north, west, zoom)
+    x1, y1 = tile_xy(south, east, zoom)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > limit:
+        return None
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def tile_room(zoom, x, y):
+    return f"tile_{zoom}_{x}_{y}"
+
+
+def viewport_rooms(bbox):
+    """Tile rooms a client viewing bbox should join, or None if the viewport is too large."""
+    for zoom in ROOM_TILE_ZOOMS:
+        tiles = tiles_for_bbox(bbox, zoom)
+        if tiles is not None:
+            return {tile_room(zoom, x, y) for x, y in tiles}
+    return None
+
+
+def point_rooms(lat, lon):
+    """Tile rooms, one per room zoom level, whose clients can see a point."""
+    return [tile_room(zoom, *tile_xy(lat, lon, zoom)) for zoom in ROOM_TILE_ZOOMS]
+
+
+class SpatialIndex:
+    """Points bucketed into a lat/lon grid for fast bounding-box lookups.
+
+    Each entry is a key (e.g. vehicle id) with a position and an optional
+    item returned by queries. Thread-safe.
+    """
+
+    def __init__(self, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._entries = {}  # key -> (lat, lon, cell, item)
+        self._cells = {}    # cell -> set of keys
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees)))
+
+    def upsert(self, key, lat, lon, item=None):
+        with self._lock:
+            cell = self._cell(lat, lon)
+            existing = self._entries.get(key)
+            if existing is not None and existing[2] != cell:
+                self._discard(key, existing[2])
+            self._entries[key] = (lat, lon, cell, item if item is not None else key)
+            self._cells.setdefault(cell, set()).add(key)
+            self.version += 1
+
+    def remove(self, key):
+        with self._lock:
+            existing = self._entries.pop(key, None)
+            if existing is not None:
+                self._discard(key, existing[2])
+                self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cells.clear()
+            self.version += 1
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry[3] if entry is not None else None
+
+    def within(self, bbox):
+        """Return the items of every entry inside bbox."""
+        south, west, north, east = bbox
+        with self._lock:
+            row0, col0 = self._cell(south, west)
+            row1, col1 = self._cell(north, east)
+            span = (row1 - row0 + 1) * (col1 - col0 + 1)
+            if span <= len(self._cells):
+                cells = (self._cells.get((row, col)) for row in range(row0, row1 + 1)
+                         for col in range(col0, col1 + 1))
+            else:
+                # Viewport spans more cells than are occupied; walk the occupied ones
+                cells = (keys for (row, col), keys in self._cells.items()
+                         if row0 <= row <= row1 and col0 <= col <= col1)
+
+            results = []
+            for keys in cells:
+                if not keys:
+                    continue
+                for key in keys:
+                    lat, lon, _, item = self._entries[key]
+                    if south <= lat <= north and west <= lon <= east:
+                        results.append(item)
+            return results
+
+    def items(self):
+        with self._lock:
+            return [entry[3] for entry in self._entries.values()]
+
+    def positions(self):
+        """Return (key, lat, lon, item) for every entry."""
+        with self._lock:
+            return [(key, lat, lon, item) for key, (lat, lon, _, item) in self._entries.items()]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key, cell):
+        # Caller must hold the lock
+        keys = self._cells.get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
@@ -116,6 +116,21 @@ async function handlePassengerAdjustment(delta) {
     }
 }
 
+// Show trip counters from a trip-stats (or bootstrap) response
+function applyTripStats(stats) {
+    const todayTripsEl = document.getElementById('todayTripsCount');
+    const totalTripsEl = document.getElementById('totalTripsCount');
+    
+    if (todayTripsEl) {
+        todayTripsEl.textContent = stats.today_trips || 0;
+    }
+    if (totalTripsEl) {
+        totalTripsEl.textContent = stats.total_trips || 0;
+    }
+    
+    console.log('✅ Trip counters updated:', stats);
+}
+
 // Update trip counters
 async function updateTripCounters() {
     try {
@@ -123,17 +138,7 @@ async function updateTripCounters() {
         if (response.ok) {
             const data = await response.json();
             if (data.success) {
-                const todayTripsEl = document.getElementById('todayTripsCount');
-                const totalTripsEl = document.getElementById('totalTripsCount');
-                
-                if (todayTripsEl) {
-                    todayTripsEl.textContent = data.stats.today_trips || 0;
-                }
-                if (totalTripsEl) {
-                    totalTripsEl.textContent = data.stats.total_trips || 0;
-                }
-                
-                console.log('✅ Trip counters updated:', data.stats);
+                applyTripStats(data.stats);
             }
         }
     } catch (error) {
@@ -184,11 +189,12 @@ function openConfirmationDialog(message, onConfirm) {
      return;
  }
  
- // Load driver vehicle assignment from API
+ // Load driver vehicle assignment, trip counters, seats and current trip in one request
  async function loadDriverVehicleAssignment() {
      try {
          console.log('🚗 Loading driver vehicle assignment...');
-         const response = await fetch('/driver/vehicle-assignment');
+         // The browser revalidates with the ETag, so an unchanged reload is a 304
+         const response = await fetch('/driver/bootstrap');
          
          if (!response.ok) {
              throw new Error(`HTTP ${response.status}: ${response.statusText}`);
@@ -199,18 +205,20 @@ function openConfirmationDialog(message, onConfirm) {
          if (data.success) {
              vehiclesData = data.vehicles;
              console.log('✅ Vehicle assignment loaded:', vehiclesData);
+             applyTripStats(data.stats);
              
              if (vehiclesData.length > 0) {
                  // Auto-select first vehicle
                  currentVehicleId = vehiclesData[0].id;
                  console.log('🚗 Auto-selecting first vehicle:', currentVehicleId);
-                updateVehicleInfo(currentVehicleId);
-                updateRouteInfo(currentVehicleId);
+                // The bootstrap response already has the trip and seats; don't fetch them again
+                updateVehicleInfo(currentVehicleId, false);
                 updatePassengerCapacityDisplay(vehiclesData[0]);
-                setPassengerControlsEnabled(false);
-                setOccupancyControlsEnabled(false);
-                updateTripSummary();
-                loadSeatStatus();
+                applyTripSummary(vehiclesData[0].current_trip);
+                if (vehiclesData[0].current_trip) {
+                    updateTripPhaseDisplay(vehiclesData[0].current_trip.status);
+                }
+                applySeatStatus(vehiclesData[0].seat_status);
                  enableVehicleControls(); // Enable buttons when vehicle is selected
              } else {
                  console.log('⚠️ No vehicles assigned to driver');
@@ -287,7 +295,7 @@ function openConfirmationDialog(message, onConfirm) {
  }
  
  // Update vehicle information display
- function updateVehicleInfo(vehicleId) {
+ function updateVehicleInfo(vehicleId, refreshTrip = true) {
      const vehicle = vehiclesData.find(v => v.id == vehicleId);
      if (vehicle) {
          // Log vehicle details to console for debugging
@@ -301,12 +309,12 @@ function openConfirmationDialog(message, onConfirm) {
          });
          
          // Update route info which is still displayed in the UI
-         updateRouteInfo(vehicleId);
+         updateRouteInfo(vehicleId, refreshTrip);
      }
  }
  
-   // Update route information display
-  function updateRouteInfo(vehicleId) {
+   // Update route information display (refreshTrip: also re-fetch the current trip)
+  function updateRouteInfo(vehicleId, refreshTrip = true) {
       const vehicle = vehiclesData.find(v => v.id == vehicleId);
       if (vehicle) {
         updatePassengerCapacityDisplay(vehicle);
@@ -333,7 +341,7 @@ function openConfirmationDialog(message, onConfirm) {
               enableVehicleControls();
               
               // Check if there's an active trip for this vehicle
-              checkCurrentTripStatus(vehicleId);
+              if (refreshTrip) checkCurrentTripStatus(vehicleId);
           } else {
               document.getElementById('routeDisplay').textContent = 'No route set';
               document.getElementById('routeStatus').textContent = 'No Route';
@@ -345,7 +353,7 @@ function openConfirmationDialog(message, onConfirm) {
               const routePhase = document.getElementById('routePhase');
               if (routePhase) routePhase.textContent = '';
           }
-        updateTripSummary();
+        if (refreshTrip) updateTripSummary();
       }
   }
  
@@ -482,24 +490,69 @@ function updateTripPhaseDisplay(tripStatus) {
 }
 
 // Location broadcasting helpers
-async function postVehicleLocation(latitude, longitude, accuracy) {
+// Fixes are buffered (and kept in localStorage) until the server has them, so
+// fixes taken in dead zones are uploaded in one batch once the phone is back online
+const PENDING_FIXES_KEY = 'pendingLocationFixes';
+const MAX_PENDING_FIXES = 500;  // Server accepts at most 500 per batch
+let pendingFixes = loadPendingFixes();
+let fixUploadInFlight = false;
+
+function loadPendingFixes() {
+    try {
+        const saved = JSON.parse(localStorage.getItem(PENDING_FIXES_KEY) || '{}');
+        return Array.isArray(saved.fixes) ? saved : { vehicleId: null, fixes: [] };
+    } catch (_) {
+        return { vehicleId: null, fixes: [] };
+    }
+}
+
+function savePendingFixes() {
+    try { localStorage.setItem(PENDING_FIXES_KEY, JSON.stringify(pendingFixes)); } catch (_) {}
+}
+
+async function postVehicleLocation(latitude, longitude, accuracy, timestamp) {
+    if (pendingFixes.vehicleId !== currentVehicleId) {
+        pendingFixes = { vehicleId: currentVehicleId, fixes: [] };
+    }
+    // Compact fix: [device timestamp ms, lat, lon, accuracy]
+    pendingFixes.fixes.push([timestamp || Date.now(), latitude, longitude, accuracy]);
+    if (pendingFixes.fixes.length > MAX_PENDING_FIXES) {
+        pendingFixes.fixes.splice(0, pendingFixes.fixes.length - MAX_PENDING_FIXES);
+    }
+    savePendingFixes();
+    return flushPendingFixes();
+}
+
+async function flushPendingFixes() {
+    if (fixUploadInFlight || !pendingFixes.vehicleId || pendingFixes.fixes.length === 0) return null;
+    fixUploadInFlight = true;
+    const sent = pendingFixes.fixes.slice();
     try {
-        const response = await fetch(`/driver/vehicle/${currentVehicleId}/location`, {
+        const response = await fetch(`/driver/vehicle/${pendingFixes.vehicleId}/locations`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ latitude, longitude, accuracy })
+            body: JSON.stringify({ fixes: sent })
         });
+        if (response.status >= 500 || response.status === 429) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        // Delivered (or permanently refused): drop what was sent, keep fixes taken meanwhile
+        pendingFixes.fixes.splice(0, sent.length);
+        savePendingFixes();
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}`);
         }
-        const data = await response.json();
-        return data;
+        return await response.json();
     } catch (error) {
-        console.error('❌ Failed to post location:', error);
+        console.error(`❌ Failed to post location (${pendingFixes.fixes.length} fixes buffered):`, error);
         return null;
+    } finally {
+        fixUploadInFlight = false;
     }
 }
 
+window.addEventListener('online', () => { flushPendingFixes(); });
+
 function startLocationBroadcasting() {
     if (isBroadcastingLocation) return;
     if (!('geolocation' in navigator)) {
@@ -519,7 +572,7 @@ function startLocationBroadcasting() {
         async (pos) => {
             if (!currentVehicleId) return;
             const { latitude, longitude, accuracy } = pos.coords;
-            await postVehicleLocation(latitude, longitude, accuracy);
+            await postVehicleLocation(latitude, longitude, accuracy, pos.timestamp);
         },
         (err) => {
             console.error('❌ Geolocation error:', err);
@@ -861,6 +914,24 @@ async function recordPassengerEvent(eventType, countOverride = null) {
      }
  }
  
+ // Show the active trip (or none) from a current-trip (or bootstrap) response
+ function applyTripSummary(trip) {
+     if (trip) {
+         currentTripId = trip.id;
+         const summary = trip.passenger_summary || {};
+         passengerCurrentCount = summary.current_passengers || 0;
+         updatePassengerDisplay(passengerCurrentCount);
+         setPassengerControlsEnabled(true);
+         setOccupancyControlsEnabled(true);
+     } else {
+         currentTripId = null;
+         passengerCurrentCount = 0;
+         updatePassengerDisplay(0);
+         setPassengerControlsEnabled(false);
+         setOccupancyControlsEnabled(false);
+     }
+ }
+ 
  async function updateTripSummary() {
      if (!currentVehicleId) return;
      
@@ -868,19 +939,8 @@ async function recordPassengerEvent(eventType, countOverride = null) {
          const response = await fetch(`/driver/current-trip/${currentVehicleId}`);
          if (response.ok) {
              const data = await response.json();
-             if (data.success && data.trip) {
-                currentTripId = data.trip.id;
-                const summary = data.trip.passenger_summary || {};
-                passengerCurrentCount = summary.current_passengers || 0;
-                updatePassengerDisplay(passengerCurrentCount);
-                setPassengerControlsEnabled(true);
-                setOccupancyControlsEnabled(true);
-            } else {
-                currentTripId = null;
-                passengerCurrentCount = 0;
-                updatePassengerDisplay(0);
-                setPassengerControlsEnabled(false);
-                setOccupancyControlsEnabled(false);
+             if (data.success) {
+                 applyTripSummary(data.trip);
              }
          }
      } catch (error) {
@@ -891,6 +951,18 @@ async function recordPassengerEvent(eventType, countOverride = null) {
      await loadSeatStatus();
  }
  
+ // Seat mask (bit i = seat i) -> array of 15 booleans
+ function seatMaskToList(mask) {
+     return Array.from({ length: 15 }, (_, i) => Boolean((mask >> i) & 1));
+ }
+ 
+ function applySeatStatus(seats) {
+     if (seats && Array.isArray(seats)) {
+         seatStatus = seats;
+         renderSeatVisualization();
+     }
+ }
+ 
  async function loadSeatStatus() {
      if (!currentVehicleId) return;
      
@@ -899,10 +971,7 @@ async function recordPassengerEvent(eventType, countOverride = null) {
          if (response.ok) {
              const data = await response.json();
              if (data.success && data.vehicle) {
-                 if (data.vehicle.seat_status && Array.isArray(data.vehicle.seat_status)) {
-                     seatStatus = data.vehicle.seat_status;
-                     renderSeatVisualization();
-                 }
+                 applySeatStatus(data.vehicle.seat_status);
              }
          }
      } catch (error) {
@@ -995,7 +1064,8 @@ async function recordPassengerEvent(eventType, countOverride = null) {
          const data = await response.json();
          
          if (data.success) {
-             seatStatus[seatIndex] = newStatus;
+             // The server's seat map includes changes made from other taps/devices
+             seatStatus = seatMaskToList(data.seat_mask);
              renderSeatVisualization();
              showToast('Success', `Seat ${seatIndex + 1} ${newStatus ? 'occupied' : 'freed'}`, 'success');
          } else {
@@ -1169,12 +1239,9 @@ async function recordPassengerEvent(eventType, countOverride = null) {
     setPassengerControlsEnabled(false);
     setOccupancyControlsEnabled(false);
      
-                     // Load driver vehicle assignment data
+                     // Load vehicle assignment, trip counters, seats and current trip (one request)
      loadDriverVehicleAssignment();
      
-     // Load initial trip counters
-     updateTripCounters();
-     
      // Add route change confirmation button listener
       const confirmRouteChangeBtn = document.getElementById('confirmRouteChange');
       if (confirmRouteChangeBtn) {
@@ -5,11 +5,11 @@ console.log('🚨 DRIVER OCCUPANCY JS LOADED - Simple occupancy controls');
 let currentVehicleId = null;
 let vehiclesData = [];
 
-// Load driver vehicle assignment
+// Load driver vehicle assignment (with each vehicle's current trip) in one request
 async function loadDriverVehicleAssignment() {
     try {
         console.log('🚗 Loading driver vehicle assignment...');
-        const response = await fetch('/driver/vehicle-assignment');
+        const response = await fetch('/driver/bootstrap');
         
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
@@ -82,8 +82,12 @@ function updateRouteInfo(vehicleId) {
                 routeStatus.className = 'badge bg-success';
             }
             
-            // Check if there's an active trip for this vehicle
-            checkCurrentTripStatus(vehicleId);
+            // The bootstrap response carries the active trip; only fetch it otherwise
+            if ('current_trip' in vehicle) {
+                if (vehicle.current_trip) updateTripPhaseDisplay(vehicle.current_trip.status);
+            } else {
+                checkCurrentTripStatus(vehicleId);
+            }
         } else {
             if (routeDisplay) routeDisplay.textContent = 'No route set';
             if (routeStatus) {
@@ -5,6 +5,7 @@
  * - Automatic reconnection
  * - Connection status tracking
  * - Event handling for connection state changes
+ * - Optional compact MessagePack payloads (initSocketConnection({compactPayloads: true}))
  */
 
 // Configuration
@@ -18,6 +19,14 @@ let socket = null;
 // Connection status
 let connectionStatus = 'disconnected';
 
+// Compact payload description sent by the server ('payload_mode' event), or
+// null while payloads are JSON
+let payloadCodec = null;
+
+// Routes the client follows ('saved', an array, or null for none); re-sent
+// after every (re)connect since rooms are per connection
+let followedRoutes = null;
+
 // Event callbacks
 const eventCallbacks = {
     'connect': [],
@@ -27,7 +36,10 @@ const eventCallbacks = {
     'reconnect_error': [],
     'reconnect_failed': [],
     'vehicle_positions': [],
-    'vehicle_update': []
+    'vehicle_update': [],
+    'routes_subscribed': [],
+    'vehicle_route_changed': [],
+    'route_headways': []
 };
 
 /**
@@ -48,7 +60,14 @@ function initSocketConnection(options = {}) {
     };
     
     // Merge default options with provided options
-    const socketOptions = { ...defaultOptions, ...options };
+    const { compactPayloads, ...socketOptionOverrides } = options;
+    const socketOptions = { ...defaultOptions, ...socketOptionOverrides };
+    
+    // Ask for compact binary payloads; servers without msgpack answer with
+    // payload_mode 'json' and old servers ignore the request
+    if (compactPayloads) {
+        socketOptions.auth = { ...(socketOptions.auth || {}), payload_mode: 'msgpack' };
+    }
     
     // Initialize Socket.IO
     socket = io(socketOptions);
@@ -57,6 +76,9 @@ function initSocketConnection(options = {}) {
     socket.on('connect', () => {
         console.log('Socket.IO connected');
         connectionStatus = 'connected';
+        if (followedRoutes !== null) {
+            socket.emit('subscribe_routes', followedRoutes === 'saved' ? {} : { routes: followedRoutes });
+        }
         triggerCallbacks('connect');
     });
     
@@ -88,18 +110,169 @@ function initSocketConnection(options = {}) {
         triggerCallbacks('reconnect_failed');
     });
     
+    socket.on('payload_mode', (data) => {
+        payloadCodec = data && data.mode === 'msgpack' ? data : null;
+        console.log(`Socket.IO payload mode: ${payloadCodec ? 'msgpack' : 'json'}`);
+    });
+    
     // Set up event listeners for vehicle data
     socket.on('vehicle_positions', (data) => {
-        triggerCallbacks('vehicle_positions', data);
+        triggerCallbacks('vehicle_positions', decodePayload(data));
     });
     
     socket.on('vehicle_update', (data) => {
         triggerCallbacks('vehicle_update', data);
     });
     
+    // The server coalesces vehicle updates and sends them in batches
+    socket.on('vehicle_update_batch', (data) => {
+        (decodePayload(data).updates || []).forEach(update => triggerCallbacks('vehicle_update', update));
+    });
+    
+    socket.on('routes_subscribed', (data) => {
+        triggerCallbacks('routes_subscribed', data);
+    });
+    
+    socket.on('vehicle_route_changed', (data) => {
+        triggerCallbacks('vehicle_route_changed', data);
+    });
+    
+    // Followed routes also get the server's vehicle order, gaps and headways
+    socket.on('route_headways', (data) => {
+        triggerCallbacks('route_headways', data);
+    });
+    
     return socket;
 }
 
+/**
+ * Decode an event payload that may be in the compact binary form.
+ * JSON payloads are returned unchanged, so handlers can always call this.
+ *
+ * @param {Object|ArrayBuffer|Uint8Array} data - The event payload
+ * @returns {Object} - The payload in its usual JSON shape
+ */
+function decodePayload(data) {
+    if (!(data instanceof ArrayBuffer) && !ArrayBuffer.isView(data)) {
+        return data;
+    }
+    const bytes = data instanceof ArrayBuffer ? new Uint8Array(data)
+        : new Uint8Array(data.buffer, data.byteOffset, data.byteLength);
+    return expandCompact(unpackMsgpack(bytes), payloadCodec || DEFAULT_PAYLOAD_CODEC);
+}
+
+// Matches payload_codec.describe() on the server, used until payload_mode arrives
+const DEFAULT_PAYLOAD_CODEC = {
+    fields: {
+        id: 'i', vehicle_id: 'vi', latitude: 'a', longitude: 'o', status: 's',
+        occupancy_status: 'c', type: 't', route: 'r', last_updated: 'u', speed_kmh: 'k',
+        timestamp: 'ts', vehicles: 'V', updates: 'U', count: 'n', bbox: 'b'
+    },
+    coord_scale: 1000000,
+    coord_fields: ['latitude', 'longitude', 'bbox'],
+    timestamp_fields: ['last_updated', 'timestamp']
+};
+
+function expandCompact(value, codec) {
+    if (Array.isArray(value)) {
+        return value.map(item => expandCompact(item, codec));
+    }
+    if (value === null || typeof value !== 'object') {
+        return value;
+    }
+    if (!codec.names) {
+        codec.names = {};
+        Object.keys(codec.fields).forEach(name => { codec.names[codec.fields[name]] = name; });
+    }
+    const result = {};
+    Object.keys(value).forEach(code => {
+        const name = codec.names[code] || code;
+        let item = value[code];
+        if (codec.coord_fields.includes(name)) {
+            item = Array.isArray(item) ? item.map(c => c / codec.coord_scale) : item / codec.coord_scale;
+        } else if (name === 'last_updated' && typeof item === 'number') {
+            item = new Date(item * 1000).toISOString();
+        } else if (!codec.timestamp_fields.includes(name)) {
+            item = expandCompact(item, codec);
+        }
+        result[name] = item;
+    });
+    return result;
+}
+
+/**
+ * Minimal MessagePack decoder (maps, arrays, strings, numbers, booleans, nil, bin)
+ *
+ * @param {Uint8Array} bytes - Encoded data
+ * @returns {any} - Decoded value
+ */
+function unpackMsgpack(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const textDecoder = new TextDecoder();
+    let offset = 0;
+    
+    function readString(length) {
+        const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return value;
+    }
+    function readArray(length) {
+        const items = new Array(length);
+        for (let i = 0; i < length; i++) items[i] = read();
+        return items;
+    }
+    function readMap(length) {
+        const map = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            map[key] = read();
+        }
+        return map;
+    }
+    function readBin(length) {
+        const value = bytes.slice(offset, offset + length);
+        offset += length;
+        return value;
+    }
+    function read() {
+        const type = view.getUint8(offset++);
+        let value;
+        if (type <= 0x7f) return type;
+        if (type <= 0x8f) return readMap(type & 0x0f);
+        if (type <= 0x9f) return readArray(type & 0x0f);
+        if (type <= 0xbf) return readString(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: value = view.getUint8(offset); offset += 1; return readBin(value);
+            case 0xc5: value = view.getUint16(offset); offset += 2; return readBin(value);
+            case 0xc6: value = view.getUint32(offset); offset += 4; return readBin(value);
+            case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+            case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+            case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+            case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+            case 0xce: value = view.getUint32(offset); offset += 4; return value;
+            case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+            case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+            case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+            case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+            case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+            case 0xd9: value = view.getUint8(offset); offset += 1; return readString(value);
+            case 0xda: value = view.getUint16(offset); offset += 2; return readString(value);
+            case 0xdb: value = view.getUint32(offset); offset += 4; return readString(value);
+            case 0xdc: value = view.getUint16(offset); offset += 2; return readArray(value);
+            case 0xdd: value = view.getUint32(offset); offset += 4; return readArray(value);
+            case 0xde: value = view.getUint16(offset); offset += 2; return readMap(value);
+            case 0xdf: value = view.getUint32(offset); offset += 4; return readMap(value);
+            default:
+                throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+        }
+    }
+    return read();
+}
+
 /**
  * Get the current Socket.IO instance
  * 
@@ -205,9 +378,34 @@ function emit(event, data, callback) {
 
 /**
  * Request vehicle positions from the server
+ * @param {string|Array} bbox - Optional viewport as 'west,south,east,north'
+ *   (Leaflet's map.getBounds().toBBoxString()). When given, only vehicles in
+ *   the viewport are returned and later vehicle_update events are limited to it.
+ */
+function requestVehiclePositions(bbox) {
+    if (bbox) {
+        emit('request_vehicle_positions', { bbox: bbox });
+    } else {
+        emit('request_vehicle_positions');
+    }
+}
+
+/**
+ * Follow specific routes so vehicle_update events are limited to them
+ * @param {Array|null} routes - Route names; null follows the routes saved in
+ *   the commuter's notification settings, [] stops following routes.
+ *   The server answers with 'routes_subscribed' carrying current positions,
+ *   and sends 'vehicle_route_changed' when a vehicle joins or leaves a route,
+ *   and 'route_headways' (vehicle order, gaps, bunching) as vehicles move.
  */
-function requestVehiclePositions() {
-    emit('request_vehicle_positions');
+function subscribeRoutes(routes) {
+    if (routes === undefined || routes === null) {
+        followedRoutes = 'saved';
+        emit('subscribe_routes', {});
+    } else {
+        followedRoutes = routes.length ? routes : null;
+        emit('subscribe_routes', { routes: routes });
+    }
 }
 
 // Export functions
@@ -220,5 +418,7 @@ window.socketManager = {
     connect,
     disconnect,
     emit,
-    requestVehiclePositions
+    requestVehiclePositions,
+    subscribeRoutes,
+    decodePayload
 };
\ No newline at end of file
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test that list routes use batched loaders: a bounded number of queries
+however many vehicles, drivers or trips there are
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask_login import LoginManager
+from sqlalchemy import event
+
+from models import db
+from models.user import User, Trip, PassengerEvent, DriverActionLog
+from models.vehicle import Vehicle
+import batch_loader
+
+
+def make_app(path):
+    from routes.auth import auth_bp
+    from routes.commuter import commuter_bp
+    from routes.driver import driver_bp
+    from routes.operator import operator_bp
+
+    app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                      SECRET_KEY='test', TESTING=True)
+    db.init_app(app)
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.user_loader(lambda user_id: User.query.get(int(user_id)))
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(driver_bp, url_prefix='/driver')
+    app.register_blueprint(commuter_bp, url_prefix='/commuter')
+    app.register_blueprint(operator_bp, url_prefix='/operator')
+    app.add_url_rule('/', 'index', lambda: 'index')
+    return app
+
+
+def seed(app, fleet_size):
+    with app.app_context():
+        db.create_all()
+        operator = User(username='op', email='op@test', user_type='operator')
+        operator.set_password('x')
+        db.session.add(operator)
+        db.session.commit()
+        first_driver = None
+        for i in range(fleet_size):
+            driver = User(username=f'driver{i}', email=f'driver{i}@test', user_type='driver', created_by_id=operator.id)
+            driver.set_password('x')
+            db.session.add(driver)
+            db.session.flush()
+            vehicle = Vehicle(registration_number=f'V{i}', vehicle_type='jeepney', capacity=15, owner_id=operator.id,
+                              assigned_driver_id=driver.id, status='active')
+            db.session.add(vehicle)
+            db.session.flush()
+            db.session.add(DriverActionLog(driver_id=driver.id, vehicle_id=vehicle.id, action='trip_start'))
+            first_driver = first_driver or driver
+            # The first driver gets a long trip history
+            for _ in range(1 if i else fleet_size):
+                trip = Trip(vehicle_id=vehicle.id, driver_id=driver.id, route_name='A → B',
+                            start_time=datetime.utcnow() - timedelta(hours=1), end_time=datetime.utcnow(),
+                            status='completed')
+                db.session.add(trip)
+                db.session.flush()
+                db.session.add(PassengerEvent(trip_id=trip.id, event_type='board', count=3))
+        db.session.commit()
+        return operator.id, first_driver.id
+
+
+def count_queries(app, user_id, path):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    client.get(path)  # Warm up one-time loads (e.g. the dashboard aggregates)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert response.status_code == 200, response.data[:200]
+    return len(statements)
+
+
+def queries_for(fleet_size):
+    directory = tempfile.mkdtemp()
+    app = make_app(os.path.join(directory, 'fleet.db'))
+    operator_id, driver_id = seed(app, fleet_size)
+    return {
+        'dashboard': count_queries(app, operator_id, '/operator/dashboard'),
+        'manage_drivers': count_queries(app, operator_id, '/operator/drivers/manage'),
+        'driver_details': count_queries(app, operator_id, f'/operator/drivers/{driver_id}/details'),
+        'export_trips': count_queries(app, driver_id, '/driver/export/trip-history'),
+    }
+
+
+def test_batched_routes_have_bounded_query_counts():
+    """Query counts don't grow with the number of vehicles, drivers or trips"""
+    small = queries_for(2)
+    large = queries_for(12)
+    assert small == large, (small, large)
+    assert all(count <= 6 for count in large.values()), large
+
+
+def test_loader_batches_pending_keys_and_memoizes():
+    """want() keys are fetched together on the next load and then served from memory"""
+    fetched = []
+
+    def fetch(keys):
+        fetched.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    loader = batch_loader.BatchLoader('test-numbers', fetch)
+    app = Flask(__name__)
+    with app.test_request_context():
+        loader.want(1, 2, 3)
+        assert loader.load(4) == 40
+        assert fetched == [[1, 2, 3, 4]]
+        assert loader.load_many([1, 2, 3]) == {1: 10, 2: 20, 3: None}
+        assert len(fetched) == 1
+    with app.test_request_context():
+        loader.load(1)  # A new request starts with an empty memo
+        assert fetched[-1] == [1]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the cache subsystem (LRU bounds, TTL, tags, single-flight)
+"""
+import os
+import tempfile
+import threading
+import time
+
+from caching import TTLCache, MemoryBackend, SQLiteBackend, timed_cache
+
+
+def test_lru_eviction_and_stats():
+    """Oldest entries are evicted once the cache is full"""
+    cache = TTLCache('test-lru', ttl=60, backend=MemoryBackend(max_entries=2))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'a' is now most recently used
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+    assert stats['size'] == 2
+
+
+def test_ttl_expiry():
+    """Entries disappear after their TTL"""
+    cache = TTLCache('test-ttl', backend=MemoryBackend())
+    cache.set('k', 'v', ttl=0.05)
+    assert cache.get('k') == 'v'
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_tag_invalidation():
+    """Invalidating a tag drops every entry carrying it"""
+    cache = TTLCache('test-tags', backend=MemoryBackend())
+    cache.set(('driver', 1), 'd1', tags=['vehicle:42'])
+    cache.set(('owner', 1), 'o1', tags=['vehicle:42', 'user:1'])
+    cache.set(('owner', 2), 'o2', tags=['vehicle:7'])
+
+    assert cache.invalidate_tag('vehicle:42') == 2
+    assert cache.get(('driver', 1)) is None
+    assert cache.get(('owner', 1)) is None
+    assert cache.get(('owner', 2)) == 'o2'
+
+
+def test_single_flight_loading():
+    """Concurrent misses for the same key run the loader once"""
+    cache = TTLCache('test-flight', backend=MemoryBackend())
+    calls = []
+    gate = threading.Event()
+
+    def loader():
+        calls.append(1)
+        gate.wait(1)
+        return 'loaded'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == ['loaded'] * 8
+
+
+def test_timed_cache_keys_on_arguments():
+    """The decorator caches per argument set and can invalidate one call"""
+    calls = []
+
+    @timed_cache(seconds=60)
+    def square(x, scale=1):
+        calls.append(x)
+        return x * x * scale
+
+    assert square(3) == 9
+    assert square(3) == 9
+    assert square(3, scale=2) == 18
+    assert len(calls) == 2
+
+    square.invalidate(3)
+    assert square(3) == 9
+    assert len(calls) == 3
+
+
+def test_sqlite_backend_shared_between_instances():
+    """Two caches on the same SQLite file see each other's writes and invalidations"""
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    writer = TTLCache('shared', backend=SQLiteBackend('shared', path=path, max_entries=2))
+    reader = TTLCache('shared', backend=SQLiteBackend('shared', path=path, max_entries=2))
+
+    writer.set(('vehicle', 42), {'owner_id': 1}, tags=['vehicle:42'])
+    assert reader.get(('vehicle', 42)) == {'owner_id': 1}
+
+    reader.invalidate_tag('vehicle:42')
+    assert writer.get(('vehicle', 42)) is None
+
+    writer.set('a', 1)
+    writer.set('b', 2)
+    writer.set('c', 3)
+    assert len(writer.backend) == 2
+    assert writer.stats()['evictions'] == 1
+
+
+def test_load_overtaken_by_invalidation_is_not_stored():
+    """A value loaded before an invalidation is returned but not cached"""
+    cache = TTLCache('test-stale', backend=MemoryBackend())
+    versions = iter(['old', 'new'])
+
+    def loader():
+        value = next(versions)
+        if value == 'old':
+            # The row changes (and the cache is invalidated) while the load is running
+            cache.invalidate_tag('vehicle:42')
+        return value
+
+    assert cache.get_or_load('k', loader, tags=['vehicle:42']) == 'old'
+    assert cache.get('k') is None
+    assert cache.get_or_load('k', loader, tags=['vehicle:42']) == 'new'
+    assert cache.get('k') == 'new'
+    assert cache.stats()['stale_loads'] == 1
+
+
+def test_invalidation_during_store_is_not_lost():
+    """An invalidation racing the store of a finished load still removes the entry"""
+    storing = threading.Event()
+
+    class SlowBackend(MemoryBackend):
+        def set(self, key, value, expires_at, tags=()):
+            storing.set()
+            time.sleep(0.05)
+            return super().set(key, value, expires_at, tags)
+
+    cache = TTLCache('test-store-race', backend=SlowBackend())
+    invalidator = threading.Thread(target=lambda: storing.wait(1) and cache.invalidate('k'))
+    invalidator.start()
+    assert cache.get_or_load('k', lambda: 'old') == 'old'
+    invalidator.join()
+    assert cache.get('k') is None
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test that location fixes only count as seen once they are stored
+"""
+import os
+import tempfile
+from collections import namedtuple
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+import location_dedup
+from models import db
+from models.location_log import LocationLog
+
+Fix = namedtuple('Fix', ['latitude', 'longitude', 'device_ts', 'seq'])
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(location_dedup, 'fixes', location_dedup.FixDeduplicator())
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'dedup.db')}",
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+def store(vehicle_id, latitude, longitude, device_ts, seq, fail=False):
+    # Mirrors the location endpoints: check, then remember after the commit
+    if location_dedup.fixes.check(vehicle_id, latitude, longitude, device_ts, seq) != location_dedup.ACCEPTED:
+        return False
+    # A missing latitude violates NOT NULL, so the commit fails
+    db.session.add(LocationLog(vehicle_id=vehicle_id, latitude=None if fail else latitude, longitude=longitude))
+    location_dedup.remember_after_commit(db.session, vehicle_id, latitude, longitude, device_ts, seq)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise
+    return True
+
+
+def test_fix_whose_commit_failed_is_accepted_on_retry(app):
+    """A failed write doesn't mark the fix as seen; the stored retry does"""
+    with pytest.raises(IntegrityError):
+        store(7, 14.6, 121.0, 1700000000.0, seq=5, fail=True)
+
+    assert store(7, 14.6, 121.0, 1700000000.0, seq=5)
+    assert not store(7, 14.6, 121.0, 1700000000.0, seq=5)
+    assert LocationLog.query.count() == 1
+
+    stats = location_dedup.fixes.stats()
+    assert stats['accepted'] == 1
+    assert stats['duplicates'] == 1
+
+
+def test_batch_is_remembered_only_after_commit(app):
+    """Batches skip copies within themselves and are recorded once committed"""
+    batch = [Fix(14.6, 121.0, 1700000000.0, 1), Fix(14.6, 121.0, 1700000000.0, 1),
+             Fix(14.7, 121.0, 1700000010.0, 2)]
+    new, suppressed = location_dedup.filter_new(7, batch)
+    assert (len(new), suppressed) == (2, 1)
+
+    location_dedup.remember_batch_after_commit(db.session, 7, new)
+    db.session.rollback()
+    assert location_dedup.filter_new(7, new) == (new, 0)
+
+    location_dedup.remember_batch_after_commit(db.session, 7, new)
+    db.session.commit()
+    assert location_dedup.filter_new(7, new) == ([], 2)
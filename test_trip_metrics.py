@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Test the per-trip accumulator: moving/idle legs and GPS jump rejection
+"""
+from datetime import datetime, timedelta
+
+from trip_metrics import TripAccumulator
+
+START = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def make_accumulator(onboard=0):
+    return TripAccumulator(1, 1, 1, 1, 'A → B', START, onboard=onboard)
+
+
+def test_moving_and_idle_legs():
+    """Legs above the moving threshold add distance, slower ones add idle time"""
+    accumulator = make_accumulator(onboard=2)
+    accumulator.add_fix(14.6000, 121.0000, START)
+    accumulator.add_fix(14.6010, 121.0000, START + timedelta(seconds=10))  # ~111 m, ~40 km/h
+    accumulator.add_fix(14.6010, 121.0000, START + timedelta(seconds=40))  # parked
+
+    assert 100 < accumulator.distance_m < 120
+    assert accumulator.moving_seconds == 10
+    assert accumulator.idle_seconds == 30
+    assert round(accumulator.passenger_km, 3) == round(2 * accumulator.distance_m / 1000.0, 3)
+    assert accumulator.fixes == 3
+
+
+def test_gps_jump_is_dropped():
+    """A fix implying more than MAX_SPEED_KMH is ignored and the next leg starts from the last good fix"""
+    accumulator = make_accumulator()
+    accumulator.add_fix(14.6000, 121.0000, START)
+    accumulator.add_fix(14.7000, 121.0000, START + timedelta(seconds=10))  # ~11 km in 10 s
+    accumulator.add_fix(14.6010, 121.0000, START + timedelta(seconds=20))  # ~111 m from the first fix
+
+    assert 100 < accumulator.distance_m < 120
+    assert accumulator.moving_seconds == 20
+    assert accumulator.fixes == 2
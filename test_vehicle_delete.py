@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test that a vehicle with trip history can be deleted with foreign keys enforced
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask_login import LoginManager
+from sqlalchemy import event
+
+from models import db
+from models.ridership import RidershipRollup, TripPassengerTotal
+from models.stop import Stop, StopVisit
+from models.trip_metrics import TripMetrics
+from models.user import User, Trip, PassengerEvent
+from models.vehicle import Vehicle
+import geofences
+import ridership
+import trip_metrics  # noqa: F401  registers the flush listener that writes TripMetrics
+
+
+def make_app(path):
+    from routes.operator import operator_bp
+
+    app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                      SECRET_KEY='test', TESTING=True)
+    db.init_app(app)
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.user_loader(lambda user_id: User.query.get(int(user_id)))
+    app.register_blueprint(operator_bp, url_prefix='/operator')
+    with app.app_context():
+        # SQLite only checks foreign keys when asked to, like Postgres always does
+        event.listen(db.engine, 'connect', lambda connection, record: connection.execute('PRAGMA foreign_keys=ON'))
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def app():
+    return make_app(os.path.join(tempfile.mkdtemp(), 'delete.db'))
+
+
+def seed(app):
+    """An operator with one unassigned vehicle that has a completed trip with passengers and a stop visit."""
+    with app.app_context():
+        operator = User(username='op', email='op@test', user_type='operator')
+        operator.set_password('x')
+        driver = User(username='driver', email='driver@test', user_type='driver')
+        driver.set_password('x')
+        db.session.add_all([operator, driver])
+        db.session.flush()
+        vehicle = Vehicle(registration_number='V1', vehicle_type='jeepney', capacity=15, owner_id=operator.id,
+                          status='inactive')
+        db.session.add(vehicle)
+        db.session.flush()
+        trip = Trip(vehicle_id=vehicle.id, driver_id=driver.id, route_name='A → B',
+                    start_time=datetime.utcnow() - timedelta(hours=1), status='active')
+        db.session.add(trip)
+        db.session.flush()
+        db.session.add(PassengerEvent(trip_id=trip.id, event_type='board', count=3))
+        stop = Stop(name='Terminal', latitude=14.6, longitude=121.0)
+        db.session.add(stop)
+        db.session.flush()
+        db.session.add(StopVisit(stop_id=stop.id, vehicle_id=vehicle.id, arrived_at=trip.start_time,
+                                 departed_at=trip.start_time + timedelta(minutes=2), dwell_seconds=120))
+        db.session.commit()
+        trip.status = 'completed'
+        trip.end_time = datetime.utcnow()
+        db.session.commit()
+        return operator.id, driver.id, vehicle.id
+
+
+def delete(app, operator_id, vehicle_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(operator_id)
+        session['_fresh'] = True
+    return client.post(f'/operator/vehicle/{vehicle_id}/delete')
+
+
+def test_delete_vehicle_with_trip_history(app):
+    """The vehicle, its trips and everything derived from them are removed"""
+    operator_id, driver_id, vehicle_id = seed(app)
+    with app.app_context():
+        assert TripPassengerTotal.query.count() == 1
+        assert TripMetrics.query.count() == 1
+        assert ridership.totals('total', datetime.utcnow(), driver_id=driver_id)['trips_completed'] == 1
+
+    response = delete(app, operator_id, vehicle_id)
+    assert response.status_code == 200, response.data[:300]
+
+    with app.app_context():
+        assert Vehicle.query.get(vehicle_id) is None
+        assert Trip.query.count() == 0
+        assert TripPassengerTotal.query.count() == 0
+        assert TripMetrics.query.count() == 0
+        assert StopVisit.query.count() == 0
+        assert RidershipRollup.query.filter_by(vehicle_id=vehicle_id).count() == 0
+        assert ridership.totals('total', datetime.utcnow(), driver_id=driver_id)['trips_completed'] == 0
+
+
+def test_queued_visits_of_deleted_vehicles_are_not_written(app):
+    """A visit queued for a vehicle deleted before the writer runs doesn't sink the batch"""
+    operator_id, driver_id, vehicle_id = seed(app)
+    with app.app_context():
+        stop_id = Stop.query.first().id
+        other = Vehicle(registration_number='V2', vehicle_type='jeepney', capacity=15, owner_id=operator_id)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+
+    writer = geofences.VisitWriter()
+    now = datetime.utcnow()
+    for queued_vehicle in (vehicle_id, other_id):
+        writer.add({'stop_id': stop_id, 'vehicle_id': queued_vehicle, 'route': None,
+                    'arrived_at': now, 'departed_at': now, 'dwell_seconds': 0.0})
+
+    geofences.visit_writer.add({'stop_id': stop_id, 'vehicle_id': vehicle_id, 'route': None,
+                                'arrived_at': now, 'departed_at': now, 'dwell_seconds': 0.0})
+
+    assert delete(app, operator_id, vehicle_id).status_code == 200
+    assert all(row['vehicle_id'] != vehicle_id for row in geofences.visit_writer._pending)
+    with app.app_context():
+        assert writer.flush() == 1
+        assert [visit.vehicle_id for visit in StopVisit.query.all()] == [other_id]
@@ -0,0 +1,319 @@
+"""
+Running per-trip distance, moving/idle time and passenger-km
+
+Every active trip has an accumulator fed from the location stream (a flush
+listener on vehicle position changes, like headways and geofences, plus the
+intermediate fixes of batch uploads). Each fix adds one leg: legs faster
+than MIN_MOVING_KMH count as moving time and distance (and distance times
+the passengers on board as passenger-km), slower ones as idle time, so GPS
+jitter while parked doesn't add distance. Gaps longer than MAX_LEG_SECONDS
+(signal loss, app closed) aren't counted either way. A fix that would need
+a leg faster than MAX_SPEED_KMH (the same sanity limit the location
+endpoints use) is a GPS jump and is dropped; the next leg starts from the
+last good fix.
+
+Boardings and alightings keep the on-board count current. When the trip
+ends the accumulator is written as a TripMetrics row in the same
+transaction, and the analytics endpoints only ever read those rows plus
+the live accumulators; raw LocationLog fixes are never rescanned.
+
+Accumulators live in memory. After a restart an active trip's accumulator
+starts again from its next fix, so a trip in progress during a restart
+under-reports the legs before it.
+"""
+import logging
+import math
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from commit_hooks import after_commit
+from models import db
+from models.ridership import TripPassengerTotal
+from models.trip_metrics import TripMetrics
+from models.user import PassengerEvent, Trip
+from models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+MIN_MOVING_KMH = 3.0
+MAX_LEG_SECONDS = 300.0
+MAX_SPEED_KMH = 120.0
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance; accurate to well under a metre for one leg."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class TripAccumulator:
+    """Running totals for one active trip."""
+
+    __slots__ = ('trip_id', 'operator_id', 'vehicle_id', 'driver_id', 'route', 'started_at', 'onboard',
+                 'distance_m', 'moving_seconds', 'idle_seconds', 'passenger_km', 'fixes', '_last')
+
+    def __init__(self, trip_id, operator_id, vehicle_id, driver_id, route, started_at, onboard=0):
+        self.trip_id = trip_id
+        self.operator_id = operator_id or 0
+        self.vehicle_id = vehicle_id
+        self.driver_id = driver_id
+        self.route = route
+        self.started_at = started_at
+        self.onboard = max(0, onboard)
+        self.distance_m = 0.0
+        self.moving_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.passenger_km = 0.0
+        self.fixes = 0
+        self._last = None  # (lat, lon, when)
+
+    def add_fix(self, lat, lon, when):
+        if when < self.started_at:
+            return  # Replayed from before the trip
+        last = self._last
+        if last is not None:
+            seconds = (when - last[2]).total_seconds()
+            if seconds <= 0:
+                return  # Out of order; the leg was already counted
+            meters = _distance_m(last[0], last[1], lat, lon)
+            speed_kmh = meters / seconds * 3.6
+            if speed_kmh > MAX_SPEED_KMH:
+                return  # GPS jump; keep measuring from the last good fix
+            if seconds <= MAX_LEG_SECONDS:
+                if speed_kmh >= MIN_MOVING_KMH:
+                    self.moving_seconds += seconds
+                    self.distance_m += meters
+                    self.passenger_km += self.onboard * meters / 1000.0
+                else:
+                    self.idle_seconds += seconds
+        self._last = (lat, lon, when)
+        self.fixes += 1
+
+    def row(self, ended_at):
+        return {
+            'trip_id': self.trip_id,
+            'operator_id': self.operator_id,
+            'vehicle_id': self.vehicle_id,
+            'driver_id': self.driver_id,
+            'route': self.route,
+            'day': self.started_at.date(),
+            'started_at': self.started_at,
+            'ended_at': ended_at,
+            'distance_m': self.distance_m,
+            'moving_seconds': self.moving_seconds,
+            'idle_seconds': self.idle_seconds,
+            'passenger_km': self.passenger_km,
+            'fixes': self.fixes
+        }
+
+
+class TripMetricsTracker:
+    """Accumulators for every active trip, by vehicle and by trip."""
+
+    def __init__(self):
+        self._by_vehicle = {}
+        self._by_trip = {}
+        self._without_trip = set()  # Vehicles known to have no active trip
+        self._lock = threading.Lock()
+
+    def start(self, accumulator):
+        with self._lock:
+            self._drop(self._by_vehicle.get(accumulator.vehicle_id))
+            self._by_vehicle[accumulator.vehicle_id] = accumulator
+            self._by_trip[accumulator.trip_id] = accumulator
+            self._without_trip.discard(accumulator.vehicle_id)
+
+    def finish(self, trip_id):
+        with self._lock:
+            self._drop(self._by_trip.get(trip_id))
+
+    def _drop(self, accumulator):
+        # Caller holds the lock
+        if accumulator is not None:
+            self._by_trip.pop(accumulator.trip_id, None)
+            if self._by_vehicle.get(accumulator.vehicle_id) is accumulator:
+                del self._by_vehicle[accumulator.vehicle_id]
+
+    def forget_vehicle(self, vehicle_id):
+        with self._lock:
+            self._drop(self._by_vehicle.get(vehicle_id))
+            self._without_trip.discard(vehicle_id)
+
+    def for_trip(self, trip_id):
+        return self._by_trip.get(trip_id)
+
+    def observe(self, vehicle_id, lat, lon, when):
+        if lat is None or lon is None or when is None:
+            return
+        accumulator = self._by_vehicle.get(vehicle_id)
+        if accumulator is None:
+            if vehicle_id in self._without_trip:
+                return
+            accumulator = _load_active_trip(vehicle_id)
+            if accumulator is None:
+                with self._lock:
+                    self._without_trip.add(vehicle_id)
+                return
+            self.start(accumulator)
+        with self._lock:
+            accumulator.add_fix(lat, lon, when)
+
+    def passengers(self, trip_id, delta):
+        with self._lock:
+            accumulator = self._by_trip.get(trip_id)
+            if accumulator is not None:
+                accumulator.onboard = max(0, accumulator.onboard + delta)
+
+    def live(self, vehicle_ids=None):
+        """Rows for the trips still in progress (optionally only some vehicles)."""
+        now = datetime.utcnow()
+        with self._lock:
+            return [accumulator.row(now) for accumulator in self._by_vehicle.values()
+                    if vehicle_ids is None or accumulator.vehicle_id in vehicle_ids]
+
+
+tracker = TripMetricsTracker()
+
+
+def _load_active_trip(vehicle_id):
+    """Accumulator for the vehicle's active trip, read through its own connection, or None.
+
+    Only used for trips started before this process (after a restart).
+    """
+    from flask import has_app_context
+    if not has_app_context():
+        return None
+    trips, vehicles, totals = Trip.__table__, Vehicle.__table__, TripPassengerTotal.__table__
+    with db.engine.connect() as connection:
+        row = connection.execute(
+            select(trips.c.id, vehicles.c.owner_id, trips.c.vehicle_id, trips.c.driver_id, trips.c.route_name,
+                   trips.c.start_time, totals.c.boards, totals.c.alights)
+            .select_from(trips.join(vehicles, vehicles.c.id == trips.c.vehicle_id)
+                         .outerjoin(totals, totals.c.trip_id == trips.c.id))
+            .where(trips.c.vehicle_id == vehicle_id, trips.c.status == 'active')
+            .order_by(trips.c.start_time.desc())
+            .limit(1)
+        ).first()
+    if row is None:
+        return None
+    return TripAccumulator(row[0], row[1], row[2], row[3], row[4], row[5], (row[6] or 0) - (row[7] or 0))
+
+
+def observe_fixes(vehicle_id, fixes):
+    """Feed (lat, lon, timestamp) fixes, oldest first."""
+    for lat, lon, when in fixes:
+        tracker.observe(vehicle_id, lat, lon, when)
+
+
+def remove_vehicle(vehicle_id):
+    """Delete a vehicle's TripMetrics rows before its trips are deleted in bulk.
+
+    Runs in the caller's transaction; the vehicle's accumulator is dropped once it commits.
+    """
+    TripMetrics.query.filter_by(vehicle_id=vehicle_id).delete(synchronize_session=False)
+    after_commit(db.session, tracker.forget_vehicle, vehicle_id)
+
+
+def summarize(rows):
+    """Fold TripMetrics-shaped rows into per-(vehicle, day) analytics, newest day first."""
+    days = {}
+    for row in rows:
+        key = (row['vehicle_id'], row['day'])
+        total = days.setdefault(key, {'trips': 0, 'distance_m': 0.0, 'moving_seconds': 0.0, 'idle_seconds': 0.0,
+                                      'passenger_km': 0.0, 'revenue_seconds': 0.0})
+        total['trips'] += 1
+        total['revenue_seconds'] += max(0.0, (row['ended_at'] - row['started_at']).total_seconds())
+        for name in ('distance_m', 'moving_seconds', 'idle_seconds', 'passenger_km'):
+            total[name] += row[name]
+    result = []
+    for (vehicle_id, day), total in sorted(days.items(), key=lambda item: (item[0][1], item[0][0]), reverse=True):
+        moving = total['moving_seconds']
+        result.append({
+            'vehicle_id': vehicle_id,
+            'day': day.isoformat(),
+            'trips': total['trips'],
+            'distance_km': round(total['distance_m'] / 1000.0, 2),
+            'moving_hours': round(moving / 3600.0, 2),
+            'idle_hours': round(total['idle_seconds'] / 3600.0, 2),
+            'revenue_hours': round(total['revenue_seconds'] / 3600.0, 2),
+            'utilization': round(moving / total['revenue_seconds'], 3) if total['revenue_seconds'] else None,
+            'average_speed_kmh': round(total['distance_m'] / moving * 3.6, 1) if moving else None,
+            'passenger_km': round(total['passenger_km'], 2)
+        })
+    return result
+
+
+def stored_rows(start_day, operator_id=None, vehicle_id=None):
+    """TripMetrics rows for trips that started on or after start_day, as dicts."""
+    query = TripMetrics.query.filter(TripMetrics.day >= start_day)
+    if operator_id is not None:
+        query = query.filter(TripMetrics.operator_id == operator_id)
+    if vehicle_id is not None:
+        query = query.filter(TripMetrics.vehicle_id == vehicle_id)
+    columns = TripMetrics.__table__.columns.keys()
+    return [{name: getattr(metrics, name) for name in columns} for metrics in query.all()]
+
+
+def _apply(positions, passengers, started, finished):
+    for accumulator in started:
+        tracker.start(accumulator)
+    for trip_id, delta in passengers:
+        tracker.passengers(trip_id, delta)
+    for vehicle_id, lat, lon, when in positions:
+        tracker.observe(vehicle_id, lat, lon, when)
+    for trip_id in finished:
+        tracker.finish(trip_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_trips(session, flush_context):
+    positions, passengers, started, ending = [], [], [], []
+    for obj in session.new:
+        if isinstance(obj, PassengerEvent):
+            passengers.append((obj.trip_id, obj.count if obj.event_type == 'board' else -obj.count))
+        elif isinstance(obj, Trip) and obj.status == 'active':
+            started.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Vehicle):
+            attrs = inspect(obj).attrs
+            if attrs.current_latitude.history.has_changes() or attrs.current_longitude.history.has_changes():
+                positions.append((obj.id, obj.current_latitude, obj.current_longitude,
+                                  obj.last_updated or datetime.utcnow()))
+        elif isinstance(obj, Trip):
+            history = inspect(obj).attrs.status.history
+            if history.deleted and history.deleted[0] == 'active' and obj.status != 'active':
+                ending.append(obj)
+    if not (positions or passengers or started or ending):
+        return
+
+    accumulators = []
+    if started:
+        owners = dict(session.connection().execute(
+            select(Vehicle.__table__.c.id, Vehicle.__table__.c.owner_id)
+            .where(Vehicle.__table__.c.id.in_({trip.vehicle_id for trip in started}))
+        ).fetchall())
+        accumulators = [TripAccumulator(trip.id, owners.get(trip.vehicle_id), trip.vehicle_id, trip.driver_id,
+                                        trip.route_name, trip.start_time or datetime.utcnow())
+                        for trip in started]
+
+    # Ending trips are written now, so the metrics commit (or roll back) with the trip
+    finished = []
+    for trip in ending:
+        accumulator = tracker.for_trip(trip.id) or TripAccumulator(
+            trip.id, None, trip.vehicle_id, trip.driver_id, trip.route_name, trip.start_time)
+        table = TripMetrics.__table__
+        connection = session.connection()
+        connection.execute(table.delete().where(table.c.trip_id == trip.id))
+        if accumulator.operator_id == 0:
+            accumulator.operator_id = connection.execute(
+                select(Vehicle.__table__.c.owner_id).where(Vehicle.__table__.c.id == trip.vehicle_id)
+            ).scalar() or 0
+        connection.execute(table.insert().values(**accumulator.row(trip.end_time or datetime.utcnow())))
+        finished.append(trip.id)
+
+    after_commit(session, _apply, positions, passengers, accumulators, finished)
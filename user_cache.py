@@ -0,0 +1,148 @@
+"""
+Cached session users for Flask-Login
+
+The user loader runs on every authenticated request and Socket.IO event.
+Instead of querying the users table each time it returns a CachedUser built
+from a small immutable Principal kept in the cache subsystem. Identity and
+role checks (id, username, user_type, is_active) never touch the database; the full User row is loaded lazily the first time a handler needs
+any other field, and at most once per request.
+
+Cached principals stay coherent on their own: a flush listener notices users
+whose username, role or status changed (or who were deleted) and drops their
+entries once the transaction commits. Vehicle assignments aren't part of
+the principal; drivers' access to vehicles is checked through vehicle_access.
+"""
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from caching import get_cache
+from commit_hooks import after_commit
+from models.user import User
+
+# Immutable snapshot of what authorization checks need
+Principal = namedtuple('Principal', ['id', 'username', 'user_type', 'is_active'])
+
+PRINCIPAL_TTL = 300
+
+_principals = get_cache('user-principals', ttl=PRINCIPAL_TTL, max_entries=4096)
+
+
+class _UserMissing(Exception):
+    pass
+
+
+def build_principal(user):
+    """Build the cached principal for a User row."""
+    return Principal(user.id, user.username, user.user_type, bool(user.is_active))
+
+
+class CachedUser:
+    """Stand-in for current_user that answers identity checks from a Principal.
+
+    Attribute reads outside the principal, method calls and attribute writes
+    are forwarded to the real User row, which is loaded on first use.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, principal, user=None):
+        object.__setattr__(self, '_principal', principal)
+        object.__setattr__(self, '_user', user)
+
+    def get_id(self):
+        return str(self._principal.id)
+
+    def get_user(self):
+        """Return the full User row (for session.delete and other ORM calls)."""
+        if self._user is None:
+            object.__setattr__(self, '_user', User.query.get(self._principal.id))
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        # Once the row is loaded it is read instead, so writes made during the request are visible
+        if self._user is None and name in Principal._fields:
+            return getattr(self._principal, name)
+        return getattr(self.get_user(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_user(), name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, CachedUser):
+            return self._principal.id == other._principal.id
+        if isinstance(other, User):
+            return self._principal.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(('user', self._principal.id))
+
+    def __repr__(self):
+        return f"<CachedUser {self._principal.id} {self._principal.user_type}>"
+
+
+def load_cached_user(user_id):
+    """Flask-Login user loader backed by the principal cache."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    loaded = {}
+
+    def loader():
+        user = User.query.get(user_id)
+        if user is None:
+            # Don't cache misses; the id may belong to a user created later
+            raise _UserMissing(user_id)
+        loaded['user'] = user
+        return build_principal(user)
+
+    try:
+        principal = _principals.get_or_load(user_id, loader, tags=[f"user:{user_id}"])
+    except _UserMissing:
+        return None
+
+    # On a miss we already have the row, so keep it for this request
+    return CachedUser(principal, loaded.get('user'))
+
+
+def get_principal(user_id):
+    """Return the cached principal for any user id, or None if the user doesn't exist."""
+    cached = load_cached_user(user_id)
+    return cached._principal if cached is not None else None
+
+
+def invalidate_user(*user_ids):
+    """Drop cached principals so the next request reloads them."""
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        try:
+            _principals.invalidate(int(user_id))
+        except (TypeError, ValueError):
+            continue
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    user_ids = set()
+
+    for obj in session.dirty:
+        if not isinstance(obj, User):
+            continue
+        attrs = inspect(obj).attrs
+        if any(attrs[name].history.has_changes() for name in Principal._fields):
+            user_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+
+    if user_ids:
+        after_commit(session, invalidate_user, *user_ids)
@@ -0,0 +1,85 @@
+"""
+Vehicle ownership/assignment map for permission checks
+
+Most driver and operator endpoints only need (owner_id, assigned_driver_id)
+to decide whether current_user may touch a vehicle. Those pairs are kept in
+the cache subsystem so the check costs no query; routes load the full
+Vehicle row only after the check passes and only if they actually use it.
+
+The map stays coherent on its own: a flush listener notices vehicles whose
+owner or driver changed (assign, unassign, delete) and drops their entries
+once the transaction commits.
+"""
+from collections import namedtuple
+
+from flask import abort
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from caching import get_cache
+from commit_hooks import after_commit
+from models import db
+from models.vehicle import Vehicle
+
+VehicleAccess = namedtuple('VehicleAccess', ['owner_id', 'driver_id'])
+
+ACCESS_TTL = 60
+
+_access = get_cache('vehicle-access', ttl=ACCESS_TTL, max_entries=8192)
+
+
+class _VehicleMissing(Exception):
+    pass
+
+
+def get_vehicle_access(vehicle_id):
+    """Return VehicleAccess(owner_id, driver_id) for a vehicle, or None if it doesn't exist."""
+    try:
+        vehicle_id = int(vehicle_id)
+    except (TypeError, ValueError):
+        return None
+
+    def loader():
+        row = db.session.query(Vehicle.owner_id, Vehicle.assigned_driver_id)\
+            .filter(Vehicle.id == vehicle_id).first()
+        if row is None:
+            # Don't cache misses; the vehicle may be created later
+            raise _VehicleMissing(vehicle_id)
+        return VehicleAccess(row[0], row[1])
+
+    try:
+        return _access.get_or_load(vehicle_id, loader, tags=[f"vehicle:{vehicle_id}"])
+    except _VehicleMissing:
+        return None
+
+
+def vehicle_access_or_404(vehicle_id):
+    """Like Vehicle.query.get_or_404 but only for the ownership/assignment pair."""
+    access = get_vehicle_access(vehicle_id)
+    if access is None:
+        abort(404)
+    return access
+
+
+def invalidate_vehicle(*vehicle_ids):
+    for vehicle_id in vehicle_ids:
+        _access.invalidate_tag(f"vehicle:{vehicle_id}")
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_access_changes(session, flush_context):
+    vehicle_ids = set()
+
+    for obj in session.dirty:
+        if not isinstance(obj, Vehicle):
+            continue
+        attrs = inspect(obj).attrs
+        if attrs.assigned_driver_id.history.has_changes() or attrs.owner_id.history.has_changes():
+            vehicle_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Vehicle):
+            vehicle_ids.add(obj.id)
+
+    if vehicle_ids:
+        after_commit(session, invalidate_vehicle, *vehicle_ids)
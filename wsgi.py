@@ -1,3 +1,7 @@
+# Evented modes must patch the standard library before anything else is imported
+import async_server
+async_server.monkey_patch()
+
 import os
 import logging
 